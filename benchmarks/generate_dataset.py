@@ -0,0 +1,128 @@
+import os
+import argparse
+import numpy as np
+
+# Rough MovieLens shapes: users, items, interactions.
+scales = {
+    "tiny": (200, 300, 6000),
+    "ml-100k": (943, 1682, 100000),
+    "ml-1m": (6040, 3706, 1000209),
+    "ml-10m": (69878, 10677, 10000054),
+    "ml-20m": (138493, 26744, 20000263),
+}
+# Power-law exponents for item popularity and user activity; MovieLens fits are around these values.
+item_popularity_exponent = 0.8
+user_activity_exponent = 0.75
+min_user_interactions = 20
+start_timestamp = 874724710
+timestamp_span = 3 * 365 * 24 * 3600
+write_chunk = 500000
+
+occupations = ["administrator", "artist", "doctor", "educator", "engineer", "entertainment", "executive",
+               "healthcare", "homemaker", "lawyer", "librarian", "marketing", "none", "other", "programmer",
+               "retired", "salesman", "scientist", "student", "technician", "writer"]
+genres = ["Action", "Adventure", "Animation", "Children's", "Comedy", "Crime", "Documentary", "Drama", "Fantasy",
+          "Film-Noir", "Horror", "Musical", "Mystery", "Romance", "Sci-Fi", "Thriller", "War", "Western"]
+
+def zipf_weights(n, exponent, rng):
+    # Popularity by rank, shuffled so ids carry no information about popularity.
+    weights = 1.0 / np.arange(1, n + 1) ** exponent
+    rng.shuffle(weights)
+    return weights / weights.sum()
+
+def user_degrees(users, items, interactions, rng):
+    # Skewed activity with a floor of min_user_interactions. No user can exceed the item count,
+    # so whatever the cap removes is handed back to the remaining users in proportion to their weight.
+    floor = min(min_user_interactions, items, max(interactions // users, 1))
+    weights = zipf_weights(users, user_activity_exponent, rng)
+    degrees = np.full(users, floor, dtype=np.int64)
+    for _ in range(20):
+        remaining = min(interactions, users * items) - degrees.sum()
+        open_users = degrees < items
+        if remaining <= 0 or not open_users.any():
+            break
+        share = weights * open_users
+        degrees = np.minimum(degrees + np.floor(share / share.sum() * remaining).astype(np.int64), items)
+    remaining = min(interactions, users * items) - degrees.sum()
+    open_users = np.flatnonzero(degrees < items)
+    degrees[open_users[:max(remaining, 0)]] += 1
+    return degrees
+
+def sample_interactions(users, items, interactions, rng, rounds=8):
+    # Items are drawn by popularity; duplicates within a user are dropped and redrawn. Heavy users
+    # run out of popular items, so the last rounds draw uniformly to fill them up.
+    degrees = user_degrees(users, items, interactions, rng)
+    popularity = zipf_weights(items, item_popularity_exponent, rng)
+    pairs = np.empty(0, dtype=np.int64)
+    missing = degrees
+    for round_idx in range(rounds):
+        user_codes = np.repeat(np.arange(users, dtype=np.int64), missing)
+        if not len(user_codes):
+            break
+        item_codes = rng.choice(items, size=len(user_codes), p=popularity if round_idx < rounds // 2 else None)
+        pairs = np.union1d(pairs, user_codes * items + item_codes)
+        missing = np.maximum(degrees - np.bincount(pairs // items, minlength=users), 0)
+    # Users that received more than their degree keep a random subset.
+    pairs = pairs[rng.permutation(len(pairs))]
+    pairs = pairs[np.argsort(pairs // items, kind="stable")]
+    user_codes = pairs // items
+    starts = np.concatenate(([0], np.cumsum(np.bincount(user_codes, minlength=users))[:-1]))
+    keep = np.arange(len(pairs)) - starts[user_codes] < degrees[user_codes]
+    pairs = pairs[keep][rng.permutation(int(keep.sum()))]
+    return pairs // items, pairs % items
+
+def write_rows(path, header, columns):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\t".join(header) + "\n")
+        for start in range(0, len(columns[0]), write_chunk):
+            rows = zip(*(column[start:start + write_chunk] for column in columns))
+            f.write("".join("\t".join(row) + "\n" for row in rows))
+
+def generate(output_dir, name, users, items, interactions, seed=42):
+    # Writes <output_dir>/<name>/<name>.{user,item,inter} in RecBole atomic file format.
+    rng = np.random.default_rng(seed)
+    dataset_dir = os.path.join(output_dir, name)
+    os.makedirs(dataset_dir, exist_ok=True)
+
+    user_ids = np.arange(1, users + 1).astype(str)
+    write_rows(os.path.join(dataset_dir, name + ".user"),
+               ["user_id:token", "age:token", "gender:token", "occupation:token"],
+               [user_ids,
+                np.clip(rng.normal(33, 12, users), 7, 80).astype(int).astype(str),
+                rng.choice(["M", "F"], size=users, p=[0.7, 0.3]),
+                rng.choice(occupations, size=users)])
+
+    item_ids = np.arange(1, items + 1).astype(str)
+    write_rows(os.path.join(dataset_dir, name + ".item"),
+               ["item_id:token", "movie_title:token_seq", "release_year:token", "class:token_seq"],
+               [item_ids,
+                np.char.add("Movie ", item_ids),
+                rng.integers(1920, 2020, items).astype(str),
+                rng.choice(genres, size=items)])
+
+    user_codes, item_codes = sample_interactions(users, items, interactions, rng)
+    timestamps = start_timestamp + np.sort(rng.integers(0, timestamp_span, len(user_codes)))
+    ratings = rng.choice([1, 2, 3, 4, 5], size=len(user_codes), p=[0.06, 0.11, 0.27, 0.34, 0.22])
+    write_rows(os.path.join(dataset_dir, name + ".inter"),
+               ["user_id:token", "item_id:token", "rating:float", "timestamp:float"],
+               [user_ids[user_codes], item_ids[item_codes], ratings.astype(str), timestamps.astype(str)])
+    return {"name": name, "users": users, "items": items, "interactions": int(len(user_codes)), "seed": seed,
+            "path": dataset_dir}
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic RecBole-format dataset with skewed degrees.")
+    parser.add_argument("output_dir")
+    parser.add_argument("--scale", choices=sorted(scales), default="ml-100k")
+    parser.add_argument("--users", type=int, help="overrides the user count of --scale")
+    parser.add_argument("--items", type=int, help="overrides the item count of --scale")
+    parser.add_argument("--interactions", type=int, help="overrides the interaction count of --scale")
+    parser.add_argument("--name", help="dataset directory name, defaults to the scale")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    users, items, interactions = scales[args.scale]
+    info = generate(args.output_dir, args.name or args.scale, args.users or users, args.items or items,
+                    args.interactions or interactions, args.seed)
+    print("GENERATED", info)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import numpy as np
+import networkx as nx
+from recvizapi.Dataset import Dataset
+from recvizapi.Graph import Graph
+from recvizapi.SimilarityService import SimilarityService, batch_metrics
+from recvizapi.Metrics import resident_bytes
+from benchmarks.generate_dataset import scales, generate
+
+stage_groups = ["dataset", "graph", "louvain", "similarity"]
+# Force-directed layout is quadratic per iteration; larger graphs skip it (and the GEXF it feeds) by default.
+layout_node_limit = 3000
+pair_count = 10000
+suite_pair_count = 1000
+cohort_size = 1000
+query_count = 100
+regression_threshold = 1.2
+# Stages that got slower by less than this are timer noise, whatever the ratio.
+regression_min_seconds = 0.05
+
+class MemorySampler:
+    # Polls the resident set size in a thread; numpy and scipy release the GIL in their heavy
+    # loops and pure Python stages yield every switch interval, so short peaks are still seen.
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.baseline = 0
+        self.peak = 0
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def sample(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, resident_bytes())
+
+    def __enter__(self):
+        self.baseline = resident_bytes()
+        self.peak = self.baseline
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+        self.peak = max(self.peak, resident_bytes())
+
+class LoadedDataset:
+    # Stands in for DatasetManager so only the benchmarked dataset is loaded.
+    def __init__(self, ds_obj):
+        self.ds_obj = ds_obj
+
+    def get_dataset(self, dataset_name):
+        return {"dataset_obj": self.ds_obj, "models": self.ds_obj.get_models()}
+
+def measure(results, stage, function, *args, **details):
+    with MemorySampler() as memory:
+        start = time.perf_counter()
+        value = function(*args)
+        seconds = time.perf_counter() - start
+    results.append({"stage": stage, "seconds": seconds, "peak_rss_bytes": memory.peak,
+                    "peak_rss_delta_bytes": memory.peak - memory.baseline, **details})
+    print(f"{stage:36s} {seconds:10.3f}s  peak +{(memory.peak - memory.baseline) / 2 ** 20:9.1f} MiB", flush=True)
+    return value
+
+def skip(results, stage, reason):
+    results.append({"stage": stage, "skipped": reason})
+    print(f"{stage:36s} skipped: {reason}", flush=True)
+
+def load_dataset(dataset_dir):
+    name = os.path.basename(os.path.normpath(dataset_dir))
+    files = os.listdir(dataset_dir)
+    return Dataset(dataset_dir,
+                   [file for file in files if file.endswith(".inter")],
+                   [file for file in files if file.endswith(".user")],
+                   [file for file in files if file.endswith(".item")],
+                   name, {})
+
+def run_graph(results, manager, name, cache_dir, layout_limit):
+    graph = Graph(name, None, cache_dir, name, manager, build=False)
+    measure(results, "graph_prepare_nodes", graph.prepare_nodes)
+    measure(results, "graph_assemble", graph.assemble_graph)
+    nodes = graph.nx_graph.number_of_nodes()
+    if nodes > layout_limit:
+        skip(results, "graph_layout", f"{nodes} nodes is above the layout limit of {layout_limit}")
+        skip(results, "graph_write_gexf", "needs the layout")
+    else:
+        measure(results, "graph_layout", graph.layout_graph)
+        measure(results, "graph_write_gexf", graph.write_gexf)
+    return graph
+
+def run_similarity(results, manager, name, cache_dir, rng):
+    service = SimilarityService(manager, cache_dir)
+    matrices = measure(results, "similarity_matrices", service.get_matrices, name)
+    user_ids = np.asarray(matrices["user_ids"])
+    pairs = rng.choice(user_ids, size=(pair_count, 2)).tolist()
+    for metric in batch_metrics:
+        measure(results, f"similarity_batch_{metric}", service.batch_similarity, name, metric, pairs,
+                pairs=pair_count)
+    queries = rng.choice(user_ids, size=min(query_count, len(user_ids)), replace=False).tolist()
+    measure(results, "similarity_one_vs_all", lambda: [service.one_vs_all(name, "jaccard", uid) for uid in queries[:10]],
+            queries=min(10, len(queries)))
+    cohort = rng.choice(user_ids, size=min(cohort_size, len(user_ids)), replace=False).tolist()
+    measure(results, "similarity_cohort", service.cohort_similarity, name, "jaccard", cohort, users=len(cohort))
+
+    # The per-pair list metrics the user comparison view computes from interaction histories.
+    histories = {uid: [elt["item_id"] for elt in manager.ds_obj.get_user_history(uid)]
+                 for pair in pairs[:suite_pair_count] for uid in pair}
+    measure(results, "similarity_metric_suite",
+            lambda: [service.metric_suite(histories[uid1], histories[uid2]) for uid1, uid2 in pairs[:suite_pair_count]],
+            pairs=suite_pair_count)
+
+    measure(results, "neighbour_index_build", service.get_neighbour_index, name)
+    measure(results, "similarity_neighbours", lambda: [service.most_similar_users(name, uid, 10) for uid in queries],
+            queries=len(queries))
+    measure(results, "random_walk_index_build", service.build_random_walk_index, name)
+    measure(results, "similarity_random_walk",
+            lambda: [service.random_walk_similarity(name, uid1, uid2) for uid1, uid2 in pairs[:suite_pair_count]],
+            pairs=suite_pair_count)
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(dataset_dir, groups=None, layout_limit=layout_node_limit, seed=42):
+    groups = groups or stage_groups
+    name = os.path.basename(os.path.normpath(dataset_dir))
+    rng = np.random.default_rng(seed)
+    results = []
+    with tempfile.TemporaryDirectory() as cache_dir:
+        # The dataset is always loaded; its stage is only reported when asked for.
+        loaded = []
+        ds_obj = measure(loaded, "dataset_load", load_dataset, dataset_dir)
+        if "dataset" in groups:
+            results.extend(loaded)
+        manager = LoadedDataset(ds_obj)
+        graph = None
+        if "graph" in groups or "louvain" in groups:
+            graph = run_graph(results if "graph" in groups else [], manager, name, cache_dir, layout_limit)
+        if "louvain" in groups:
+            measure(results, "louvain", graph.get_louvain_parts)
+        if "similarity" in groups:
+            run_similarity(results, manager, name, cache_dir, rng)
+    return {
+        "dataset": {"name": name, "path": os.path.abspath(dataset_dir), "users": len(ds_obj.get_user_ids()),
+                    "items": len(ds_obj.get_item_ids()),
+                    "interactions": len(ds_obj.get_history_index().items)},
+        "environment": {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "git_commit": git_commit(),
+                        "python": platform.python_version(), "platform": platform.platform(),
+                        "cpus": os.cpu_count(), "numpy": np.__version__, "networkx": nx.__version__},
+        "stages": results,
+    }
+
+def compare(previous, current, threshold=regression_threshold):
+    # Returns the stages whose time grew by more than threshold x, printing every shared stage.
+    before = {entry["stage"]: entry for entry in previous["stages"] if "seconds" in entry}
+    regressions = []
+    for entry in current["stages"]:
+        if "seconds" not in entry or entry["stage"] not in before:
+            continue
+        old = before[entry["stage"]]
+        ratio = entry["seconds"] / old["seconds"] if old["seconds"] else float("inf")
+        regressed = ratio > threshold and entry["seconds"] - old["seconds"] > regression_min_seconds
+        flag = "  REGRESSION" if regressed else ""
+        print(f"{entry['stage']:36s} {old['seconds']:10.3f}s -> {entry['seconds']:10.3f}s  x{ratio:5.2f}{flag}")
+        if regressed:
+            regressions.append(entry["stage"])
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Time and measure peak memory of the recviz pipeline stages.")
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "recviz_benchmarks"),
+                        help="where generated datasets are kept between runs")
+    parser.add_argument("--scale", choices=sorted(scales), default="ml-100k")
+    parser.add_argument("--dataset", help="benchmark an existing dataset directory instead of a generated one")
+    parser.add_argument("--stages", default=",".join(stage_groups), help=f"comma separated subset of {stage_groups}")
+    parser.add_argument("--layout-limit", type=int, default=layout_node_limit)
+    parser.add_argument("--output", help="results file, defaults to benchmarks/results/<dataset>_<time>.json")
+    parser.add_argument("--compare", help="earlier results file; exits with 1 if a stage regressed")
+    parser.add_argument("--threshold", type=float, default=regression_threshold)
+    args = parser.parse_args()
+
+    dataset_dir = args.dataset
+    if dataset_dir is None:
+        dataset_dir = os.path.join(args.data_dir, args.scale)
+        if not os.path.isdir(dataset_dir):
+            print("GENERATING", args.scale, "IN", args.data_dir, flush=True)
+            generate(args.data_dir, args.scale, *scales[args.scale])
+    report = run(dataset_dir, [group for group in args.stages.split(",") if group], args.layout_limit)
+
+    output = args.output or os.path.join(os.path.dirname(os.path.abspath(__file__)), "results",
+                                         f"{report['dataset']['name']}_{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print("WROTE", output)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressions = compare(json.load(f), report, args.threshold)
+        if regressions:
+            print("REGRESSED STAGES:", ", ".join(regressions))
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
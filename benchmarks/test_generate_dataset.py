@@ -0,0 +1,27 @@
+import numpy as np
+from benchmarks.generate_dataset import generate, user_degrees
+from recvizapi.Dataset import Dataset
+
+def test_user_degrees_hit_total_and_stay_within_items():
+    degrees = user_degrees(100, 500, 3000, np.random.default_rng(0))
+    assert degrees.sum() == 3000
+    assert degrees.max() <= 500
+    assert degrees.min() >= 20
+    # Skewed: the busiest tenth of users holds well over a tenth of the interactions.
+    assert np.sort(degrees)[-10:].sum() > 0.2 * degrees.sum()
+
+def test_generated_files_load_as_dataset(tmp_path):
+    info = generate(str(tmp_path), "synthetic", 50, 80, 1500, seed=1)
+    assert 0.95 * 1500 <= info["interactions"] <= 1500
+    ds = Dataset(info["path"], ["synthetic.inter"], ["synthetic.user"], ["synthetic.item"], "synthetic", {})
+    assert ds.get_validity()
+    assert len(ds.get_user_ids()) == 50
+    assert len(ds.get_item_ids()) == 80
+    assert len(ds.get_history_index().items) == info["interactions"]
+    assert ds.get_interaction_matrix().nnz == info["interactions"]
+
+def test_generation_is_deterministic(tmp_path):
+    generate(str(tmp_path / "a"), "synthetic", 30, 40, 700, seed=3)
+    generate(str(tmp_path / "b"), "synthetic", 30, 40, 700, seed=3)
+    assert (tmp_path / "a" / "synthetic" / "synthetic.inter").read_text() == \
+        (tmp_path / "b" / "synthetic" / "synthetic.inter").read_text()
@@ -0,0 +1,35 @@
+import json
+import networkx as nx
+import pytest
+from benchmarks import run_benchmarks
+from benchmarks.generate_dataset import generate
+
+@pytest.fixture
+def dataset_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(nx, "forceatlas2_layout", lambda g, gravity, max_iter: {node: (0.5, 0.5) for node in g.nodes})
+    monkeypatch.setattr("recvizapi.Graph.use_gpu_layout", False)
+    monkeypatch.setattr(run_benchmarks, "pair_count", 50)
+    monkeypatch.setattr(run_benchmarks, "suite_pair_count", 20)
+    return generate(str(tmp_path), "synthetic", 40, 60, 1000, seed=2)["path"]
+
+def test_run_records_every_stage(dataset_dir):
+    report = run_benchmarks.run(dataset_dir)
+    stages = {entry["stage"]: entry for entry in report["stages"]}
+    for stage in ["dataset_load", "graph_assemble", "graph_layout", "graph_write_gexf", "louvain",
+                  "similarity_batch_jaccard", "similarity_metric_suite", "neighbour_index_build"]:
+        assert stages[stage]["seconds"] >= 0
+        assert stages[stage]["peak_rss_bytes"] > 0
+    assert report["dataset"]["users"] == 40
+    json.dumps(report)
+
+def test_layout_skipped_above_limit(dataset_dir):
+    report = run_benchmarks.run(dataset_dir, ["graph"], layout_limit=10)
+    stages = {entry["stage"]: entry for entry in report["stages"]}
+    assert "skipped" in stages["graph_layout"]
+    assert "dataset_load" not in stages
+
+def test_compare_flags_slower_stages():
+    previous = {"stages": [{"stage": "louvain", "seconds": 1.0}, {"stage": "graph_assemble", "seconds": 0.001}]}
+    current = {"stages": [{"stage": "louvain", "seconds": 1.5}, {"stage": "graph_assemble", "seconds": 0.004},
+                          {"stage": "graph_layout", "skipped": "too large"}]}
+    assert run_benchmarks.compare(previous, current) == ["louvain"]
@@ -25,6 +25,7 @@ SECRET_KEY = 'django-insecure-2r$+ezg-np8rdr1#1ab!!_r65va28rg^&h$^q@h80eeq*4-^hl
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
 CORS_ORIGIN_ALLOW_ALL = True
+CORS_EXPOSE_HEADERS = ["X-Recviz-Graph-Key"]
 ALLOWED_HOSTS = []
 
 
@@ -42,6 +43,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'recvizapi.Metrics.ServerTimingMiddleware',
+    'recvizapi.Profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -75,6 +78,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'recviz-backend.wsgi.application'
+ASGI_APPLICATION = 'recviz-backend.asgi.application'
 
 
 # Database
@@ -0,0 +1,183 @@
+import os
+import xml.etree.ElementTree as ET
+import networkx as nx
+import numpy as np
+import scipy.sparse as sp
+from recvizapi.SharedArrays import save_atomically
+
+# Neighbourhoods up to this many nodes get a force-directed layout of their own when no cached layout
+# covers them; larger ones are placed on rings by hop.
+local_layout_limit = 1000
+local_layout_iterations = 50
+
+def read_layout(gexf_path):
+    # Streams the x/y node attributes out of a gexf written by Graph.write_gexf, without building
+    # the graph or keeping the (large) interaction history strings in memory.
+    attribute_ids = {}
+    positions = {}
+    for _, element in ET.iterparse(gexf_path, events=("end",)):
+        tag = element.tag.rsplit("}", 1)[-1]
+        if tag == "attribute" and element.get("title") in ("x", "y"):
+            attribute_ids[element.get("id")] = element.get("title")
+        elif tag == "node":
+            coordinates = {}
+            for attvalue in element.iter():
+                if attvalue.tag.rsplit("}", 1)[-1] == "attvalue" and attvalue.get("for") in attribute_ids:
+                    coordinates[attribute_ids[attvalue.get("for")]] = float(attvalue.get("value"))
+            if "x" in coordinates and "y" in coordinates:
+                positions[element.get("id")] = (coordinates["x"], coordinates["y"])
+            element.clear()
+    return positions
+
+def expand_rows(indptr, rows):
+    # CSR entry positions of the given rows, concatenated, and the index into rows each one belongs to.
+    starts = indptr[rows]
+    lengths = indptr[rows + 1] - starts
+    owners = np.repeat(np.arange(len(rows)), lengths)
+    entries = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths) + np.repeat(starts, lengths)
+    return entries, owners
+
+class AdjacencyIndex:
+    def __init__(self, index_path=None):
+        self.index_path = index_path
+        self.n_users = 0
+        self.n_items = 0
+        # Symmetric CSR adjacency of the bipartite graph; rows are users then items, data are edge weights.
+        self.adjacency = None
+        self.nodes = np.empty(0, dtype=str)
+        self.rows = {}
+        # Positions from the cached layout of the full graph, NaN where it has none.
+        self.x = None
+        self.y = None
+        self.layout_mtime = None
+
+    def build(self, counts, user_ids, item_ids):
+        counts = sp.csr_matrix(counts, dtype=np.float32)
+        self.n_users, self.n_items = counts.shape
+        self.adjacency = sp.bmat([[None, counts], [counts.T, None]], format="csr")
+        self.adjacency.sort_indices()
+        self.nodes = np.array([f"user-{user_id}" for user_id in user_ids] + [f"item-{item_id}" for item_id in item_ids])
+        self.rows = {node: row for row, node in enumerate(self.nodes.tolist())}
+        self.x = self.y = None
+        self.layout_mtime = None
+        return self
+
+    def add(self, delta):
+        # Adds a users x items matrix of new interaction counts to the edge weights; nodes and positions are kept.
+        delta = sp.csr_matrix(delta, dtype=np.float32)
+        self.adjacency = (self.adjacency + sp.bmat([[None, delta], [delta.T, None]], format="csr")).tocsr()
+        self.adjacency.sort_indices()
+        return self
+
+    def matches(self, fingerprint):
+        # fingerprint: (users, items, nnz) of the current interaction matrix.
+        return self.adjacency is not None and (self.n_users, self.n_items, self.adjacency.nnz // 2) == tuple(fingerprint)
+
+    def attach_layout(self, gexf_path):
+        # Returns False when the positions of this gexf are already attached.
+        mtime = os.path.getmtime(gexf_path)
+        if self.layout_mtime == mtime:
+            return False
+        self.x = np.full(len(self.nodes), np.nan)
+        self.y = np.full(len(self.nodes), np.nan)
+        for node, (x, y) in read_layout(gexf_path).items():
+            row = self.rows.get(node)
+            if row is not None:
+                self.x[row] = x
+                self.y[row] = y
+        self.layout_mtime = mtime
+        return True
+
+    def save(self):
+        if self.index_path is None:
+            return
+        save_atomically(self.index_path + ".npz", sp.save_npz, self.adjacency)
+        arrays = {"nodes": self.nodes, "shape": np.array([self.n_users, self.n_items])}
+        if self.layout_mtime is not None:
+            arrays.update(x=self.x, y=self.y, layout_mtime=np.array(self.layout_mtime))
+        save_atomically(self.index_path + "_nodes.npz", np.savez, **arrays)
+
+    def paths(self):
+        return [self.index_path + suffix for suffix in [".npz", "_nodes.npz"]] if self.index_path is not None else []
+
+    def remove(self):
+        for path in self.paths():
+            if os.path.exists(path):
+                os.remove(path)
+
+    def load(self, fingerprint):
+        paths = self.paths()
+        if not paths or not all(os.path.exists(path) for path in paths):
+            return False
+        arrays = np.load(paths[1])
+        self.n_users, self.n_items = arrays["shape"].tolist()
+        self.adjacency = sp.load_npz(paths[0]).tocsr()
+        if not self.matches(fingerprint):
+            self.adjacency = None
+            return False
+        self.nodes = arrays["nodes"]
+        self.rows = {node: row for row, node in enumerate(self.nodes.tolist())}
+        if "layout_mtime" in arrays:
+            self.x, self.y, self.layout_mtime = arrays["x"], arrays["y"], float(arrays["layout_mtime"])
+        return True
+
+    def neighbourhood(self, node, hops=1, caps=None, max_nodes=None):
+        # Breadth-first expansion from node. caps[h] keeps only the heaviest caps[h] edges from each node
+        # at hop h to nodes not seen yet (the last cap applies to further hops); max_nodes stops the
+        # expansion at the hop that would exceed it, keeping the new nodes with the most edge weight.
+        # Returns (rows, hop of each row, whether it was truncated).
+        center = self.rows[node]
+        indptr, indices, data = self.adjacency.indptr, self.adjacency.indices, self.adjacency.data
+        depth = np.full(len(self.nodes), -1, dtype=np.int64)
+        depth[center] = 0
+        frontier = np.array([center], dtype=np.int64)
+        found = [frontier]
+        count = 1
+        truncated = False
+        for hop in range(1, hops + 1):
+            entries, owners = expand_rows(indptr, frontier)
+            neighbours, weights = indices[entries], data[entries]
+            unseen = depth[neighbours] < 0
+            neighbours, weights, owners = neighbours[unseen], weights[unseen], owners[unseen]
+            cap = caps[min(hop, len(caps)) - 1] if caps else None
+            if cap is not None:
+                order = np.lexsort((neighbours, -weights, owners))
+                neighbours, weights, owners = neighbours[order], weights[order], owners[order]
+                group_starts = np.searchsorted(owners, owners, side="left")
+                keep = np.arange(len(owners)) - group_starts < cap
+                neighbours, weights = neighbours[keep], weights[keep]
+            frontier, inverse = np.unique(neighbours, return_inverse=True)
+            if max_nodes is not None and count + len(frontier) > max_nodes:
+                strength = np.bincount(inverse, weights=weights, minlength=len(frontier))
+                frontier = np.sort(frontier[np.lexsort((frontier, -strength))[:max(max_nodes - count, 0)]])
+                truncated = True
+            depth[frontier] = hop
+            found.append(frontier)
+            count += len(frontier)
+            if truncated or not len(frontier):
+                break
+        rows = np.concatenate(found)
+        return rows, depth[rows], truncated
+
+    def edges(self, rows):
+        # Edges of the subgraph induced by rows, once each, user side first: (sources, targets, weights)
+        # as positions into rows.
+        induced = self.adjacency[rows][:, rows].tocoo()
+        forward = rows[induced.row] < self.n_users
+        return induced.row[forward], induced.col[forward], induced.data[forward]
+
+    def layout(self, rows, hops, sources, targets, weights):
+        # Positions from the cached full-graph layout when it covers every node, otherwise a local layout.
+        if self.x is not None and not np.isnan(self.x[rows]).any() and not np.isnan(self.y[rows]).any():
+            return self.x[rows], self.y[rows], "cached"
+        if len(rows) <= local_layout_limit:
+            graph = nx.Graph()
+            graph.add_nodes_from(range(len(rows)))
+            graph.add_weighted_edges_from(zip(sources.tolist(), targets.tolist(), weights.tolist()))
+            positions = nx.spring_layout(graph, iterations=local_layout_iterations, seed=42)
+            coordinates = np.array([positions[idx] for idx in range(len(rows))])
+            return coordinates[:, 0], coordinates[:, 1], "local"
+        shells = [np.flatnonzero(hops == hop).tolist() for hop in range(int(hops.max()) + 1)]
+        positions = nx.shell_layout(nx.empty_graph(len(rows)), nlist=shells)
+        coordinates = np.array([positions[idx] for idx in range(len(rows))])
+        return coordinates[:, 0], coordinates[:, 1], "shell"
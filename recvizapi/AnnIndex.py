@@ -0,0 +1,200 @@
+import os
+import json
+import threading
+import numpy as np
+import torch
+from recvizapi.SharedArrays import save_atomically
+
+use_hnsw = True
+
+try:
+    import hnswlib
+except ImportError:
+    print("hnswlib is unavailable, will fall back to the NumPy IVF index for approximate top-k.")
+    use_hnsw = False
+
+kmeans_iterations = 10
+kmeans_sample_per_list = 256
+ivf_probe_lists = 32
+hnsw_m = 16
+hnsw_ef_construction = 200
+# Extra candidates fetched for the history items of one user at most; users with longer histories can come back
+# with fewer than k and are scored exactly by the caller.
+max_excluded_fetch = 512
+
+def propagated_embeddings(model):
+    # Graph models score with the embeddings their forward pass propagates; NCL also returns the layer outputs.
+    return model.forward()[:2]
+
+# recbole models whose full_sort_predict is exactly the inner product of the user and item vectors returned
+# here. Models that merely have embedding tables (ConvNCF, NNCF, ENMF, ...) score differently and are not listed.
+inner_product_models = {
+    "BPR": lambda model: (model.user_embedding.weight, model.item_embedding.weight),
+    "LightGCN": propagated_embeddings,
+    "NGCF": propagated_embeddings,
+    "SpectralCF": propagated_embeddings,
+    "DGCF": propagated_embeddings,
+    "NCL": propagated_embeddings,
+    "SGL": lambda model: model.forward(model.train_graph),
+}
+
+def get_model_embeddings(model):
+    # (user vectors, item vectors) of models that can be answered from an index, None for the rest.
+    embeddings = inner_product_models.get(type(model).__name__)
+    if embeddings is None:
+        return None
+    user_e, item_e = embeddings(model)
+    return (user_e.detach().float().cpu().numpy().astype(np.float32),
+            item_e.detach().float().cpu().numpy().astype(np.float32))
+
+def kmeans(vectors, n_lists, seed=42):
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(vectors), n_lists * kmeans_sample_per_list)
+    sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    centroids = sample[rng.choice(sample_size, n_lists, replace=False)].copy()
+    for _ in range(kmeans_iterations):
+        assignment = assign_lists(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        counts = np.bincount(assignment, minlength=n_lists)
+        non_empty = counts > 0
+        centroids[non_empty] = sums[non_empty] / counts[non_empty, None]
+    return centroids
+
+def assign_lists(vectors, centroids, chunk_size=65536):
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    assignment = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), chunk_size):
+        chunk = vectors[start:start + chunk_size]
+        distances = centroid_norms[None, :] - 2 * chunk @ centroids.T
+        assignment[start:start + chunk_size] = distances.argmin(axis=1)
+    return assignment
+
+class AnnIndex:
+    def __init__(self, index_path=None):
+        self.index_path = index_path
+        self.hnsw = None
+        self.centroids = None
+        self.list_offsets = None
+        self.list_vectors = None
+        self.list_item_ids = None
+        self.n_probe = 1
+        self.metadata = {}
+
+    def build(self, item_vectors, metadata=None):
+        # Internal item id 0 is recbole's [PAD] token and is never recommended.
+        item_ids = np.arange(1, len(item_vectors), dtype=np.int64)
+        vectors = np.ascontiguousarray(item_vectors[1:], dtype=np.float32)
+        self.metadata = metadata or {}
+        if use_hnsw:
+            self.hnsw = hnswlib.Index(space="ip", dim=vectors.shape[1])
+            self.hnsw.init_index(max_elements=len(vectors), ef_construction=hnsw_ef_construction, M=hnsw_m)
+            self.hnsw.add_items(vectors, item_ids)
+        else:
+            n_lists = max(1, int(np.sqrt(len(vectors))))
+            self.centroids = kmeans(vectors, n_lists)
+            assignment = assign_lists(vectors, self.centroids)
+            order = np.argsort(assignment, kind="stable")
+            self.list_offsets = np.concatenate(([0], np.cumsum(np.bincount(assignment, minlength=n_lists))))
+            self.list_vectors = vectors[order]
+            self.list_item_ids = item_ids[order]
+            self.n_probe = min(n_lists, ivf_probe_lists)
+        return self
+
+    def save(self):
+        # The metadata file that load starts from is replaced last, so it never describes a half-written index.
+        if self.index_path is None:
+            return
+        if self.hnsw is not None:
+            # hnswlib writes to a path, not a file object.
+            temporary = os.path.join(os.path.dirname(self.index_path),
+                                     f".{os.path.basename(self.index_path)}.hnsw.{os.getpid()}.{threading.get_ident()}.tmp")
+            try:
+                self.hnsw.save_index(temporary)
+                os.replace(temporary, self.index_path + ".hnsw")
+            finally:
+                if os.path.exists(temporary):
+                    os.remove(temporary)
+        else:
+            save_atomically(self.index_path + ".npz", np.savez,
+                            centroids=self.centroids,
+                            list_offsets=self.list_offsets,
+                            list_vectors=self.list_vectors,
+                            list_item_ids=self.list_item_ids)
+        metadata = dict(self.metadata, backend="hnsw" if self.hnsw is not None else "ivf", n_probe=self.n_probe)
+        save_atomically(self.index_path + ".json", lambda f: f.write(json.dumps(metadata).encode("utf-8")))
+
+    def load(self, expected_metadata, dim):
+        # Returns False when nothing usable is persisted, so the caller rebuilds.
+        if self.index_path is None or not os.path.exists(self.index_path + ".json"):
+            return False
+        with open(self.index_path + ".json", "r", encoding="utf-8") as f:
+            stored = json.load(f)
+        backend = stored.pop("backend")
+        n_probe = stored.pop("n_probe")
+        if stored != expected_metadata or backend != ("hnsw" if use_hnsw else "ivf"):
+            return False
+        if backend == "hnsw":
+            self.hnsw = hnswlib.Index(space="ip", dim=dim)
+            self.hnsw.load_index(self.index_path + ".hnsw")
+        else:
+            arrays = np.load(self.index_path + ".npz")
+            self.centroids = arrays["centroids"]
+            self.list_offsets = arrays["list_offsets"]
+            self.list_vectors = arrays["list_vectors"]
+            self.list_item_ids = arrays["list_item_ids"]
+        self.n_probe = n_probe
+        self.metadata = stored
+        return True
+
+    def search(self, queries, k, exclude=None):
+        # exclude: optional list (one per query) of internal item ids to leave out, e.g. history items.
+        # Rows with fewer than k candidates left end in item 0 with a -inf score; callers rescore them.
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        excluded = np.zeros(len(queries), dtype=np.int64)
+        if exclude is not None:
+            excluded = np.minimum([len(items) for items in exclude], max_excluded_fetch).astype(np.int64)
+        topk_ids = np.zeros((len(queries), k), dtype=np.int64)
+        topk_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        # Rows are searched in groups of similar history length (up to twice as long), so one long history does not
+        # widen the search of every query.
+        groups = np.ceil(np.log2(excluded + 1)).astype(np.int64)
+        for group in np.unique(groups):
+            rows = np.flatnonzero(groups == group)
+            candidate_ids, candidate_scores = self.candidates(queries[rows], k + int(excluded[rows].max()))
+            for position, row in enumerate(rows.tolist()):
+                ids, scores = candidate_ids[position], candidate_scores[position]
+                keep = np.isfinite(scores)
+                if exclude is not None and len(exclude[row]):
+                    keep &= ~np.isin(ids, exclude[row])
+                ids, scores = ids[keep], scores[keep]
+                count = min(k, len(ids))
+                topk_ids[row, :count] = ids[:count]
+                topk_scores[row, :count] = scores[:count]
+        return topk_scores, topk_ids
+
+    def candidates(self, queries, fetch):
+        if self.hnsw is not None:
+            fetch = min(fetch, self.hnsw.get_current_count())
+            self.hnsw.set_ef(max(fetch * 2, 64))
+            labels, distances = self.hnsw.knn_query(queries, k=fetch)
+            return labels.astype(np.int64), 1 - distances
+        return self.search_ivf(queries, fetch)
+
+    def search_ivf(self, queries, fetch):
+        probe = min(self.n_probe, len(self.centroids))
+        probed_lists = np.argpartition(-(queries @ self.centroids.T), probe - 1, axis=1)[:, :probe]
+        candidate_ids = np.zeros((len(queries), fetch), dtype=np.int64)
+        candidate_scores = np.full((len(queries), fetch), -np.inf, dtype=np.float32)
+        for row, lists in enumerate(probed_lists):
+            slices = [np.arange(self.list_offsets[lst], self.list_offsets[lst + 1]) for lst in lists]
+            positions = np.concatenate(slices)
+            scores = self.list_vectors[positions] @ queries[row]
+            count = min(fetch, len(scores))
+            if count == 0:
+                continue
+            best = np.argpartition(-scores, count - 1)[:count]
+            best = best[np.argsort(-scores[best], kind="stable")]
+            candidate_ids[row, :count] = self.list_item_ids[positions[best]]
+            candidate_scores[row, :count] = scores[best]
+        return candidate_ids, candidate_scores
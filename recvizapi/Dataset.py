@@ -1,35 +1,73 @@
 import os
+import numpy as np
+import scipy.sparse as sp
+from recvizapi.HistoryIndex import HistoryIndex, history_arrays
+from recvizapi.Metrics import timed
+from recvizapi.SharedArrays import SharedArrays, source_fingerprint
+
+# Shared arrays the history index is made from; a process finding all of them skips parsing the .inter files.
+history_keys = ["history_indptr", "history_items", "history_timestamps", "history_field_codes", "history_field_names",
+                "history_field_values", "history_field_columns", "history_unknown_items", "history_inter_offsets"]
 
 class Dataset:
-    def __init__(self, dataset_dir_path, inter_files, user_files, item_files, dataset_sub_dir, models):
+    def __init__(self, dataset_dir_path, inter_files, user_files, item_files, dataset_sub_dir, models, shared_dir=None):
         self.user_mapping = {}
         self.user_ids = None
         self.user_features = ["user_history_length"]
         self.item_features = []
         self.item_mapping = {}
-        self.interaction_history = {}
-        self.timestamps = None
+        # .inter fields besides the user, item and timestamp, kept per interaction in the history index as codes into
+        # history_values, the distinct values of every field; history_value_columns holds the field of each value and
+        # history_value_codes one {value: code} dict per field. history_values is None while the vocabulary is only
+        # in the shared arrays (see load_history_vocabulary).
+        self.history_fields = []
+        self.history_values = []
+        self.history_value_columns = []
+        self.history_value_codes = []
         self.item_ids = None
         self.models = models
         self.dataset_name = dataset_sub_dir
         self.valid = False
+        self.user_index = None
+        self.item_index = None
+        self.interaction_matrix = None
+        self.interaction_arrays = None
+        self.history_index = None
+        self.source_files = [os.path.join(dataset_dir_path, file) for file in inter_files + user_files + item_files]
+        # Header fields and bytes read so far of each .inter file, so appended lines can be ingested later.
+        self.inter_field_names = {}
+        self.inter_offsets = {}
+        # With shared_dir the history index, interaction matrix and arrays are memory-mapped from files every process shares.
+        # The fingerprint is taken before parsing, so lines appended meanwhile can only make it look older.
+        self.shared = None
+        if shared_dir is not None:
+            self.shared = SharedArrays(os.path.join(shared_dir, dataset_sub_dir), source_fingerprint(self.source_files),
+                                       self.get_source_mtime())
 
-        for user_file in user_files:
-            self.load_user_features(os.path.join(dataset_dir_path, user_file))
-
-        for item_file in item_files:
-            self.load_item_features(os.path.join(dataset_dir_path, item_file))
+        with timed("dataset_parse"):
+            for user_file in user_files:
+                self.load_user_features(os.path.join(dataset_dir_path, user_file))
 
-        if self.user_mapping and self.item_mapping:
-            self.user_ids = sorted(list(self.user_mapping.keys()))
-            self.item_ids = sorted(list(self.item_mapping.keys()))
+            for item_file in item_files:
+                self.load_item_features(os.path.join(dataset_dir_path, item_file))
 
-            for inter_file in inter_files:
-                self.load_inter_file(os.path.join(dataset_dir_path, inter_file))
+            if self.user_mapping and self.item_mapping:
+                self.user_ids = sorted(list(self.user_mapping.keys()))
+                self.item_ids = sorted(list(self.item_mapping.keys()))
 
-            if self.interaction_history and self.timestamps is not None:
-                self.timestamps = sorted(list(self.timestamps))
-                self.valid = True
+                inter_paths = [os.path.join(dataset_dir_path, inter_file) for inter_file in inter_files]
+                arrays = self.shared.load(history_keys) if self.shared is not None else None
+                if arrays is not None:
+                    # Another process already parsed these files: attach to its arrays without reading the interactions.
+                    self.attach_history_index(arrays, inter_paths)
+                else:
+                    # Interactions are only held as parsed columns until the history index is built from them.
+                    parsed = {"rows": [], "codes": [], "timestamps": [], "fields": [], "unknown_items": {}}
+                    for inter_path in inter_paths:
+                        self.load_inter_file(inter_path, parsed)
+                    if parsed["rows"]:
+                        self.store_history_index(parsed, inter_paths)
+                self.valid = self.history_index is not None and len(self.history_index.items) > 0
 
     def load_user_features(self, file_path):
         with open(file_path, 'r', encoding='utf-8') as f:
@@ -41,7 +79,7 @@ class Dataset:
                 user_id = fields[0]
                 for idx, field_name in enumerate(field_names):
                     if user_id not in self.user_mapping:
-                        self.user_mapping[user_id] = {"user_history_length": 0, "interaction_history": []}
+                        self.user_mapping[user_id] = {"user_history_length": 0}
                     self.user_mapping[user_id][field_name.split(':')[0]] = fields[idx]
 
     def load_item_features(self, file_path):
@@ -55,27 +93,288 @@ class Dataset:
                     field_names[i]: fields[i] for i in range(len(fields))
                 }
 
-    def load_inter_file(self, file_path):
-        self.timestamps = set()
+    def load_inter_file(self, file_path, parsed):
         with open(file_path, 'r', encoding='utf-8') as f:
             field_names = [field.split(':')[0] for field in f.readline().strip().split('\t')]
-            for line in f:
-                fields = line.strip().split('\t')
-                timestamp = fields[-1]
-                if timestamp not in self.interaction_history:
-                    self.interaction_history[timestamp] = []
-                self.interaction_history[timestamp].append({field_names[i]: fields[i] for i in range(len(fields) - 1)})
-                if field_names[0] == 'user_id' and fields[0] in self.user_ids:
-                    self.user_mapping[fields[0]]["user_history_length"] += 1
-                    self.user_mapping[fields[0]]["interaction_history"].append({field_names[i]: fields[i] for i in range(1, len(fields) - 1)})
-                self.timestamps.add(timestamp)
-        for user in self.user_mapping:
-            if "interaction_history" in self.user_mapping[user]:
-                self.user_mapping[user]["interaction_history_str"] = str(self.user_mapping[user]["interaction_history"])
+            self.parse_interactions(field_names, (line.strip().split('\t') for line in f), parsed)
+            self.inter_field_names[file_path] = field_names
+            self.inter_offsets[file_path] = f.tell()
+
+    def parse_interactions(self, field_names, rows, parsed, keep_unknown_items=True):
+        # Adds the user row, item code, float timestamp and history field values of each interaction of a known user
+        # to the lists of parsed and counts it in the user's history length. Items missing from the item files get
+        # codes after item_ids (see HistoryIndex) with keep_unknown_items and are skipped otherwise. Returns the
+        # number of rows skipped.
+        self.load_history_vocabulary()
+        user_index = self.get_user_index()
+        item_index = self.get_item_index()
+        user_field = field_names.index("user_id") if "user_id" in field_names else None
+        item_field = field_names.index("item_id") if "item_id" in field_names else None
+        for field_name in field_names[:-1]:
+            if field_name not in ("user_id", "item_id") and field_name not in self.history_fields:
+                self.history_fields.append(field_name)
+                self.history_value_codes.append({})
+        history_columns = [field_names.index(field_name) if field_name in field_names[:-1] else None
+                           for field_name in self.history_fields]
+        skipped = 0
+        for fields in rows:
+            if user_field is None or item_field is None or len(fields) != len(field_names):
+                skipped += 1
+                continue
+            row = user_index.get(fields[user_field])
+            col = item_index.get(fields[item_field])
+            if col is None and keep_unknown_items:
+                unknown_items = parsed["unknown_items"]
+                col = len(self.item_ids) + unknown_items.setdefault(fields[item_field], len(unknown_items))
+            try:
+                timestamp = float(fields[-1])
+            except ValueError:
+                timestamp = None
+            if row is None or col is None or timestamp is None:
+                skipped += 1
+                continue
+            self.user_mapping[fields[user_field]]["user_history_length"] += 1
+            parsed["rows"].append(row)
+            parsed["codes"].append(col)
+            parsed["timestamps"].append(timestamp)
+            parsed["fields"].append([self.history_value_code(position, fields[column] if column is not None else "")
+                                     for position, column in enumerate(history_columns)])
+        return skipped
+
+    def load_history_vocabulary(self):
+        # A process attached to shared arrays only builds the value dicts when it first parses interactions.
+        if self.history_values is None:
+            self.history_values = self.history_index.field_values.tolist()
+            self.history_value_columns = self.history_value_columns.tolist()
+            self.history_value_codes = [{} for _ in self.history_fields]
+            for code, (column, value) in enumerate(zip(self.history_value_columns, self.history_values)):
+                self.history_value_codes[column][value] = code
+
+    def history_value_code(self, column, value):
+        codes = self.history_value_codes[column]
+        if value not in codes:
+            codes[value] = len(self.history_values)
+            self.history_values.append(value)
+            self.history_value_columns.append(column)
+        return codes[value]
+
+    def history_field_array(self, parsed):
+        # Rows parsed before a later .inter file added fields are padded with empty values.
+        width = len(self.history_fields)
+        return np.array([values + [self.history_value_code(column, "") for column in range(len(values), width)]
+                         for values in parsed["fields"]], dtype=np.int32).reshape(len(parsed["fields"]), width)
+
+    def store_history_index(self, parsed, inter_paths):
+        arrays = history_arrays(parsed["rows"], parsed["codes"], np.array(parsed["timestamps"], dtype=np.float64),
+                                len(self.user_ids), self.history_field_array(parsed))
+        arrays["history_unknown_items"] = np.array(list(parsed["unknown_items"]), dtype=str)
+        arrays["history_field_names"] = np.array(self.history_fields, dtype=str)
+        arrays["history_field_values"] = np.array(self.history_values, dtype=str)
+        arrays["history_field_columns"] = np.array(self.history_value_columns, dtype=np.int32)
+        # Where parsing stopped, which may be past the fingerprinted sizes if lines were appended meanwhile.
+        arrays["history_inter_offsets"] = np.array([self.inter_offsets[path] for path in inter_paths], dtype=np.int64)
+        if self.shared is not None:
+            arrays = self.shared.store(arrays)
+        self.make_history_index(arrays)
+
+    def attach_history_index(self, arrays, inter_paths):
+        self.history_fields = arrays["history_field_names"].tolist()
+        self.history_values = None
+        self.history_value_columns = arrays["history_field_columns"]
+        for path, offset in zip(inter_paths, arrays["history_inter_offsets"].tolist()):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.inter_field_names[path] = [field.split(':')[0] for field in f.readline().strip().split('\t')]
+            self.inter_offsets[path] = offset
+        for user_id, length in zip(self.user_ids, np.diff(arrays["history_indptr"]).tolist()):
+            self.user_mapping[user_id]["user_history_length"] = length
+        self.make_history_index(arrays)
+
+    def make_history_index(self, arrays):
+        self.history_index = HistoryIndex(arrays["history_indptr"], arrays["history_items"], arrays["history_timestamps"],
+                                          self.item_ids, arrays["history_unknown_items"].tolist(), self.item_mapping,
+                                          arrays["history_field_codes"], arrays["history_field_values"],
+                                          self.history_fields)
+
+    def read_appended_lines(self, file_path, end_offset=None):
+        # Complete lines written to an .inter file since it was last read, up to end_offset if given; a line still
+        # being written is left for later.
+        with open(file_path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() < self.inter_offsets[file_path]:
+                print("INTER FILE SHRANK, NOT INGESTING", file_path)
+                return []
+            f.seek(self.inter_offsets[file_path])
+            appended = f.read() if end_offset is None else f.read(max(end_offset - self.inter_offsets[file_path], 0))
+        end = appended.rfind(b'\n') + 1
+        self.inter_offsets[file_path] += end
+        return [line for line in appended[:end].decode('utf-8').split('\n') if line.strip()]
+
+    def ingest_appended(self, end_offsets=None):
+        # Adds the lines appended to every .inter file since the last read; end_offsets ({file path: offset}, e.g.
+        # another process' inter_offsets) stops reading where that process did.
+        end_offsets = end_offsets or {}
+        summaries = [self.append_rows(self.inter_field_names[file_path],
+                                      [line.strip().split('\t') for line in self.read_appended_lines(file_path, end_offsets.get(file_path))])
+                     for file_path in self.inter_field_names]
+        if len(summaries) == 1:
+            return summaries[0]
+        return {
+            "appended": sum(summary["appended"] for summary in summaries),
+            "skipped": sum(summary["skipped"] for summary in summaries),
+            "new_pairs": sum(summary["new_pairs"] for summary in summaries),
+            "users": np.unique(np.concatenate([summary["users"] for summary in summaries])),
+            "items": np.unique(np.concatenate([summary["items"] for summary in summaries])),
+            "delta": sum((summary["delta"] for summary in summaries[1:]), summaries[0]["delta"]),
+        }
+
+    def write_interactions(self, records):
+        # Appends records ({field: value}) to the first .inter file in its column order; records of unknown
+        # users or items are left out. Returns the number of records written and left out.
+        file_path = next(iter(self.inter_field_names))
+        field_names = self.inter_field_names[file_path]
+        lines = []
+        for record in records:
+            missing = [field for field in field_names if field not in record]
+            if missing:
+                raise ValueError(f"Interaction is missing {', '.join(missing)}")
+            values = [str(record[field]) for field in field_names]
+            if any('\t' in value or '\n' in value for value in values):
+                raise ValueError("Interaction values may not contain tabs or newlines")
+            if str(record.get("user_id")) in self.user_mapping and str(record.get("item_id")) in self.item_mapping:
+                lines.append('\t'.join(values) + '\n')
+        if lines:
+            with open(file_path, 'rb+') as f:
+                f.seek(0, os.SEEK_END)
+                if f.tell() > 0:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b'\n':
+                        lines[0] = '\n' + lines[0]
+                f.write(''.join(lines).encode('utf-8'))
+        return len(lines), len(records) - len(lines)
+
+    def append_rows(self, field_names, rows):
+        # Adds interactions (field lists in field_names order) of known users and items to the history index, user
+        # history lengths, the interaction matrix and the interaction arrays if they are built. Returns the counts,
+        # how many user-item pairs are new, the user and item rows that changed and the users x items matrix of added
+        # interaction counts.
+        # Built from the history before it grows, so the delta can be added to it.
+        previous_nnz = self.get_interaction_matrix().nnz
+        parsed = {"rows": [], "codes": [], "timestamps": [], "fields": [], "unknown_items": {}}
+        skipped = self.parse_interactions(field_names, rows, parsed, keep_unknown_items=False)
+        rows_added = np.array(parsed["rows"], dtype=np.int64)
+        cols_added = np.array(parsed["codes"], dtype=np.int64)
+        timestamps_added = np.array(parsed["timestamps"], dtype=np.float64)
+        delta = sp.csr_matrix((np.ones(len(rows_added), dtype=np.float32), (rows_added, cols_added)),
+                              shape=(len(self.user_ids), len(self.item_ids)))
+        new_pairs = 0
+        if len(rows_added):
+            self.interaction_matrix = (self.interaction_matrix + delta).tocsr()
+            new_pairs = self.interaction_matrix.nnz - previous_nnz
+            if self.interaction_arrays is not None:
+                self.merge_interaction_arrays(timestamps_added, rows_added * len(self.item_ids) + cols_added)
+            self.history_index.add(rows_added, cols_added, timestamps_added, self.history_field_array(parsed),
+                                   self.history_values)
+        return {"appended": len(rows_added), "skipped": skipped, "new_pairs": new_pairs, "users": np.unique(rows_added),
+                "items": np.unique(cols_added), "delta": delta}
+
+    def merge_interaction_arrays(self, timestamps, pairs):
+        # Inserts new interactions into the sorted arrays after the ones with equal timestamps, as a rebuild would.
+        arrays = self.interaction_arrays
+        order = np.argsort(timestamps, kind="stable")
+        timestamps, pairs = timestamps[order], pairs[order]
+        # Only the (few) new pairs are sorted; the existing ones already are.
+        unique_pairs = np.unique(pairs)
+        known = np.searchsorted(arrays["distinct_pairs"], unique_pairs)
+        found = known < len(arrays["distinct_pairs"])
+        found[found] = arrays["distinct_pairs"][known[found]] == unique_pairs[found]
+        distinct_pairs = np.insert(arrays["distinct_pairs"], known[~found], unique_pairs[~found])
+        pair_ids = arrays["pair_ids"]
+        if not found.all():
+            pair_ids = np.searchsorted(distinct_pairs, arrays["distinct_pairs"])[pair_ids]
+        positions = np.searchsorted(arrays["timestamps"], timestamps, side="right")
+        self.interaction_arrays = {
+            "timestamps": np.insert(arrays["timestamps"], positions, timestamps),
+            "pair_ids": np.insert(pair_ids, positions, np.searchsorted(distinct_pairs, pairs)),
+            "distinct_pairs": distinct_pairs,
+        }
 
     def get_user_ids(self):
         return self.user_ids
 
+    def get_user_index(self):
+        if self.user_index is None:
+            self.user_index = {user_id: idx for idx, user_id in enumerate(self.user_ids)}
+        return self.user_index
+
+    def get_item_index(self):
+        if self.item_index is None:
+            self.item_index = {item_id: idx for idx, item_id in enumerate(self.item_ids)}
+        return self.item_index
+
+    def get_interaction_matrix(self):
+        # users x items CSR matrix of interaction counts, rows/cols in user_ids/item_ids order.
+        if self.interaction_matrix is None and self.shared is not None:
+            arrays = self.shared.load(["matrix_data", "matrix_indices", "matrix_indptr"])
+            if arrays is not None:
+                self.interaction_matrix = sp.csr_matrix(
+                    (arrays["matrix_data"], arrays["matrix_indices"], arrays["matrix_indptr"]),
+                    shape=(len(self.user_ids), len(self.item_ids)), copy=False
+                )
+        if self.interaction_matrix is None:
+            history_index = self.get_history_index()
+            known = history_index.items < len(self.item_ids)
+            self.interaction_matrix = sp.csr_matrix(
+                (np.ones(int(known.sum()), dtype=np.float32),
+                 (history_index.user_rows()[known], history_index.items[known].astype(np.int64))),
+                shape=(len(self.user_ids), len(self.item_ids))
+            )
+            if self.shared is not None:
+                arrays = self.shared.store({"matrix_data": self.interaction_matrix.data,
+                                            "matrix_indices": self.interaction_matrix.indices,
+                                            "matrix_indptr": self.interaction_matrix.indptr})
+                self.interaction_matrix = sp.csr_matrix(
+                    (arrays["matrix_data"], arrays["matrix_indices"], arrays["matrix_indptr"]),
+                    shape=self.interaction_matrix.shape, copy=False
+                )
+        return self.interaction_matrix
+
+    def get_interaction_arrays(self):
+        # Interactions sorted by timestamp, for binary searches over time windows: float timestamps and, per
+        # interaction, the position of its user-item pair in distinct_pairs (sorted user row * items + item column).
+        if self.interaction_arrays is None and self.shared is not None:
+            self.interaction_arrays = self.shared.load(["timestamps", "pair_ids", "distinct_pairs"])
+        if self.interaction_arrays is None:
+            # Interactions with equal timestamps stay in history index order (by user).
+            history_index = self.get_history_index()
+            known = history_index.items < len(self.item_ids)
+            timestamps = np.asarray(history_index.timestamps[known], dtype=np.float64)
+            pairs = history_index.user_rows()[known] * len(self.item_ids) + history_index.items[known]
+            order = np.argsort(timestamps, kind="stable")
+            distinct_pairs, pair_ids = np.unique(pairs.astype(np.int64)[order], return_inverse=True)
+            self.interaction_arrays = {"timestamps": timestamps[order], "pair_ids": pair_ids.astype(np.int64),
+                                       "distinct_pairs": distinct_pairs}
+            if self.shared is not None:
+                self.interaction_arrays = self.shared.store(self.interaction_arrays)
+        return self.interaction_arrays
+
+    def get_history_index(self):
+        # Each user's interactions in timestamp order (see HistoryIndex), built when the dataset is loaded.
+        return self.history_index
+
+    def get_user_history(self, user_id):
+        # The user's interactions as {"item_id": ..., <other .inter field>: ...} dicts, or None for an unknown user.
+        row = self.get_user_index().get(user_id)
+        if row is None or self.history_index is None:
+            return None
+        return self.history_index.records(row)
+
+    def get_window_bounds(self, start=None, end=None):
+        # Positions in the sorted arrays of the interactions with start <= timestamp < end.
+        timestamps = self.get_interaction_arrays()["timestamps"]
+        lo = 0 if start is None else int(np.searchsorted(timestamps, start, side="left"))
+        hi = len(timestamps) if end is None else int(np.searchsorted(timestamps, end, side="left"))
+        return lo, max(lo, hi)
+
     def get_user_mapping(self):
         return self.user_mapping
 
@@ -94,17 +393,15 @@ class Dataset:
     def get_item_mapping(self):
         return self.item_mapping
 
-    def get_timestamps(self):
-        return self.timestamps
-
-    def get_interaction_history(self):
-        return self.interaction_history
-
     def get_models(self):
         return self.models
 
     def get_dataset_name(self):
         return self.dataset_name
 
+    def get_source_mtime(self):
+        # Newest modification time of the atomic files, used to tell whether cached artifacts are stale.
+        return max((os.path.getmtime(path) for path in self.source_files if os.path.exists(path)), default=0.0)
+
     def get_validity(self):
         return self.valid
\ No newline at end of file
@@ -4,6 +4,10 @@ from recvizapi.Dataset import Dataset
 class DatasetManager:
     def __init__(self):
         dataset_path = os.environ['RECVIZ_DS_PATH']
+        # Interaction arrays are memory-mapped from here so every worker process shares one copy.
+        shared_dir = os.environ.get("RECVIZ_SHARED_PATH")
+        if shared_dir is None and "RECVIZ_CACHE_PATH" in os.environ:
+            shared_dir = os.path.join(os.environ["RECVIZ_CACHE_PATH"], "shared")
         self.datasets = {}
         for dataset_sub_dir in os.listdir(dataset_path):
             dataset_dir_path = os.path.join(dataset_path, dataset_sub_dir)
@@ -33,7 +37,8 @@ class DatasetManager:
                                         user_files,
                                         item_files,
                                         dataset_sub_dir,
-                                        models)
+                                        models,
+                                        shared_dir)
                     if loaded_ds.get_validity():
                         self.datasets[dataset_sub_dir] = {"dataset_obj": loaded_ds, "models": models}
 
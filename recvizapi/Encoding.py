@@ -0,0 +1,73 @@
+import json
+import gzip
+import numpy as np
+from recvizapi.Metrics import timed
+
+use_orjson = True
+use_brotli = True
+
+try:
+    import orjson
+except ImportError:
+    print("orjson is unavailable, will fall back to the standard library JSON encoder.")
+    use_orjson = False
+
+try:
+    import brotli
+except ImportError:
+    print("brotli is unavailable, responses will only be gzip compressed.")
+    use_brotli = False
+
+# Bodies smaller than this are sent as-is; compressing them costs more than it saves. Low levels are
+# used because payloads run to tens of megabytes and higher levels mostly trade seconds for a few percent.
+compress_min_bytes = 1024
+gzip_level = 1
+brotli_quality = 4
+
+def to_builtin(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def dumps(payload):
+    if use_orjson:
+        return orjson.dumps(payload, default=to_builtin, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(payload, default=to_builtin, separators=(",", ":")).encode()
+
+def accepted_encodings(accept_encoding):
+    # "gzip;q=0.5, br" -> {"gzip": 0.5, "br": 1.0}; q=0 means the client refuses that coding.
+    accepted = {}
+    for part in (accept_encoding or "").split(","):
+        fields = part.strip().split(";")
+        coding = fields[0].strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for field in fields[1:]:
+            name, _, value = field.strip().partition("=")
+            if name == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[coding] = quality
+    return accepted
+
+def encode_payload(payload, accept_encoding=None):
+    # Returns (body, content_encoding); content_encoding is None when the body is not compressed.
+    with timed("serialize"):
+        body = dumps(payload)
+    if len(body) < compress_min_bytes:
+        return body, None
+    accepted = accepted_encodings(accept_encoding)
+    brotli_q = accepted.get("br", accepted.get("*", 0))
+    gzip_q = accepted.get("gzip", accepted.get("*", 0))
+    if use_brotli and brotli_q > 0 and brotli_q >= gzip_q:
+        with timed("compress"):
+            return brotli.compress(body, quality=brotli_quality), "br"
+    if gzip_q > 0:
+        with timed("compress"):
+            return gzip.compress(body, compresslevel=gzip_level, mtime=0), "gzip"
+    return body, None
@@ -0,0 +1,174 @@
+import os
+import json
+import hashlib
+import numpy as np
+from recvizapi.Metrics import count_cache
+
+metric_names = ["recall", "precision", "ndcg", "mrr", "hit_rate"]
+
+def model_fingerprint(model_file):
+    stat = os.stat(model_file)
+    return hashlib.sha1(f"{os.path.abspath(model_file)}:{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()
+
+def ranking_metrics(hits, ground_truth_lengths):
+    # hits: (users x k) booleans, True where the recommendation at that rank is in the ground truth.
+    k = hits.shape[1]
+    hit_counts = hits.sum(axis=1)
+    discounts = 1 / np.log2(np.arange(2, k + 2))
+    ideal = np.concatenate(([0.0], np.cumsum(discounts)))[np.minimum(ground_truth_lengths, k)]
+    first_hit = hits.argmax(axis=1)
+    return {
+        "recall": hit_counts / np.maximum(ground_truth_lengths, 1),
+        "precision": hit_counts / k,
+        "ndcg": (hits * discounts).sum(axis=1) / np.maximum(ideal, 1e-12),
+        "mrr": np.where(hits.any(axis=1), 1 / (first_hit + 1), 0.0),
+        "hit_rate": hits.any(axis=1).astype(float),
+    }
+
+def bucket_labels(values, bins):
+    # bins use the same inclusive "x-y" syntax as the graph filters; unmatched values are dropped.
+    if not bins:
+        return [str(value) for value in values]
+    ranges = []
+    for bin_query in bins:
+        low, high = bin_query.split("-")
+        ranges.append((int(low), int(high), bin_query))
+    labels = []
+    for value in values:
+        label = None
+        try:
+            number = int(value)
+        except (TypeError, ValueError):
+            number = None
+        if number is not None:
+            for low, high, bin_query in ranges:
+                if low <= number <= high:
+                    label = bin_query
+                    break
+        labels.append(label)
+    return labels
+
+class EvaluationService:
+    def __init__(self, dataset_manager, recommendation_service, cache_dir=None):
+        self.dataset_manager = dataset_manager
+        self.recommendation_service = recommendation_service
+        self.cache_dir = cache_dir
+        self.cached = {}
+
+    def get_masked_items(self, dataset_name, model_name, user_ids):
+        # Items full_sort_topk leaves out of each user's recommendations, which can never count as hits.
+        config, model, dataset, train_data, valid_data, test_data, ds_obj = self.recommendation_service.load_model(dataset_name, model_name)
+        history_items = getattr(test_data, "uid2history_item", None)
+        if history_items is None:
+            return [set() for _ in user_ids]
+        masked = []
+        for uid in dataset.token2id(dataset.uid_field, list(user_ids)):
+            items = history_items[uid]
+            if items is None or len(items) == 0:
+                masked.append(set())
+            else:
+                masked.append(set(np.asarray(dataset.id2token(dataset.iid_field, np.asarray(items))).tolist()))
+        return masked
+
+    def get_ground_truth(self, ds_obj, user_ids, n, masked=None):
+        # The last n interactions of each user in timestamp order, without the items the model masks.
+        user_index = ds_obj.get_user_index()
+        history_index = ds_obj.get_history_index()
+        ground_truth = []
+        for position, user_id in enumerate(user_ids):
+            items = dict.fromkeys(history_index.tokens_of(history_index.entries(user_index[user_id], k=n)))
+            if masked is not None:
+                items = [item for item in items if item not in masked[position]]
+            ground_truth.append(list(items))
+        return ground_truth
+
+    def cache_prefix(self, dataset_name, model_name):
+        return f"{dataset_name}_{os.path.splitext(model_name)[0]}_eval_"
+
+    def invalidate_dataset(self, dataset_name, appended):
+        # The ground truth comes from the interaction histories, so every result of the dataset is stale.
+        for key in [key for key in self.cached if key[0] == dataset_name]:
+            del self.cached[key]
+        if self.cache_dir is None:
+            return
+        dsm_entry = self.dataset_manager.get_dataset(dataset_name)
+        prefixes = tuple(self.cache_prefix(dataset_name, model_name) for model_name in dsm_entry["dataset_obj"].get_models())
+        for file in os.listdir(self.cache_dir):
+            if prefixes and file.startswith(prefixes) and file.endswith(".json"):
+                os.remove(os.path.join(self.cache_dir, file))
+
+    def evaluate(self, dataset_name, model_name, k, n=1, group_by=None, bins=None, chunk_size=4096):
+        dsm_entry = self.dataset_manager.get_dataset(dataset_name)
+        if not dsm_entry or not dsm_entry["dataset_obj"].get_validity():
+            return None
+        ds_obj = dsm_entry["dataset_obj"]
+        models = ds_obj.get_models()
+        if model_name not in models:
+            return None
+
+        params = {"k": k, "n": n, "group_by": group_by, "bins": list(bins or [])}
+        cache_key = hashlib.sha1(json.dumps([model_fingerprint(models[model_name]), params]).encode()).hexdigest()
+        cache_path = None
+        if self.cache_dir is not None:
+            cache_path = os.path.join(self.cache_dir, f"{self.cache_prefix(dataset_name, model_name)}{cache_key}.json")
+        cache_key = (dataset_name, cache_key)
+        if cache_key in self.cached:
+            count_cache("evaluation", True)
+            return self.cached[cache_key]
+        if cache_path is not None and os.path.exists(cache_path):
+            count_cache("evaluation", True)
+            with open(cache_path, "r", encoding="utf-8") as f:
+                self.cached[cache_key] = json.load(f)
+            return self.cached[cache_key]
+        count_cache("evaluation", False)
+
+        user_ids = ds_obj.get_user_ids()
+        recs = np.asarray(self.recommendation_service.get_topk_tokens(dataset_name, model_name, k, user_ids)).astype(str)
+        ground_truth = self.get_ground_truth(ds_obj, user_ids, n, self.get_masked_items(dataset_name, model_name, user_ids))
+        ground_truth_lengths = np.array([len(items) for items in ground_truth])
+        width = max(ground_truth_lengths.max(initial=0), 1)
+        padded = np.full((len(user_ids), width), "", dtype=object)
+        for row, items in enumerate(ground_truth):
+            padded[row, :len(items)] = items
+
+        _, codes = np.unique(np.concatenate((recs.ravel(), padded.ravel().astype(str))), return_inverse=True)
+        rec_codes = codes[:recs.size].reshape(recs.shape)
+        truth_codes = codes[recs.size:].reshape(padded.shape)
+        truth_codes[padded == ""] = -1
+
+        hits = np.empty(recs.shape, dtype=bool)
+        for start in range(0, len(user_ids), chunk_size):
+            hits[start:start + chunk_size] = (
+                rec_codes[start:start + chunk_size, :, None] == truth_codes[start:start + chunk_size, None, :]
+            ).any(axis=2)
+
+        evaluated = ground_truth_lengths > 0
+        per_user = ranking_metrics(hits, ground_truth_lengths)
+        result = {
+            "k": k,
+            "n": n,
+            "users": int(evaluated.sum()),
+            "metrics": {name: float(per_user[name][evaluated].mean()) if evaluated.any() else 0.0 for name in metric_names},
+            "coverage": len(np.unique(rec_codes)) / max(len(ds_obj.get_item_ids()), 1),
+        }
+
+        if group_by is not None:
+            user_mapping = ds_obj.get_user_mapping()
+            labels = bucket_labels([user_mapping[user_id].get(group_by) for user_id in user_ids], bins)
+            labels = np.array([label if label is not None else "" for label in labels], dtype=object)
+            groups, group_codes = np.unique(labels[evaluated].astype(str), return_inverse=True)
+            group_sizes = np.bincount(group_codes, minlength=len(groups))
+            breakdown = {}
+            for name in metric_names:
+                sums = np.bincount(group_codes, weights=per_user[name][evaluated], minlength=len(groups))
+                for group, size, total in zip(groups, group_sizes, sums):
+                    if group == "":
+                        continue
+                    breakdown.setdefault(group, {"users": int(size)})[name] = float(total / size)
+            result["breakdown"] = {"feature": group_by, "groups": breakdown}
+
+        self.cached[cache_key] = result
+        if cache_path is not None:
+            with open(cache_path, "w", encoding="utf-8") as f:
+                json.dump(result, f)
+        return result
@@ -1,5 +1,7 @@
 import os
 import networkx as nx
+import numpy as np
+from recvizapi.Metrics import timed
 
 use_gpu_layout = True
 
@@ -9,8 +11,46 @@ except ImportError:
     print("cuGraph is unavailable, will fall back to CPU graph layout.")
     use_gpu_layout = False
 
+# A window laid out from the previous window's positions starts close to its equilibrium, and fewer
+# iterations keep nodes closer to where they were, which is what an animation needs.
+seeded_layout_iterations = 100
+
+class WindowEdges:
+    # Weighted user-item edges of the interactions with start <= timestamp < end. counts holds the window's
+    # interactions per distinct pair of the dataset; lo/hi bound the window in the time-sorted arrays.
+    def __init__(self, window, lo, hi, counts, distinct_pairs):
+        self.window = window
+        self.lo = lo
+        self.hi = hi
+        self.counts = counts
+        self.distinct_pairs = distinct_pairs
+
+    @classmethod
+    def from_arrays(cls, arrays, window, lo, hi):
+        counts = np.bincount(arrays["pair_ids"][lo:hi], minlength=len(arrays["distinct_pairs"])).astype(np.int32)
+        return cls(window, lo, hi, counts, arrays["distinct_pairs"])
+
+    def slide(self, arrays, window, lo, hi):
+        # Counts of [lo, hi) from this window's, adding and removing only the interactions that entered
+        # or left; this window's counts are left as they are.
+        if hi <= self.lo or lo >= self.hi:
+            return WindowEdges.from_arrays(arrays, window, lo, hi)
+        pair_ids = arrays["pair_ids"]
+        counts = self.counts.copy()
+        np.add.at(counts, pair_ids[lo:min(self.lo, hi)], 1)
+        np.add.at(counts, pair_ids[max(self.hi, lo):hi], 1)
+        np.subtract.at(counts, pair_ids[self.lo:min(lo, self.hi)], 1)
+        np.subtract.at(counts, pair_ids[max(hi, self.lo):self.hi], 1)
+        return WindowEdges(window, lo, hi, counts, self.distinct_pairs)
+
+    def edges(self):
+        # (pair codes, weights) of the pairs present in the window.
+        present = np.flatnonzero(self.counts)
+        return self.distinct_pairs[present], self.counts[present]
+
 class Graph:
-    def __init__(self, dataset_name, filters, cache_dir, graph_key, dataset_manager, skip_write=False):
+    def __init__(self, dataset_name, filters, cache_dir, graph_key, dataset_manager, skip_write=False, build=True,
+                 window_edges=None, seed_positions=None):
         self.dataset_name = dataset_name
         self.dataset_manager = dataset_manager
         self.user_nodes = {}
@@ -22,18 +62,34 @@ class Graph:
         self.graph_key = graph_key
         self.ds_obj = None
         self.ready = False
-        self.prepare_nodes()
-        self.assemble_graph()
-        self.layout_graph()
-        if not skip_write:
-            self.write_gexf()
+        # A WindowEdges replaces the full interaction history as the source of edges.
+        self.window_edges = window_edges
+        # {node id: (x, y)} from an earlier layout (the previous time window) to start the layout from.
+        self.seed_positions = seed_positions
+        # build=False leaves the stages to the caller (the benchmarks run them one at a time).
+        if build:
+            self.run_stages(layout=True, write=not skip_write)
+
+    def run_stages(self, layout=True, write=True):
+        # Community detection only needs the assembled graph, so callers can stop before the layout.
+        with timed("graph_prepare_nodes"):
+            self.prepare_nodes()
+        with timed("graph_assemble"):
+            self.assemble_graph()
+        if layout:
+            with timed("graph_layout"):
+                self.layout_graph()
+        if layout and write:
+            with timed("graph_write_gexf"):
+                self.write_gexf()
 
     def prepare_nodes(self):
         self.ds_obj = self.dataset_manager.get_dataset(self.dataset_name)["dataset_obj"]
         if self.ds_obj is not None:
+            # Node attributes (and the filter attributes added later) go on copies, not on the dataset's mappings.
             user_mapping = self.ds_obj.get_user_mapping()
             for user_id in user_mapping:
-                self.user_nodes[user_id] = user_mapping[user_id]
+                self.user_nodes[user_id] = dict(user_mapping[user_id])
                 self.user_nodes[user_id]['id'] = f"user-{user_id}"
                 self.user_nodes[user_id]['label'] = f"User {user_id}"
                 self.user_nodes[user_id]['type'] = "circle"
@@ -43,7 +99,7 @@ class Graph:
 
             item_mapping = self.ds_obj.get_item_mapping()
             for item_id in item_mapping:
-                self.item_nodes[item_id] = item_mapping[item_id]
+                self.item_nodes[item_id] = dict(item_mapping[item_id])
                 self.item_nodes[item_id]['id'] = f"item-{item_id}"
                 self.item_nodes[item_id]['label'] = f"Item {item_id}"
                 self.item_nodes[item_id]['x'] = 1
@@ -53,62 +109,8 @@ class Graph:
 
     def assemble_graph(self):
         self.nx_graph = nx.Graph()
-        timestamps = self.ds_obj.get_timestamps()
-        interaction_history = self.ds_obj.get_interaction_history()
         if self.filters:
-            users_to_include = set()
-            items_to_include = set()
-            for filter_feature, filter_queries in self.filters.items():
-                for filter_query in filter_queries:
-                    if "-" in filter_query:
-                        try:
-                            num1_str, num2_str = filter_query.split("-")
-                            num1 = int(num1_str)
-                            num2 = int(num2_str)
-                        except (TypeError, ValueError):
-                            continue
-                        for user_id in self.user_nodes:
-                            user = self.user_nodes[user_id]
-                            if filter_feature in user and num1 <= int(user[filter_feature]) <= num2:
-                                user["filter_feature"] = filter_feature
-                                user["filter_query"] = filter_query
-                                users_to_include.add(user_id)
-                                self.nx_graph.add_node(user["id"], **user)
-                        for item_id in self.item_nodes:
-                            item = self.item_nodes[item_id]
-                            if filter_feature in item and num1 <= int(item[filter_feature]) <= num2:
-                                item["filter_feature"] = filter_feature
-                                item["filter_query"] = filter_query
-                                items_to_include.add(item_id)
-                                self.nx_graph.add_node(item["id"], **item)
-                    else:
-                        for user_id in self.user_nodes:
-                            user = self.user_nodes[user_id]
-                            if filter_feature in user and str(user[filter_feature]) == filter_query:
-                                user["filter_feature"] = filter_feature
-                                user["filter_query"] = filter_query
-                                users_to_include.add(user_id)
-                                self.nx_graph.add_node(user["id"], **user)
-                        for item_id in self.item_nodes:
-                            item = self.item_nodes[item_id]
-                            if filter_feature in item and str(item[filter_feature]) == filter_query:
-                                item["filter_feature"] = filter_feature
-                                item["filter_query"] = filter_query
-                                items_to_include.add(item_id)
-
-            for timestamp in timestamps:
-                ts_interactions = interaction_history[timestamp]
-                for interaction in ts_interactions:
-                    if "user_id" in interaction and "item_id" in interaction and interaction["user_id"] in users_to_include and (interaction["item_id"] in items_to_include or not items_to_include):
-                        item = self.item_nodes[interaction["item_id"]]
-                        item_node_id = item["id"]
-                        self.nx_graph.add_node(item_node_id, **item)
-                        user_node_id = self.user_nodes[interaction["user_id"]]["id"]
-                        if self.nx_graph.has_edge(user_node_id, item_node_id):
-                            self.nx_graph.add_edge(user_node_id, item_node_id,
-                                                   self.nx_graph[user_node_id][item_node_id]['weight'] + 1)
-                        else:
-                            self.nx_graph.add_edge(user_node_id, item_node_id, weight=1)
+            users_to_include, items_to_include = self.add_filtered_nodes()
         else:
             for user_id in self.user_nodes:
                 node_attributes = self.user_nodes[user_id]
@@ -118,24 +120,96 @@ class Graph:
                 node_attributes = self.item_nodes[item_id]
                 self.nx_graph.add_node(node_attributes["id"], **node_attributes)
 
-            for timestamp in timestamps:
-                ts_interactions = interaction_history[timestamp]
-                for interaction in ts_interactions:
-                    if "user_id" in interaction and "item_id" in interaction:
-                        item = self.item_nodes[interaction["item_id"]]
-                        item_node_id = item["id"]
-                        user_node_id = self.user_nodes[interaction["user_id"]]["id"]
-                        if self.nx_graph.has_edge(user_node_id, item_node_id):
-                            self.nx_graph.add_edge(user_node_id, item_node_id,
-                                                   self.nx_graph[user_node_id][item_node_id]['weight'] + 1)
-                        else:
-                            self.nx_graph.add_edge(user_node_id, item_node_id, weight=1)
+        for user_id, item_id, weight in self.iter_interactions():
+            if self.filters:
+                if user_id not in users_to_include or (items_to_include and item_id not in items_to_include):
+                    continue
+                item = self.item_nodes[item_id]
+                self.nx_graph.add_node(item["id"], **item)
+            user_node_id = self.user_nodes[user_id]["id"]
+            item_node_id = self.item_nodes[item_id]["id"]
+            if self.nx_graph.has_edge(user_node_id, item_node_id):
+                self.nx_graph.add_edge(user_node_id, item_node_id,
+                                       weight=self.nx_graph[user_node_id][item_node_id]['weight'] + weight)
+            else:
+                self.nx_graph.add_edge(user_node_id, item_node_id, weight=weight)
 
         print("ASSEMBLED NX GRAPH WITH", self.nx_graph.number_of_nodes(), "NODES", self.nx_graph.number_of_edges(), "EDGES")
 
+    def add_filtered_nodes(self):
+        users_to_include = set()
+        items_to_include = set()
+        for filter_feature, filter_queries in self.filters.items():
+            for filter_query in filter_queries:
+                if "-" in filter_query:
+                    try:
+                        num1_str, num2_str = filter_query.split("-")
+                        num1 = int(num1_str)
+                        num2 = int(num2_str)
+                    except (TypeError, ValueError):
+                        continue
+                    for user_id in self.user_nodes:
+                        user = self.user_nodes[user_id]
+                        if filter_feature in user and num1 <= int(user[filter_feature]) <= num2:
+                            user["filter_feature"] = filter_feature
+                            user["filter_query"] = filter_query
+                            users_to_include.add(user_id)
+                            self.nx_graph.add_node(user["id"], **user)
+                    for item_id in self.item_nodes:
+                        item = self.item_nodes[item_id]
+                        if filter_feature in item and num1 <= int(item[filter_feature]) <= num2:
+                            item["filter_feature"] = filter_feature
+                            item["filter_query"] = filter_query
+                            items_to_include.add(item_id)
+                            self.nx_graph.add_node(item["id"], **item)
+                else:
+                    for user_id in self.user_nodes:
+                        user = self.user_nodes[user_id]
+                        if filter_feature in user and str(user[filter_feature]) == filter_query:
+                            user["filter_feature"] = filter_feature
+                            user["filter_query"] = filter_query
+                            users_to_include.add(user_id)
+                            self.nx_graph.add_node(user["id"], **user)
+                    for item_id in self.item_nodes:
+                        item = self.item_nodes[item_id]
+                        if filter_feature in item and str(item[filter_feature]) == filter_query:
+                            item["filter_feature"] = filter_feature
+                            item["filter_query"] = filter_query
+                            items_to_include.add(item_id)
+        return users_to_include, items_to_include
+
+    def select_nodes(self):
+        # The users and items the filters keep, and the items that are nodes even without edges, without
+        # assembling the graph.
+        self.prepare_nodes()
+        self.nx_graph = nx.Graph()
+        users_to_include, items_to_include = self.add_filtered_nodes()
+        item_nodes = {node[len("item-"):] for node in self.nx_graph.nodes if node.startswith("item-")}
+        self.nx_graph = None
+        return users_to_include, items_to_include, item_nodes
+
+    def iter_interactions(self):
+        # (user id, item id, weight) of every interaction, or of the window's edge table when there is one.
+        if self.window_edges is not None:
+            user_ids = self.ds_obj.get_user_ids()
+            item_ids = self.ds_obj.get_item_ids()
+            pairs, weights = self.window_edges.edges()
+            for pair, weight in zip(pairs.tolist(), weights.tolist()):
+                yield user_ids[pair // len(item_ids)], item_ids[pair % len(item_ids)], weight
+            return
+        user_ids = self.ds_obj.get_user_ids()
+        item_ids = self.ds_obj.get_item_ids()
+        matrix = self.ds_obj.get_interaction_matrix()
+        for row in range(matrix.shape[0]):
+            start, end = matrix.indptr[row], matrix.indptr[row + 1]
+            for col, weight in zip(matrix.indices[start:end].tolist(), matrix.data[start:end].tolist()):
+                yield user_ids[row], item_ids[col], weight
+
     def layout_graph(self):
         if self.nx_graph is not None:
             initial_positions = nx.circular_layout(self.nx_graph)
+            if self.seed_positions:
+                initial_positions = self.seeded_positions(initial_positions)
             for node, pos in initial_positions.items():
                 self.nx_graph.nodes[node]["x"] = pos[0]
                 self.nx_graph.nodes[node]["y"] = pos[1]
@@ -146,6 +220,9 @@ class Graph:
                     row["vertex"]: [row["x"], row["y"]]
                     for row in fa2_positions.to_dict(orient="records")
                 }
+            elif self.seed_positions:
+                fa2_pos_dict = nx.forceatlas2_layout(self.nx_graph, pos=initial_positions, gravity=10,
+                                                     max_iter=seeded_layout_iterations)
             else:
                 fa2_pos_dict = nx.forceatlas2_layout(self.nx_graph, gravity=10, max_iter=1500)
 
@@ -153,6 +230,23 @@ class Graph:
                 self.nx_graph.nodes[node]["x"] = pos[0]
                 self.nx_graph.nodes[node]["y"] = pos[1]
 
+    def seeded_positions(self, initial_positions):
+        # Nodes laid out before keep their place; new nodes start near the centre of their placed neighbours,
+        # offset by their circular position so they do not coincide.
+        positions = {node: np.asarray(self.seed_positions[node], dtype=float)
+                     for node in self.nx_graph.nodes if node in self.seed_positions}
+        if not positions:
+            return initial_positions
+        centre = np.mean(list(positions.values()), axis=0)
+        for node in self.nx_graph.nodes:
+            if node not in positions:
+                placed = [positions[neighbour] for neighbour in self.nx_graph.neighbors(node) if neighbour in positions]
+                positions[node] = (np.mean(placed, axis=0) if placed else centre) + initial_positions[node]
+        return positions
+
+    def get_positions(self):
+        return {node: (float(attributes["x"]), float(attributes["y"])) for node, attributes in self.nx_graph.nodes(data=True)}
+
     def get_louvain_parts(self):
         if self.nx_graph is not None:
             ret_parts = {}
@@ -171,10 +265,15 @@ class Graph:
 
     def write_gexf(self):
         self.gexf_path = os.path.join(self.cache_dir, self.graph_key + ".gexf")
+        # The history strings the frontend shows are only built for the file, not kept on the nodes.
         for node in self.nx_graph.nodes:
-            if "interaction_history" in self.nx_graph.nodes[node]:
-                del self.nx_graph.nodes[node]["interaction_history"]
+            if node.startswith("user-"):
+                history = self.ds_obj.get_user_history(node[len("user-"):])
+                if history is not None:
+                    self.nx_graph.nodes[node]["interaction_history_str"] = str(history)
         nx.write_gexf(self.nx_graph, self.gexf_path)
+        for node in self.nx_graph.nodes:
+            self.nx_graph.nodes[node].pop("interaction_history_str", None)
         print("WROTE GEXF", self.graph_key + ".gexf")
         self.ready = True
 
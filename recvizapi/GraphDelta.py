@@ -0,0 +1,75 @@
+import xml.etree.ElementTree as ET
+import numpy as np
+
+# Kept nodes whose position moved less than this share of the base layout's extent are not reported as moved.
+position_tolerance = 0.005
+
+attribute_types = {"long": int, "integer": int, "float": float, "double": float, "boolean": lambda value: value == "true"}
+
+def local_name(element):
+    return element.tag.rsplit("}", 1)[-1]
+
+def read_graph_tables(gexf_path):
+    # Streams a gexf written by Graph.write_gexf into {node id: {attribute: value}} (the label included) and
+    # {(source, target): weight}, with the endpoints of each undirected edge in sorted order.
+    attributes = {}
+    nodes = {}
+    edges = {}
+    for _, element in ET.iterparse(gexf_path, events=("end",)):
+        tag = local_name(element)
+        if tag == "attribute":
+            attributes[element.get("id")] = (element.get("title"), attribute_types.get(element.get("type"), str))
+        elif tag == "node":
+            values = {"label": element.get("label")}
+            for attvalue in element.iter():
+                if local_name(attvalue) == "attvalue" and attvalue.get("for") in attributes:
+                    title, cast = attributes[attvalue.get("for")]
+                    values[title] = cast(attvalue.get("value"))
+            nodes[element.get("id")] = values
+            element.clear()
+        elif tag == "edge":
+            source, target = sorted((element.get("source"), element.get("target")))
+            edges[(source, target)] = float(element.get("weight", 1))
+            element.clear()
+    return nodes, edges
+
+def layout_extent(nodes):
+    coordinates = np.array([(values["x"], values["y"]) for values in nodes.values() if "x" in values and "y" in values])
+    if not len(coordinates):
+        return 0.0
+    return float(np.linalg.norm(coordinates.max(axis=0) - coordinates.min(axis=0)))
+
+def graph_delta(base, target, tolerance=position_tolerance):
+    # base, target: (nodes, edges) from read_graph_tables. Nodes and edges only in target are added with all
+    # their attributes, those only in base are removed, and kept ones report the attributes that differ.
+    base_nodes, base_edges = base
+    target_nodes, target_edges = target
+    kept = base_nodes.keys() & target_nodes.keys()
+    min_move = tolerance * layout_extent(base_nodes)
+    moved = {}
+    changed = {}
+    for node in sorted(kept):
+        old, new = base_nodes[node], target_nodes[node]
+        if "x" in new and "y" in new and ("x" not in old or "y" not in old
+                                         or np.hypot(new["x"] - old["x"], new["y"] - old["y"]) > min_move):
+            moved[node] = [new["x"], new["y"]]
+        differences = {key: value for key, value in new.items() if key not in ("x", "y") and old.get(key) != value}
+        differences.update({key: None for key in old if key not in new})
+        if differences:
+            changed[node] = differences
+    kept_edges = base_edges.keys() & target_edges.keys()
+    return {
+        "nodes": {
+            "added": [{"id": node, **target_nodes[node]} for node in sorted(target_nodes.keys() - kept)],
+            "removed": sorted(base_nodes.keys() - kept),
+            "moved": moved,
+            "changed": changed,
+        },
+        "edges": {
+            "added": [[source, target, target_edges[(source, target)]]
+                      for source, target in sorted(target_edges.keys() - kept_edges)],
+            "removed": [list(edge) for edge in sorted(base_edges.keys() - kept_edges)],
+            "changed": [[source, target, target_edges[(source, target)]] for source, target in sorted(kept_edges)
+                        if base_edges[(source, target)] != target_edges[(source, target)]],
+        },
+    }
@@ -1,27 +1,136 @@
 import os
-from recvizapi.Graph import Graph
-
-def compute_graph_key(dataset_name, filters=None):
-    if filters is None:
-        return dataset_name
-    parts = []
-    for key in sorted(filters.keys()):
-        values = filters[key]
-        sorted_values = sorted(values)
-        parts.append(f"{key}:{','.join(sorted_values)}")
-    filters_str = "_".join(parts)
-    return f"{dataset_name}_{filters_str}"
+import re
+import json
+import hashlib
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import networkx as nx
+import numpy as np
+import scipy.sparse as sp
+from recvizapi.Graph import Graph, WindowEdges
+from recvizapi.GraphStats import graph_statistics
+from recvizapi.SimRank import SimRankIndex
+from recvizapi.AdjacencyIndex import AdjacencyIndex, read_layout
+from recvizapi.GraphDelta import read_graph_tables, graph_delta
+from recvizapi.Metrics import timed, count_cache
+
+# Parsed gexf files kept for computing deltas; filter iteration mostly diffs against the last few graphs.
+graph_table_cache_size = int(os.environ.get("RECVIZ_GRAPH_TABLE_CACHE", "4"))
+# Graphs, Louvain partitions and statistics of time windows, and graphs laid out from a delta base, are kept for
+# this many most recent entries and never written for later runs: every slider position or base is a new key.
+transient_cache_size = int(os.environ.get("RECVIZ_TRANSIENT_CACHE", "32"))
+transient_key_pattern = re.compile(r"(_t:[^_]*\.\.[^_]*(_louvain|_stats)?|_from:[0-9a-f]{12})$")
+
+def format_bound(bound):
+    return "" if bound is None else f"{bound:.17g}"
+
+def compute_graph_key(dataset_name, filters=None, window=None):
+    # An empty query string is the unfiltered graph, so it shares its cache files.
+    # window: (start, end) timestamps, either of them None for an open end.
+    graph_key = dataset_name
+    if filters:
+        parts = []
+        for key in sorted(filters.keys()):
+            values = filters[key]
+            sorted_values = sorted(values)
+            parts.append(f"{key}:{','.join(sorted_values)}")
+        filters_str = "_".join(parts)
+        graph_key = f"{dataset_name}_{filters_str}"
+    if window is not None:
+        graph_key += f"_t:{format_bound(window[0])}..{format_bound(window[1])}"
+    return graph_key
+
+def seeded_graph_key(graph_key, base_key):
+    # Key of the graph laid out starting from the positions of base_key's graph, which is a shorter layout than the
+    # one cached under graph_key itself.
+    return f"{graph_key}_from:{hashlib.sha1(base_key.encode()).hexdigest()[:12]}"
+
+def is_transient_key(key):
+    return transient_key_pattern.search(key) is not None
+
+def louvain_columnar(louvain_parts):
+    # {"user-<id>": community} -> parallel arrays of user ids and community numbers.
+    return {
+        "format": "columnar",
+        "users": [node[len("user-"):] if node.startswith("user-") else node for node in louvain_parts],
+        "communities": [int(community) for community in louvain_parts.values()],
+    }
+
+_worker_service = None
+
+def set_worker_service(graph_service):
+    # Process pool initializer; with fork the service and its loaded datasets are inherited, not pickled.
+    global _worker_service
+    _worker_service = graph_service
+
+def warm_in_worker(dataset_name, filters, force):
+    return _worker_service.warm(dataset_name, filters, force)
+
+# Graph pool jobs: functions are pickled by name, and the graph pool's fork server holds the service.
+
+def build_gexf_in_worker(dataset_name, filters, seed_path, graph_key):
+    return _worker_service.build_gexf(dataset_name, filters, seed_path, graph_key)
+
+# Window jobs get the window, not its edge counts: the fork server has already slid its counts to the latest window
+# the parent asked for (see refresh_worker_service), and the job continues from them.
+
+def build_window_gexf_in_worker(dataset_name, filters, window, seed_positions):
+    window_edges = _worker_service.get_window_edges(dataset_name, window)
+    return _worker_service.build_window_gexf(dataset_name, filters, window_edges, seed_positions)
+
+def louvain_in_worker(dataset_name, filters, window):
+    window_edges = None if window is None else _worker_service.get_window_edges(dataset_name, window)
+    return _worker_service.get_louvain(dataset_name, filters, window_edges)
+
+def build_simrank_in_worker(dataset_name, filters, graph_key):
+    # The parent loads the saved index rather than receiving the matrices through the pipe.
+    _worker_service.build_simrank(dataset_name, filters, graph_key)
+
+def refresh_worker_service(state):
+    # state: see GraphService.worker_state. The fork server reads the same appended interactions the parent has
+    # ingested, forgets the artifacts it cached of the datasets that changed, and slides its window edge counts to
+    # the latest window the parent asked for, which the jobs forked next inherit.
+    for dataset_name, dataset_offsets in state["offsets"].items():
+        ds_obj = _worker_service.dataset_manager.get_dataset(dataset_name)["dataset_obj"]
+        if ds_obj.ingest_appended(dataset_offsets)["appended"]:
+            _worker_service.forget_dataset(dataset_name)
+    for dataset_name, window in state["windows"].items():
+        _worker_service.get_window_edges(dataset_name, window)
 
 class GraphService:
-    def __init__(self, cache_path, dataset_manager):
+    def __init__(self, cache_path, dataset_manager, job_pool=None):
         if not os.path.exists(cache_path):
             raise EnvironmentError('Path read from RECVIZ_CACHE_PATH is invalid!')
         self.cached = {}
         self.cache_dir = cache_path
         self.dataset_manager = dataset_manager
+        # Pool the background SimRank builds go through (the graph pool of the views); a local thread without one.
+        self.job_pool = job_pool
+        self.simrank_jobs = {}
+        self.simrank_lock = threading.Lock()
+        self.simrank_executor = ThreadPoolExecutor(max_workers=1)
+        self.adjacency_cache = {}
+        # Most recent time window per dataset and the latest window layout per graph key without window,
+        # so consecutive windows only touch the interactions that changed and keep their node positions.
+        self.window_edges = {}
+        self.window_positions = {}
+        # Latest window per dataset sent to the graph pool, which its fork server slides its counts to.
+        self.latest_windows = {}
+        self.graph_tables = OrderedDict()
+        self.graph_tables_lock = threading.Lock()
+        self.transient_cache = OrderedDict()
+        self.transient_cache_lock = threading.Lock()
         for file in os.listdir(self.cache_dir):
-            if file.endswith('.gexf'):
+            if (file.endswith('.gexf') or file.endswith('.json')) and is_transient_key(os.path.splitext(file)[0]):
+                # Left over from an earlier run.
+                os.remove(os.path.join(self.cache_dir, file))
+            elif file.endswith('.gexf'):
                 self.cached[file[:-5]] = os.path.join(self.cache_dir, file)
+            elif file.endswith('_louvain.json') or file.endswith('_stats.json'):
+                with open(os.path.join(self.cache_dir, file), 'r', encoding='utf-8') as f:
+                    self.cached[file[:-5]] = json.load(f)
         print("CACHE:", self.cached)
 
     def get_graph(self, dataset_name, filters=None):
@@ -36,12 +145,345 @@ class GraphService:
                 self.cached[graph_key] = new_graph
                 return new_graph
 
-    def get_louvain(self, dataset_name, filters=None):
-        if filters is None and dataset_name + "_louvain" in self.cached:
+    def get_gexf_path(self, dataset_name, filters=None, window=None):
+        # Path of an already written gexf for the graph key, or None if it still has to be built.
+        gexf_path = self.find_gexf_path(compute_graph_key(dataset_name, filters, window))
+        count_cache("graph", gexf_path is not None)
+        return gexf_path
+
+    def cached_value(self, key):
+        if key in self.cached:
+            return self.cached[key]
+        with self.transient_cache_lock:
+            if key in self.transient_cache:
+                self.transient_cache.move_to_end(key)
+            return self.transient_cache.get(key)
+
+    def store_transient(self, key, value):
+        # Least recently used window entries are evicted, and the gexf files among them deleted.
+        with self.transient_cache_lock:
+            self.transient_cache[key] = value
+            self.transient_cache.move_to_end(key)
+            evicted = []
+            while len(self.transient_cache) > transient_cache_size:
+                evicted.append(self.transient_cache.popitem(last=False)[1])
+        for value in evicted:
+            if isinstance(value, str) and value.endswith(".gexf") and os.path.exists(value):
+                os.remove(value)
+
+    def find_gexf_path(self, graph_key):
+        graph = self.cached_value(graph_key)
+        if isinstance(graph, str) and graph.endswith(".gexf"):
+            return graph
+        if isinstance(graph, Graph) and graph.is_ready():
+            return graph.get_gexf_path()
+        return None
+
+    def build_gexf(self, dataset_name, filters=None, seed_path=None, graph_key=None):
+        # seed_path: gexf of a cached graph whose node positions the layout starts from, so a graph
+        # requested as a delta against it keeps its shared nodes close to where the client has them.
+        # The seeded graph is written under graph_key (see seeded_graph_key).
+        if seed_path is None:
+            graph = self.get_graph(dataset_name, filters)
+            return graph if isinstance(graph, str) else graph.get_gexf_path()
+        graph = Graph(dataset_name, filters, self.cache_dir, graph_key, self.dataset_manager,
+                      build=False, seed_positions=read_layout(seed_path))
+        graph.run_stages()
+        return graph.get_gexf_path()
+
+    def get_graph_tables(self, gexf_path):
+        # Parsed (nodes, edges) of a gexf, least recently used ones evicted; a rewritten file is parsed again.
+        mtime = os.path.getmtime(gexf_path)
+        with self.graph_tables_lock:
+            entry = self.graph_tables.get(gexf_path)
+        count_cache("graph_tables", entry is not None and entry[0] == mtime)
+        if entry is None or entry[0] != mtime:
+            with timed("graph_tables_parse"):
+                entry = (mtime, read_graph_tables(gexf_path))
+        with self.graph_tables_lock:
+            self.graph_tables[gexf_path] = entry
+            self.graph_tables.move_to_end(gexf_path)
+            while len(self.graph_tables) > graph_table_cache_size:
+                self.graph_tables.popitem(last=False)
+        return entry[1]
+
+    def get_graph_delta(self, base_path, gexf_path):
+        base = self.get_graph_tables(base_path)
+        target = self.get_graph_tables(gexf_path)
+        with timed("graph_delta"):
+            return graph_delta(base, target)
+
+    def get_window_edges(self, dataset_name, window):
+        ds_obj = self.dataset_manager.get_dataset(dataset_name)["dataset_obj"]
+        arrays = ds_obj.get_interaction_arrays()
+        lo, hi = ds_obj.get_window_bounds(*window)
+        previous = self.window_edges.get(dataset_name)
+        if previous is not None and previous.window == window:
+            return previous
+        with timed("window_edges"):
+            if previous is None:
+                window_edges = WindowEdges.from_arrays(arrays, window, lo, hi)
+            else:
+                window_edges = previous.slide(arrays, window, lo, hi)
+        self.window_edges[dataset_name] = window_edges
+        return window_edges
+
+    def get_window_positions(self, dataset_name, filters):
+        return self.window_positions.get(compute_graph_key(dataset_name, filters))
+
+    def build_window_gexf(self, dataset_name, filters, window_edges, seed_positions=None):
+        # Returns the gexf path and the node positions, which seed the layout of the next window.
+        graph_key = compute_graph_key(dataset_name, filters, window_edges.window)
+        graph = Graph(dataset_name, filters, self.cache_dir, graph_key, self.dataset_manager, build=False,
+                      window_edges=window_edges, seed_positions=seed_positions)
+        graph.run_stages()
+        return {"gexf_path": graph.get_gexf_path(), "positions": graph.get_positions()}
+
+    def store_window_positions(self, dataset_name, filters, positions):
+        self.window_positions[compute_graph_key(dataset_name, filters)] = positions
+
+    def get_cached_louvain(self, dataset_name, filters=None, window=None):
+        louvain_parts = self.cached_value(compute_graph_key(dataset_name, filters, window) + "_louvain")
+        count_cache("louvain", louvain_parts is not None)
+        return louvain_parts
+
+    def store(self, dataset_name, filters, value, suffix="", window=None):
+        # Records an artifact built elsewhere (e.g. in a worker process) under the graph key.
+        if window is not None:
+            self.store_transient(compute_graph_key(dataset_name, filters, window) + suffix, value)
+        else:
+            self.cached[compute_graph_key(dataset_name, filters) + suffix] = value
+
+    def get_louvain_path(self, graph_key):
+        return os.path.join(self.cache_dir, graph_key + "_louvain.json")
+
+    def build_louvain(self, graph, graph_key):
+        with timed("louvain"):
+            louvain_parts = {node: int(community) for node, community in graph.get_louvain_parts().items()}
+        if is_transient_key(graph_key):
+            self.store_transient(graph_key + "_louvain", louvain_parts)
+            return louvain_parts
+        with open(self.get_louvain_path(graph_key), 'w', encoding='utf-8') as f:
+            json.dump(louvain_parts, f)
+        self.cached[graph_key + "_louvain"] = louvain_parts
+        return louvain_parts
+
+    def get_louvain(self, dataset_name, filters=None, window_edges=None):
+        if filters is None and window_edges is None and dataset_name + "_louvain" in self.cached:
             return self.cached[dataset_name + "_louvain"]
         else:
-            graph_key = compute_graph_key(dataset_name, filters)
-            if graph_key + "_louvain" not in self.cached:
-                new_graph = Graph(dataset_name, filters, self.cache_dir, graph_key, self.dataset_manager, skip_write=True)
-                self.cached[graph_key + "_louvain"] = new_graph.get_louvain_parts()
-            return self.cached[graph_key + "_louvain"]
\ No newline at end of file
+            graph_key = compute_graph_key(dataset_name, filters, None if window_edges is None else window_edges.window)
+            louvain_parts = self.cached_value(graph_key + "_louvain")
+            if louvain_parts is None:
+                # Communities do not depend on node positions, so the layout is skipped.
+                new_graph = Graph(dataset_name, filters, self.cache_dir, graph_key, self.dataset_manager, build=False,
+                                  window_edges=window_edges)
+                new_graph.run_stages(layout=False)
+                louvain_parts = self.build_louvain(new_graph, graph_key)
+            return louvain_parts
+
+    def get_graph_matrix(self, dataset_name, filters=None, window_edges=None):
+        # users x items matrix of edge weights of the graph for filters (and window), and the item ids of its
+        # columns: the nodes and edges Graph.assemble_graph would add, taken from the interaction matrix instead.
+        ds_obj = self.dataset_manager.get_dataset(dataset_name)["dataset_obj"]
+        item_ids = ds_obj.get_item_ids()
+        if window_edges is None:
+            counts = ds_obj.get_interaction_matrix()
+        else:
+            pairs, weights = window_edges.edges()
+            counts = sp.csr_matrix((weights.astype(np.float32), (pairs // len(item_ids), pairs % len(item_ids))),
+                                   shape=(len(ds_obj.get_user_ids()), len(item_ids)))
+        if not filters:
+            return counts, item_ids
+        graph = Graph(dataset_name, filters, self.cache_dir, compute_graph_key(dataset_name, filters), self.dataset_manager,
+                      build=False)
+        users, items, item_nodes = graph.select_nodes()
+        user_index = ds_obj.get_user_index()
+        item_index = ds_obj.get_item_index()
+        counts = counts[np.array(sorted(user_index[user_id] for user_id in users), dtype=np.int64)]
+        if items:
+            kept = np.zeros(len(item_ids), dtype=bool)
+            kept[[item_index[item_id] for item_id in items]] = True
+            counts = counts.multiply(kept[np.newaxis, :]).tocsr()
+            counts.eliminate_zeros()
+        cols = np.union1d(counts.indices, [item_index[item_id] for item_id in item_nodes]).astype(np.int64)
+        return counts[:, cols], [item_ids[col] for col in cols.tolist()]
+
+    def get_stats_path(self, graph_key):
+        return os.path.join(self.cache_dir, graph_key + "_stats.json")
+
+    def get_cached_graph_stats(self, dataset_name, filters=None, window=None):
+        stats = self.cached_value(compute_graph_key(dataset_name, filters, window) + "_stats")
+        count_cache("graph_stats", stats is not None)
+        return stats
+
+    def build_graph_stats(self, dataset_name, filters=None, window_edges=None):
+        graph_key = compute_graph_key(dataset_name, filters, None if window_edges is None else window_edges.window)
+        with timed("graph_stats"):
+            counts, item_ids = self.get_graph_matrix(dataset_name, filters, window_edges)
+            stats = {"graph_key": graph_key, **graph_statistics(counts, item_ids)}
+        if window_edges is not None:
+            self.store_transient(graph_key + "_stats", stats)
+            return stats
+        with open(self.get_stats_path(graph_key), 'w', encoding='utf-8') as f:
+            json.dump(stats, f)
+        self.cached[graph_key + "_stats"] = stats
+        return stats
+
+    def is_fresh(self, path, dataset_name):
+        if not os.path.exists(path):
+            return False
+        ds_obj = self.dataset_manager.get_dataset(dataset_name)["dataset_obj"]
+        return os.path.getmtime(path) >= ds_obj.get_source_mtime()
+
+    def warm(self, dataset_name, filters=None, force=False):
+        # Builds the gexf (graph plus layout) and the Louvain partition of one graph key from a single
+        # assembled graph, skipping artifacts newer than the dataset files unless forced.
+        graph_key = compute_graph_key(dataset_name, filters)
+        gexf_path = os.path.join(self.cache_dir, graph_key + ".gexf")
+        need_gexf = force or not self.is_fresh(gexf_path, dataset_name)
+        need_louvain = force or not self.is_fresh(self.get_louvain_path(graph_key), dataset_name)
+        need_stats = force or not self.is_fresh(self.get_stats_path(graph_key), dataset_name)
+        report = {"graph_key": graph_key, "built": [], "seconds": {}}
+        if need_gexf or need_louvain:
+            start = time.perf_counter()
+            graph = Graph(dataset_name, filters, self.cache_dir, graph_key, self.dataset_manager, build=False)
+            graph.run_stages(layout=need_gexf, write=need_gexf)
+            if need_gexf:
+                self.cached[graph_key] = gexf_path
+                report["built"].append("gexf")
+                report["seconds"]["gexf"] = time.perf_counter() - start
+            if need_louvain:
+                louvain_start = time.perf_counter()
+                self.build_louvain(graph, graph_key)
+                report["built"].append("louvain")
+                report["seconds"]["louvain"] = time.perf_counter() - louvain_start
+            report["nodes"] = graph.nx_graph.number_of_nodes()
+            report["edges"] = graph.nx_graph.number_of_edges()
+        if need_stats:
+            # The statistics come from the interaction matrix, not the assembled graph.
+            stats_start = time.perf_counter()
+            stats = self.build_graph_stats(dataset_name, filters)
+            report["built"].append("stats")
+            report["seconds"]["stats"] = time.perf_counter() - stats_start
+            report.setdefault("nodes", stats["users"] + stats["items"])
+            report.setdefault("edges", stats["edges"])
+        return report
+
+    def build_simrank(self, dataset_name, filters, graph_key):
+        # SimRank only follows the edges, so the graph is assembled without a layout.
+        graph = Graph(dataset_name, filters, self.cache_dir, graph_key, self.dataset_manager, build=False)
+        graph.run_stages(layout=False)
+        index = SimRankIndex(os.path.join(self.cache_dir, graph_key + "_simrank"))
+        with timed("simrank_build"):
+            index.build_from_graph(graph.nx_graph, lambda node: str(node).startswith("user-"))
+        index.save()
+        print("BUILT SIMRANK", graph_key, index.mode)
+        return index
+
+    def get_simrank(self, dataset_name, filters=None):
+        # Returns the SimRank index of the graph, or None while its background job is still running. The job
+        # writes the index file, which is loaded once the job is done; a failed job raises here once.
+        graph_key = compute_graph_key(dataset_name, filters)
+        count_cache("simrank", graph_key + "_simrank" in self.cached)
+        if graph_key + "_simrank" in self.cached:
+            return self.cached[graph_key + "_simrank"]
+        with self.simrank_lock:
+            job = self.simrank_jobs.get(graph_key)
+            if job is not None and not job.done():
+                return None
+            if job is not None:
+                del self.simrank_jobs[graph_key]
+                job.result()
+            index = SimRankIndex(os.path.join(self.cache_dir, graph_key + "_simrank"))
+            if index.load():
+                self.cached[graph_key + "_simrank"] = index
+                return index
+            if self.job_pool is None:
+                self.simrank_jobs[graph_key] = self.simrank_executor.submit(self.build_simrank, dataset_name, filters, graph_key)
+            else:
+                self.simrank_jobs[graph_key] = self.job_pool.submit(build_simrank_in_worker, dataset_name, filters, graph_key)
+            return None
+
+    def dataset_offsets(self):
+        return {dataset_name: dict(self.dataset_manager.get_dataset(dataset_name)["dataset_obj"].inter_offsets)
+                for dataset_name in self.dataset_manager.get_available_datasets()}
+
+    def worker_state(self):
+        # State the graph pool's fork server catches up to before each job (see refresh_worker_service): the read
+        # positions in the .inter files and the latest window of each dataset.
+        return {"offsets": self.dataset_offsets(), "windows": dict(self.latest_windows)}
+
+    def get_adjacency_index(self, dataset_name):
+        count_cache("adjacency_index", dataset_name in self.adjacency_cache)
+        if dataset_name not in self.adjacency_cache:
+            ds_obj = self.dataset_manager.get_dataset(dataset_name)["dataset_obj"]
+            counts = ds_obj.get_interaction_matrix()
+            index = AdjacencyIndex(os.path.join(self.cache_dir, dataset_name + "_adjacency"))
+            if not index.load((counts.shape[0], counts.shape[1], counts.nnz)):
+                with timed("adjacency_index_build"):
+                    index.build(counts, ds_obj.get_user_ids(), ds_obj.get_item_ids())
+                index.save()
+                print("BUILT ADJACENCY INDEX", dataset_name)
+            self.adjacency_cache[dataset_name] = index
+        index = self.adjacency_cache[dataset_name]
+        # Positions are taken from the unfiltered layout once it has been written (again when it is rewritten).
+        graph = self.cached.get(dataset_name)
+        if graph is not None and not isinstance(graph, str):
+            graph = graph.get_gexf_path() if graph.is_ready() else None
+        if graph is not None and os.path.exists(graph) and index.attach_layout(graph):
+            index.save()
+        return index
+
+    def owns_key(self, dataset_name, key):
+        # Whether a cache key or file name belongs to dataset_name rather than to another dataset whose name
+        # starts with it: the longest dataset name the key starts with (followed by "_", "." or the end) wins.
+        owners = [name for name in self.dataset_manager.get_available_datasets()
+                  if key == name or key.startswith(name + "_") or key.startswith(name + ".")]
+        return max(owners, key=len, default=None) == dataset_name
+
+    def forget_dataset(self, dataset_name):
+        for key in [key for key in self.cached if self.owns_key(dataset_name, key)]:
+            del self.cached[key]
+        with self.transient_cache_lock:
+            for key in [key for key in self.transient_cache if self.owns_key(dataset_name, key)]:
+                del self.transient_cache[key]
+        with self.simrank_lock:
+            for key in [key for key in self.simrank_jobs if self.owns_key(dataset_name, key)]:
+                del self.simrank_jobs[key]
+        self.window_edges.pop(dataset_name, None)
+
+    def invalidate_dataset(self, dataset_name, appended):
+        # appended: summary of Dataset.append_rows. Graphs, Louvain partitions, statistics and SimRank indexes of the
+        # dataset are dropped with their files and rebuilt on request; the adjacency index gets the new edge weights.
+        self.forget_dataset(dataset_name)
+        for file in os.listdir(self.cache_dir):
+            if (file.endswith(".gexf") or file.endswith("_louvain.json") or file.endswith("_stats.json") or "_simrank" in file) \
+                    and self.owns_key(dataset_name, file):
+                os.remove(os.path.join(self.cache_dir, file))
+        if dataset_name in self.adjacency_cache:
+            with timed("adjacency_index_update"):
+                self.adjacency_cache[dataset_name].add(appended["delta"])
+            self.adjacency_cache[dataset_name].save()
+        else:
+            AdjacencyIndex(os.path.join(self.cache_dir, dataset_name + "_adjacency")).remove()
+
+    def get_neighbourhood(self, dataset_name, node, hops=1, caps=None, max_nodes=None, columnar=False):
+        index = self.get_adjacency_index(dataset_name)
+        with timed("neighbourhood_query"):
+            rows, depths, truncated = index.neighbourhood(node, hops, caps, max_nodes)
+            sources, targets, weights = index.edges(rows)
+        with timed("neighbourhood_layout"):
+            x, y, layout = index.layout(rows, depths, sources, targets, weights)
+        ids = index.nodes[rows].tolist()
+        payload = {"center": node, "hops": hops, "truncated": truncated, "layout": layout}
+        if columnar:
+            # Edge endpoints are positions in the node columns.
+            payload["nodes"] = {"id": ids, "hop": depths.tolist(), "x": x.tolist(), "y": y.tolist()}
+            payload["edges"] = {"source": sources.tolist(), "target": targets.tolist(), "weight": weights.tolist()}
+        else:
+            payload["nodes"] = [{"id": node_id, "hop": hop, "x": node_x, "y": node_y}
+                                for node_id, hop, node_x, node_y in zip(ids, depths.tolist(), x.tolist(), y.tolist())]
+            payload["edges"] = [[ids[source], ids[target], weight]
+                                for source, target, weight in zip(sources.tolist(), targets.tolist(), weights.tolist())]
+        return payload
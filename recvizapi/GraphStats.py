@@ -0,0 +1,67 @@
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import connected_components
+
+# Most interacted items listed by id; the rest of the popularity curve is in the histogram.
+top_items = 20
+# Largest connected components listed by size; the rest are in the size distribution.
+top_components = 10
+
+def distribution(values):
+    # Distinct integer values and how many nodes have each, for exact degree distributions.
+    values, counts = np.unique(np.asarray(values, dtype=np.int64), return_counts=True)
+    return {"values": values.tolist(), "counts": counts.tolist()}
+
+def log_histogram(values):
+    # Counts over [0, 1), [1, 2), [2, 4), [4, 8), ...; the bins list holds their edges.
+    values = np.asarray(values, dtype=np.int64)
+    top = int(values.max()) if len(values) else 0
+    edges = np.concatenate([[0], 2 ** np.arange(int(np.log2(top)) + 2 if top else 1)])
+    counts, _ = np.histogram(values, bins=edges)
+    return {"bins": edges.tolist(), "counts": counts.tolist()}
+
+def summary(values):
+    if not len(values):
+        return {"min": 0, "max": 0, "mean": 0.0, "median": 0.0}
+    return {"min": int(values.min()), "max": int(values.max()), "mean": float(values.mean()),
+            "median": float(np.median(values))}
+
+def graph_statistics(counts, item_ids):
+    # Statistics of the bipartite graph whose users x items CSR matrix of edge weights (interaction counts)
+    # is counts; item_ids names its columns.
+    counts = sp.csr_matrix(counts)
+    n_users, n_items = counts.shape
+    user_degree = np.diff(counts.indptr)
+    item_degree = np.bincount(counts.indices, minlength=n_items)
+    user_activity = np.asarray(counts.sum(axis=1)).ravel()
+    item_popularity = np.asarray(counts.sum(axis=0)).ravel()
+    top = np.lexsort((np.arange(n_items), -item_popularity))[:top_items]
+
+    if n_users and n_items:
+        adjacency = sp.bmat([[None, counts], [counts.T, None]], format="csr")
+        _, labels = connected_components(adjacency, directed=False)
+        sizes = np.bincount(labels)
+    else:
+        # Without the other side there are no edges and every node is a component of its own.
+        sizes = np.ones(n_users + n_items, dtype=np.int64)
+    largest = np.sort(sizes)[::-1]
+
+    return {
+        "users": n_users,
+        "items": n_items,
+        "edges": int(counts.nnz),
+        "interactions": int(counts.sum()),
+        "density": counts.nnz / (n_users * n_items) if n_users and n_items else 0.0,
+        "user_degree": {**summary(user_degree), "distribution": distribution(user_degree)},
+        "item_degree": {**summary(item_degree), "distribution": distribution(item_degree)},
+        "user_activity": {**summary(user_activity), "histogram": log_histogram(user_activity)},
+        "item_popularity": {**summary(item_popularity), "histogram": log_histogram(item_popularity),
+                            "top": [[item_ids[col], int(item_popularity[col]), int(item_degree[col])] for col in top.tolist()]},
+        "components": {
+            "count": len(sizes),
+            "largest": largest[:top_components].tolist(),
+            "largest_share": float(largest[0] / (n_users + n_items)) if len(sizes) else 0.0,
+            "isolated": int((sizes == 1).sum()),
+            "size_distribution": distribution(sizes),
+        },
+    }
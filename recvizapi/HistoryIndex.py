@@ -0,0 +1,89 @@
+import numpy as np
+
+# Item feature the history endpoints show; items without it are named by their id.
+title_field = "movie_title"
+
+def history_arrays(rows, codes, timestamps, n_users, field_codes=None):
+    # CSR arrays from one entry per interaction (user row, item code, timestamp and a row of other field value
+    # codes) in file order. Each user's entries are sorted by timestamp, interactions with equal timestamps keeping
+    # their file order.
+    rows = np.asarray(rows, dtype=np.int64)
+    order = np.lexsort((timestamps, rows))
+    if field_codes is None:
+        field_codes = np.empty((len(rows), 0), dtype=np.int32)
+    return {
+        "history_indptr": np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=n_users))]).astype(np.int64),
+        "history_items": np.asarray(codes, dtype=np.int32)[order],
+        "history_timestamps": np.asarray(timestamps, dtype=np.float64)[order],
+        "history_field_codes": np.asarray(field_codes, dtype=np.int32).reshape(len(rows), -1)[order],
+    }
+
+class HistoryIndex:
+    # Per-user interaction histories: the entries of user row r are items[indptr[r]:indptr[r + 1]] with their
+    # timestamps and the values of the other .inter fields (field_names) in the rows of field_codes, as codes into
+    # field_values so a long value is stored once. Item codes index item_ids, then unknown_items for the items
+    # missing from the item files, and titles / tokens hold one title / item id per code, so a slice of codes
+    # resolves them in one lookup.
+    def __init__(self, indptr, items, timestamps, item_ids, unknown_items, item_mapping, field_codes=None,
+                 field_values=(), field_names=()):
+        self.indptr = indptr
+        self.items = items
+        self.timestamps = timestamps
+        self.field_codes = np.empty((len(items), 0), dtype=np.int32) if field_codes is None else field_codes
+        self.field_values = np.asarray(field_values, dtype=str)
+        self.field_names = list(field_names)
+        self.tokens = np.array(list(item_ids) + list(unknown_items), dtype=object)
+        self.titles = np.array([item_mapping[item_id].get(title_field, f"Unknown ID {item_id}") for item_id in item_ids]
+                               + [f"Unknown ID {item_id}" for item_id in unknown_items], dtype=object)
+
+    def length(self, row):
+        return int(self.indptr[row + 1] - self.indptr[row])
+
+    def user_rows(self):
+        # The user row of every entry.
+        return np.repeat(np.arange(len(self.indptr) - 1, dtype=np.int64), np.diff(self.indptr))
+
+    def records(self, row):
+        # A user's interactions in timestamp order as {"item_id": ..., <other field>: ...} dicts.
+        lo, hi = int(self.indptr[row]), int(self.indptr[row + 1])
+        return [{"item_id": token, **dict(zip(self.field_names, values))}
+                for token, values in zip(self.tokens[self.items[lo:hi]].tolist(),
+                                         self.field_values[self.field_codes[lo:hi]].tolist())]
+
+    def entries(self, row, k=None, start=None, end=None):
+        # View of the item codes of a user's interactions with start <= timestamp < end, the last k of them with k.
+        lo, hi = int(self.indptr[row]), int(self.indptr[row + 1])
+        timestamps = self.timestamps[lo:hi]
+        if end is not None:
+            hi = lo + int(np.searchsorted(timestamps, end, side="left"))
+        if start is not None:
+            lo = min(hi, lo + int(np.searchsorted(timestamps, start, side="left")))
+        if k is not None:
+            lo = max(lo, hi - k)
+        return self.items[lo:hi]
+
+    def titles_of(self, codes):
+        return self.titles[codes].tolist()
+
+    def tokens_of(self, codes):
+        return self.tokens[codes].tolist()
+
+    def add(self, rows, codes, timestamps, field_codes=None, field_values=None):
+        # Inserts appended interactions of known items after the user's entries with equal or earlier timestamps.
+        # field_values is the whole value vocabulary when the field codes of the new entries extend it.
+        if field_codes is None:
+            field_codes = np.empty((len(rows), 0), dtype=np.int32)
+        if field_values is not None and len(field_values) != len(self.field_values):
+            self.field_values = np.asarray(field_values, dtype=str)
+        order = np.lexsort((timestamps, rows))
+        rows, codes, timestamps = rows[order], codes[order], timestamps[order]
+        field_codes = np.asarray(field_codes, dtype=np.int32).reshape(len(order), -1)[order]
+        positions = np.array([self.indptr[row] + np.searchsorted(self.timestamps[self.indptr[row]:self.indptr[row + 1]],
+                                                                 timestamp, side="right")
+                              for row, timestamp in zip(rows.tolist(), timestamps.tolist())], dtype=np.int64)
+        self.items = np.insert(self.items, positions, codes.astype(self.items.dtype))
+        self.timestamps = np.insert(self.timestamps, positions, timestamps)
+        self.field_codes = np.insert(self.field_codes, positions, field_codes, axis=0)
+        added = np.bincount(rows, minlength=len(self.indptr) - 1)
+        self.indptr = self.indptr + np.concatenate([[0], np.cumsum(added)])
+        return self
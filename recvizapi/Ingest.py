@@ -0,0 +1,71 @@
+import os
+import threading
+from recvizapi.Metrics import timed
+
+# Seconds between scans of the .inter files for appended lines; the background scan is off when 0.
+ingest_interval = float(os.environ.get("RECVIZ_INGEST_INTERVAL", "0"))
+# Comma separated client addresses allowed to post interactions; the endpoint refuses everyone when empty.
+ingest_clients = {client.strip() for client in os.environ.get("RECVIZ_INGEST_CLIENTS", "").split(",") if client.strip()}
+
+def is_allowed(request):
+    return request.META.get("REMOTE_ADDR", "") in ingest_clients
+
+class Ingestor:
+    # Brings appended interactions into the loaded datasets and tells the services which caches went stale.
+    # services: objects with invalidate_dataset(dataset_name, appended).
+    def __init__(self, dataset_manager, services):
+        self.dataset_manager = dataset_manager
+        self.services = services
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def apply(self, dataset_name, appended):
+        if appended["appended"]:
+            with timed("ingest_invalidate"):
+                for service in self.services:
+                    service.invalidate_dataset(dataset_name, appended)
+            print("INGESTED", dataset_name, appended["appended"], "INTERACTIONS,", appended["skipped"], "SKIPPED")
+        return {"dataset": dataset_name, "appended": appended["appended"], "skipped": appended["skipped"],
+                "new_pairs": appended["new_pairs"], "users": len(appended["users"]), "items": len(appended["items"])}
+
+    def ingest(self, dataset_name):
+        # Reads whatever was appended to the dataset's .inter files since they were last read.
+        ds_obj = self.dataset_manager.get_dataset(dataset_name)["dataset_obj"]
+        with self.lock:
+            with timed("ingest"):
+                return self.apply(dataset_name, ds_obj.ingest_appended())
+
+    def append(self, dataset_name, records):
+        # Writes records to the dataset's .inter file, so they survive a restart, then ingests them
+        # together with anything else appended in the meantime.
+        ds_obj = self.dataset_manager.get_dataset(dataset_name)["dataset_obj"]
+        with self.lock:
+            with timed("ingest"):
+                written, left_out = ds_obj.write_interactions(records)
+                report = self.apply(dataset_name, ds_obj.ingest_appended())
+        report["written"] = written
+        report["skipped"] += left_out
+        return report
+
+    def ingest_all(self):
+        return [self.ingest(dataset_name) for dataset_name in self.dataset_manager.get_available_datasets()]
+
+    def run(self, interval):
+        while not self.stopped.wait(interval):
+            try:
+                self.ingest_all()
+            except Exception as e:
+                print("INGEST FAILED:", e)
+
+    def start(self, interval=ingest_interval):
+        if interval <= 0 or self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self.run, args=(interval,), daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
@@ -0,0 +1,188 @@
+import os
+import time
+import resource
+import threading
+import contextvars
+from contextlib import contextmanager
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+stage_buckets = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300]
+
+_lock = threading.Lock()
+# (histogram name, sorted label items) -> [bucket counts..., count, sum]
+_histograms = {}
+# (name, sorted label items) -> value
+_counters = {}
+_gauge_callbacks = {}
+# Per-request list of (stage, seconds), read by ServerTimingMiddleware.
+request_timings = contextvars.ContextVar("recviz_request_timings", default=None)
+
+def observe_histogram(name, labels, seconds):
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        stats = _histograms.setdefault(key, [0] * (len(stage_buckets) + 2))
+        for idx, bound in enumerate(stage_buckets):
+            if seconds <= bound:
+                stats[idx] += 1
+        stats[-2] += 1
+        stats[-1] += seconds
+
+def observe(stage, seconds):
+    observe_histogram("recviz_stage_seconds", {"stage": stage}, seconds)
+    timings = request_timings.get()
+    if timings is not None:
+        timings.append((stage, seconds))
+
+@contextmanager
+def timed(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+def increment(name, amount=1, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+def count_cache(cache, hit):
+    increment("recviz_cache_requests_total", cache=cache, result="hit" if hit else "miss")
+
+def register_gauge(name, callback, help_text=""):
+    # callback returns a number, or a dict of {label value tuple: number} for labelled gauges.
+    _gauge_callbacks[name] = (callback, help_text)
+
+def export_state():
+    with _lock:
+        return {"histograms": {key: list(stats) for key, stats in _histograms.items()},
+                "counters": dict(_counters),
+                "timings": list(request_timings.get() or [])}
+
+def reset_state():
+    # Used in forked workers so only the work done there is sent back to the parent.
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+    request_timings.set([])
+
+def merge_state(state):
+    with _lock:
+        for key, stats in state["histograms"].items():
+            current = _histograms.setdefault(key, [0] * (len(stage_buckets) + 2))
+            for idx, value in enumerate(stats):
+                current[idx] += value
+        for key, value in state["counters"].items():
+            _counters[key] = _counters.get(key, 0) + value
+    timings = request_timings.get()
+    if timings is not None:
+        timings.extend(state["timings"])
+
+def resident_bytes():
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+def peak_resident_bytes():
+    # ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = [(key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for key, value in labels]
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+def render_prometheus():
+    lines = []
+    with _lock:
+        histograms = {key: list(stats) for key, stats in _histograms.items()}
+        counters = dict(_counters)
+
+    histogram_help = {"recviz_stage_seconds": "Time spent in each pipeline stage.",
+                      "recviz_request_seconds": "Request latency per route."}
+    for name in sorted({name for name, _ in histograms}):
+        if name in histogram_help:
+            lines.append(f"# HELP {name} {histogram_help[name]}")
+        lines.append(f"# TYPE {name} histogram")
+        for (histogram_name, labels), stats in sorted(histograms.items()):
+            if histogram_name != name:
+                continue
+            for idx, bound in enumerate(stage_buckets):
+                lines.append(f"{name}_bucket{format_labels(list(labels) + [('le', bound)])} {stats[idx]}")
+            lines.append(f"{name}_bucket{format_labels(list(labels) + [('le', '+Inf')])} {stats[-2]}")
+            lines.append(f"{name}_sum{format_labels(labels)} {stats[-1]}")
+            lines.append(f"{name}_count{format_labels(labels)} {stats[-2]}")
+
+    for name in sorted({name for name, _ in counters}):
+        lines.append(f"# TYPE {name} counter")
+        for (counter_name, labels), value in sorted(counters.items()):
+            if counter_name == name:
+                lines.append(f"{name}{format_labels(labels)} {value}")
+
+    gauges = dict(_gauge_callbacks)
+    gauges["recviz_process_resident_bytes"] = (resident_bytes, "Current resident set size.")
+    gauges["recviz_process_peak_resident_bytes"] = (peak_resident_bytes, "Peak resident set size.")
+    for name in sorted(gauges):
+        callback, help_text = gauges[name]
+        if help_text:
+            lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        value = callback()
+        if isinstance(value, dict):
+            for labels, labelled_value in sorted(value.items()):
+                lines.append(f"{name}{format_labels(labels)} {labelled_value}")
+        else:
+            lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+def server_timing_header(timings, total):
+    # Repeated stages (e.g. one per batch) are summed so the header stays short.
+    durations = {}
+    for stage, seconds in timings:
+        durations[stage] = durations.get(stage, 0.0) + seconds
+    parts = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in durations.items()]
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+class ServerTimingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def finish(self, request, response, timings, start):
+        total = time.perf_counter() - start
+        route = getattr(getattr(request, "resolver_match", None), "url_name", None) or "unmatched"
+        observe_histogram("recviz_request_seconds", {"route": route}, total)
+        increment("recviz_requests_total", route=route, status=response.status_code)
+        response["Server-Timing"] = server_timing_header(timings, total)
+        response["Timing-Allow-Origin"] = "*"
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings = []
+        token = request_timings.set(timings)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            request_timings.reset(token)
+        return self.finish(request, response, timings, start)
+
+    async def __acall__(self, request):
+        timings = []
+        token = request_timings.set(timings)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            request_timings.reset(token)
+        return self.finish(request, response, timings, start)
@@ -0,0 +1,159 @@
+import os
+import numpy as np
+import scipy.sparse as sp
+from recvizapi.SharedArrays import save_atomically
+
+minhash_permutations = 128
+lsh_bands = 32
+minhash_prime = (1 << 31) - 1
+minhash_block_nnz = 1 << 16
+
+def minhash_signatures(binary, permutations, seed=42):
+    # One min-hash per permutation for each row of a binary CSR matrix; empty rows get the prime.
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, minhash_prime, size=permutations, dtype=np.int64)
+    b = rng.integers(0, minhash_prime, size=permutations, dtype=np.int64)
+    signatures = np.full((binary.shape[0], permutations), minhash_prime, dtype=np.int64)
+    indptr = binary.indptr
+    row_start = 0
+    while row_start < binary.shape[0]:
+        # Grow the row block until it covers roughly minhash_block_nnz stored entries.
+        row_end = int(np.searchsorted(indptr, indptr[row_start] + minhash_block_nnz, side="right")) - 1
+        row_end = min(max(row_end, row_start + 1), binary.shape[0])
+        block = binary[row_start:row_end]
+        non_empty = np.flatnonzero(np.diff(block.indptr))
+        if len(non_empty):
+            hashed = (a[:, None] * block.indices[None, :].astype(np.int64) + b[:, None]) % minhash_prime
+            minima = np.minimum.reduceat(hashed, block.indptr[non_empty], axis=1)
+            signatures[row_start + non_empty] = minima.T
+        row_start = row_end
+    return signatures
+
+def band_keys(signatures, bands, seed=7):
+    rows_per_band = signatures.shape[1] // bands
+    rng = np.random.default_rng(seed)
+    multipliers = rng.integers(1, np.iinfo(np.int64).max, size=rows_per_band, dtype=np.int64).astype(np.uint64)
+    keys = np.empty((bands, signatures.shape[0]), dtype=np.uint64)
+    for band in range(bands):
+        chunk = signatures[:, band * rows_per_band:(band + 1) * rows_per_band].astype(np.uint64)
+        keys[band] = (chunk * multipliers[None, :]).sum(axis=1, dtype=np.uint64)
+    return keys
+
+def top_n(scores, rows, n):
+    if len(rows) > n:
+        best = np.argpartition(-scores, n - 1)[:n]
+        scores, rows = scores[best], rows[best]
+    order = np.lexsort((rows, -scores))
+    return rows[order], scores[order]
+
+class NeighbourIndex:
+    def __init__(self, index_path=None):
+        self.index_path = index_path
+        self.binary = None
+        self.normalized = None
+        self.sizes = None
+        self.band_order = None
+        self.band_sorted_keys = None
+        self.query_keys = None
+
+    def build(self, counts):
+        self.set_matrices(counts)
+        self.set_keys(band_keys(minhash_signatures(self.binary, minhash_permutations), lsh_bands))
+        return self
+
+    def update(self, counts, rows):
+        # counts grew in the given rows only: their signatures are recomputed, the other rows keep theirs.
+        self.set_matrices(counts)
+        keys = self.query_keys.copy()
+        keys[:, rows] = band_keys(minhash_signatures(self.binary[rows], minhash_permutations), lsh_bands)
+        empty_signature = np.full((1, minhash_permutations), minhash_prime, dtype=np.int64)
+        keys[:, self.sizes == 0] = band_keys(empty_signature, lsh_bands)
+        self.set_keys(keys)
+        return self
+
+    def set_matrices(self, counts):
+        counts = counts.tocsr()
+        self.binary = counts.copy()
+        self.binary.data[:] = 1
+        self.sizes = np.diff(self.binary.indptr)
+        norms = np.sqrt(np.asarray(counts.multiply(counts).sum(axis=1)).ravel())
+        inverse_norms = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms != 0)
+        self.normalized = sp.diags(inverse_norms) @ counts
+        self.normalized = self.normalized.tocsr()
+
+    def set_keys(self, keys):
+        empty_rows = self.sizes == 0
+        self.band_order = np.argsort(keys, axis=1, kind="stable")
+        self.band_sorted_keys = np.take_along_axis(keys, self.band_order, axis=1)
+        self.query_keys = keys
+        # Users without history all share one signature; keep them out of every bucket.
+        self.query_keys[:, empty_rows] = np.iinfo(np.uint64).max
+
+    def matches(self, fingerprint):
+        # fingerprint: (users, items, nnz) of the current interaction matrix.
+        return self.binary is not None and self.binary.shape == fingerprint[:2] and self.binary.nnz == fingerprint[2]
+
+    def save(self):
+        if self.index_path is None:
+            return
+        save_atomically(self.index_path + "_binary.npz", sp.save_npz, self.binary)
+        save_atomically(self.index_path + "_normalized.npz", sp.save_npz, self.normalized)
+        save_atomically(self.index_path + "_lsh.npz", np.savez,
+                        band_order=self.band_order,
+                        band_sorted_keys=self.band_sorted_keys,
+                        query_keys=self.query_keys)
+
+    def paths(self):
+        if self.index_path is None:
+            return []
+        return [self.index_path + suffix for suffix in ["_binary.npz", "_normalized.npz", "_lsh.npz"]]
+
+    def remove(self):
+        for path in self.paths():
+            if os.path.exists(path):
+                os.remove(path)
+
+    def load(self, fingerprint):
+        paths = self.paths()
+        if not paths or not all(os.path.exists(path) for path in paths):
+            return False
+        self.binary = sp.load_npz(paths[0]).tocsr()
+        if not self.matches(fingerprint):
+            self.binary = None
+            return False
+        self.normalized = sp.load_npz(paths[1]).tocsr()
+        self.sizes = np.diff(self.binary.indptr)
+        arrays = np.load(paths[2])
+        self.band_order = arrays["band_order"]
+        self.band_sorted_keys = arrays["band_sorted_keys"]
+        self.query_keys = arrays["query_keys"]
+        return True
+
+    def jaccard_candidates(self, row):
+        candidates = []
+        for band in range(self.query_keys.shape[0]):
+            key = self.query_keys[band, row]
+            start = np.searchsorted(self.band_sorted_keys[band], key, side="left")
+            end = np.searchsorted(self.band_sorted_keys[band], key, side="right")
+            candidates.append(self.band_order[band, start:end])
+        candidates = np.unique(np.concatenate(candidates)) if candidates else np.empty(0, dtype=np.int64)
+        return candidates[candidates != row]
+
+    def query_jaccard(self, row, n):
+        candidates = self.jaccard_candidates(row)
+        if len(candidates) >= n:
+            intersection = (self.binary[candidates] @ self.binary[row].T).toarray().ravel()
+        else:
+            # Too few LSH collisions to fill the answer: score everyone who shares an item.
+            products = (self.binary @ self.binary[row].T).tocoo()
+            keep = products.row != row
+            candidates = products.row[keep].astype(np.int64)
+            intersection = products.data[keep]
+        union = self.sizes[candidates] + self.sizes[row] - intersection
+        scores = np.divide(intersection, union, out=np.zeros(len(candidates)), where=union != 0)
+        return top_n(scores, candidates, n)
+
+    def query_cosine(self, row, n):
+        products = (self.normalized @ self.normalized[row].T).tocoo()
+        keep = products.row != row
+        return top_n(products.data[keep].astype(float), products.row[keep].astype(np.int64), n)
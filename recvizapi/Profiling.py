@@ -0,0 +1,214 @@
+import os
+import io
+import json
+import time
+import uuid
+import pstats
+import cProfile
+import threading
+import contextvars
+from contextlib import contextmanager
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.core.exceptions import MiddlewareNotUsed
+
+# Comma separated client addresses allowed to request profiles; profiling is off when empty.
+profile_clients = {client.strip() for client in os.environ.get("RECVIZ_PROFILE_CLIENTS", "").split(",") if client.strip()}
+profile_dir = os.environ.get("RECVIZ_PROFILE_PATH",
+                             os.path.join(os.environ.get("RECVIZ_CACHE_PATH", "."), "profiles"))
+profile_keep = int(os.environ.get("RECVIZ_PROFILE_KEEP", "200"))
+profile_header = "X-Recviz-Profile"
+profile_param = "profile"
+summary_rows = 30
+
+# Collector of the request being profiled, read by the worker pools to profile the jobs it starts.
+active_profile = contextvars.ContextVar("recviz_active_profile", default=None)
+# From Python 3.12 a profiler sees every thread and only one can be enabled at a time, so
+# profiled requests take turns; a request arriving while another is profiled runs unprofiled.
+_profile_slot = threading.Lock()
+
+def client_address(request):
+    return request.META.get("REMOTE_ADDR", "")
+
+def is_allowed(request):
+    return client_address(request) in profile_clients
+
+def wants_profile(request):
+    return request.headers.get(profile_header) == "1" or request.GET.get(profile_param) == "1"
+
+class ProfileCollector:
+    def __init__(self, name):
+        self.name = name
+        self.stats = pstats.Stats()
+        self.lock = threading.Lock()
+        self.profiler = cProfile.Profile()
+        self.jobs = 0
+
+    def add(self, source):
+        # source: a Profile that has been disabled, or the path of a dumped profile.
+        with self.lock:
+            self.stats.add(source)
+
+    @contextmanager
+    def profiled(self):
+        # Pool threads get their own profiler where the interpreter allows one per thread;
+        # otherwise the request's profiler already records them.
+        self.jobs += 1
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            yield
+            return
+        try:
+            yield
+        finally:
+            profiler.disable()
+            self.add(profiler)
+
+    def part_path(self, job_id):
+        # Where a process pool job started by the request dumps its profile.
+        return os.path.join(profile_dir, f"{self.name}.{job_id}.part.prof")
+
+    def add_child(self, job_id):
+        path = self.part_path(job_id)
+        self.jobs += 1
+        if os.path.exists(path):
+            self.add(path)
+            os.remove(path)
+
+def run_profiled(part_path, function, args):
+    # Runs a job in a worker process under its own profiler, dumped to part_path for the request's collector.
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        return function(*args)
+    finally:
+        profiler.disable()
+        profiler.dump_stats(part_path)
+
+def summarize(prof_path):
+    stream = io.StringIO()
+    pstats.Stats(prof_path, stream=stream).sort_stats("cumulative").print_stats(summary_rows)
+    return stream.getvalue()
+
+def prune_profiles():
+    names = sorted(name for name in os.listdir(profile_dir) if name.endswith(".json"))
+    for name in names[:max(len(names) - profile_keep, 0)]:
+        for path in (os.path.join(profile_dir, name), os.path.join(profile_dir, name[:-5] + ".prof")):
+            if os.path.exists(path):
+                os.remove(path)
+
+def store_profile(collector, request, response, seconds):
+    with collector.lock:
+        stats = collector.stats
+    prof_path = os.path.join(profile_dir, collector.name + ".prof")
+    stats.dump_stats(prof_path)
+    metadata = {
+        "name": collector.name,
+        "created": time.time(),
+        "method": request.method,
+        "path": request.path,
+        "route": getattr(getattr(request, "resolver_match", None), "url_name", None),
+        "params": {key: values for key, values in request.GET.lists() if key != profile_param},
+        "client": client_address(request),
+        "status": response.status_code,
+        "seconds": seconds,
+        "pool_jobs": collector.jobs,
+        "summary": summarize(prof_path) if stats.stats else "",
+    }
+    with open(os.path.join(profile_dir, collector.name + ".json"), "w", encoding="utf-8") as f:
+        json.dump(metadata, f)
+    prune_profiles()
+    return metadata
+
+def list_profiles(n=50):
+    if not os.path.isdir(profile_dir):
+        return []
+    profiles = []
+    for name in sorted((name for name in os.listdir(profile_dir) if name.endswith(".json")), reverse=True)[:n]:
+        with open(os.path.join(profile_dir, name), "r", encoding="utf-8") as f:
+            metadata = json.load(f)
+        metadata.pop("summary", None)
+        profiles.append(metadata)
+    return profiles
+
+def load_profile(name):
+    # Returns (metadata, path of the .prof file), or None for unknown names.
+    path = os.path.join(profile_dir, os.path.basename(name) + ".json")
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f), path[:-5] + ".prof"
+
+class ProfilingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        # Without an allow-list Django drops the middleware, so requests pay nothing for it.
+        if not profile_clients:
+            raise MiddlewareNotUsed
+        os.makedirs(profile_dir, exist_ok=True)
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def start(self, request):
+        if not wants_profile(request) or not is_allowed(request):
+            return None
+        if not _profile_slot.acquire(blocking=False):
+            return None
+        collector = ProfileCollector(f"{time.strftime('%Y%m%d-%H%M%S')}_{uuid.uuid4().hex[:8]}")
+        try:
+            collector.profiler.enable()
+        except ValueError:
+            _profile_slot.release()
+            return None
+        return collector, active_profile.set(collector), time.perf_counter()
+
+    def finish(self, request, response, profile):
+        collector, token, start = profile
+        collector.profiler.disable()
+        active_profile.reset(token)
+        try:
+            collector.add(collector.profiler)
+            metadata = store_profile(collector, request, response, time.perf_counter() - start)
+        finally:
+            _profile_slot.release()
+        response[profile_header] = metadata["name"]
+        return response
+
+    def abort(self, profile):
+        collector, token, start = profile
+        collector.profiler.disable()
+        active_profile.reset(token)
+        _profile_slot.release()
+
+    def skipped(self, request, response):
+        if wants_profile(request) and is_allowed(request):
+            response[profile_header] = "busy"
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        profile = self.start(request)
+        if profile is None:
+            return self.skipped(request, self.get_response(request))
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            self.abort(profile)
+            raise
+        return self.finish(request, response, profile)
+
+    async def __acall__(self, request):
+        profile = self.start(request)
+        if profile is None:
+            return self.skipped(request, await self.get_response(request))
+        try:
+            response = await self.get_response(request)
+        except BaseException:
+            self.abort(profile)
+            raise
+        return self.finish(request, response, profile)
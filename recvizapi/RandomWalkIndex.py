@@ -0,0 +1,183 @@
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import scipy.sparse as sp
+from recvizapi.SharedArrays import save_atomically
+
+panther_path_length = 5
+panther_paths_per_node = 20
+panther_min_paths = 100000
+ppr_walks_per_user = 64
+ppr_restart = 0.15
+ppr_max_steps = 64
+random_walk_workers = os.cpu_count() or 1
+random_walk_seed = 42
+
+_worker_graph = None
+
+def set_worker_graph(indptr, indices):
+    global _worker_graph
+    _worker_graph = (indptr, indices)
+
+def random_step(indptr, indices, current, rng):
+    # Isolated nodes (users without history) keep the walker in place.
+    degrees = indptr[current + 1] - indptr[current]
+    offsets = np.minimum((rng.random(len(current)) * degrees).astype(np.int64), np.maximum(degrees - 1, 0))
+    return np.where(degrees > 0, indices[np.minimum(indptr[current] + offsets, len(indices) - 1)], current)
+
+def sample_panther_paths(starts, seed):
+    indptr, indices = _worker_graph
+    rng = np.random.default_rng(seed)
+    paths = np.empty((len(starts), panther_path_length + 1), dtype=np.int64)
+    paths[:, 0] = starts
+    for step in range(1, panther_path_length + 1):
+        paths[:, step] = random_step(indptr, indices, paths[:, step - 1], rng)
+    return paths
+
+def sample_ppr_endpoints(sources, seed):
+    # Walks move user -> item -> user, so every walk ends on a user: the restart is drawn before each two-hop step.
+    indptr, indices = _worker_graph
+    rng = np.random.default_rng(seed)
+    current = sources.copy()
+    ends = np.empty(len(sources), dtype=np.int64)
+    active = np.arange(len(sources))
+    for _ in range(ppr_max_steps):
+        stop = rng.random(len(active)) < ppr_restart
+        ends[active[stop]] = current[active[stop]]
+        active = active[~stop]
+        if len(active) == 0:
+            break
+        current[active] = random_step(indptr, indices, random_step(indptr, indices, current[active], rng), rng)
+    ends[active] = current[active]
+    return ends
+
+def run_chunks(function, chunks, indptr, indices):
+    # Sampling processes are forked, which is only safe from a process without other threads (a graph pool job or
+    # a warm_cache worker); anywhere else the chunks run one after the other.
+    seeds = [random_walk_seed + idx for idx in range(len(chunks))]
+    if random_walk_workers <= 1 or len(chunks) <= 1 or threading.active_count() > 1:
+        set_worker_graph(indptr, indices)
+        return [function(chunk, seed) for chunk, seed in zip(chunks, seeds)]
+    with ProcessPoolExecutor(max_workers=random_walk_workers, mp_context=multiprocessing.get_context("fork"),
+                             initializer=set_worker_graph, initargs=(indptr, indices)) as executor:
+        return list(executor.map(function, chunks, seeds))
+
+def group_by_first(pairs_first, pairs_second, size):
+    # CSR-style grouping of pairs_second by pairs_first, with duplicates removed and ids sorted.
+    order = np.lexsort((pairs_second, pairs_first))
+    first = pairs_first[order]
+    second = pairs_second[order]
+    keep = np.ones(len(first), dtype=bool)
+    keep[1:] = (first[1:] != first[:-1]) | (second[1:] != second[:-1])
+    first, second = first[keep], second[keep]
+    indptr = np.concatenate(([0], np.cumsum(np.bincount(first, minlength=size))))
+    return indptr, second
+
+class RandomWalkIndex:
+    def __init__(self, index_path=None):
+        self.index_path = index_path
+        self.n_users = 0
+        self.n_paths = 0
+        self.user_paths_indptr = None
+        self.user_paths = None
+        self.path_users_indptr = None
+        self.path_users = None
+        self.ppr_endpoints = None
+        self.fingerprint = None
+
+    def build(self, interaction_matrix):
+        binary = interaction_matrix.tocsr().astype(bool).astype(np.int8)
+        self.n_users, n_items = binary.shape
+        self.fingerprint = np.array([self.n_users, n_items, binary.nnz])
+        # Users are nodes [0, n_users), items follow them.
+        adjacency = sp.bmat([[None, binary], [binary.T, None]], format="csr")
+        indptr, indices = adjacency.indptr.astype(np.int64), adjacency.indices.astype(np.int64)
+        chunk_count = max(1, random_walk_workers)
+
+        connected = np.flatnonzero(np.diff(indptr))
+        self.n_paths = max(panther_min_paths, panther_paths_per_node * adjacency.shape[0])
+        paths = np.concatenate(run_chunks(
+            sample_panther_paths,
+            np.array_split(np.random.default_rng(random_walk_seed).choice(connected, self.n_paths), chunk_count),
+            indptr, indices
+        )) if len(connected) else np.empty((0, panther_path_length + 1), dtype=np.int64)
+        self.n_paths = len(paths)
+        path_ids = np.repeat(np.arange(len(paths)), paths.shape[1])
+        nodes = paths.ravel()
+        is_user = nodes < self.n_users
+        self.user_paths_indptr, self.user_paths = group_by_first(nodes[is_user], path_ids[is_user], self.n_users)
+        self.path_users_indptr, self.path_users = group_by_first(path_ids[is_user], nodes[is_user], len(paths))
+
+        sources = np.repeat(np.arange(self.n_users), ppr_walks_per_user)
+        ends = np.concatenate(run_chunks(sample_ppr_endpoints, np.array_split(sources, chunk_count), indptr, indices))
+        self.ppr_endpoints = ends.astype(np.int32).reshape(self.n_users, ppr_walks_per_user)
+        return self
+
+    def save(self):
+        if self.index_path is None:
+            return
+        save_atomically(self.index_path + ".npz", np.savez,
+                        fingerprint=self.fingerprint,
+                        n_paths=self.n_paths,
+                        user_paths_indptr=self.user_paths_indptr,
+                        user_paths=self.user_paths,
+                        path_users_indptr=self.path_users_indptr,
+                        path_users=self.path_users,
+                        ppr_endpoints=self.ppr_endpoints)
+
+    def remove(self):
+        if self.index_path is not None and os.path.exists(self.index_path + ".npz"):
+            os.remove(self.index_path + ".npz")
+
+    def load(self, fingerprint):
+        # fingerprint: (users, items, nnz) of the current interaction matrix.
+        if self.index_path is None or not os.path.exists(self.index_path + ".npz"):
+            return False
+        arrays = np.load(self.index_path + ".npz")
+        if arrays["fingerprint"].tolist() != list(fingerprint):
+            return False
+        # Indexes sampled with another walk count (or the earlier one-hop walks, 32 per user) are resampled.
+        if arrays["ppr_endpoints"].shape[1] != ppr_walks_per_user:
+            return False
+        self.fingerprint = arrays["fingerprint"]
+        self.n_users = int(self.fingerprint[0])
+        self.n_paths = int(arrays["n_paths"])
+        self.user_paths_indptr = arrays["user_paths_indptr"]
+        self.user_paths = arrays["user_paths"]
+        self.path_users_indptr = arrays["path_users_indptr"]
+        self.path_users = arrays["path_users"]
+        self.ppr_endpoints = arrays["ppr_endpoints"]
+        return True
+
+    def paths_of(self, user):
+        return self.user_paths[self.user_paths_indptr[user]:self.user_paths_indptr[user + 1]]
+
+    def panther_similarity(self, user1, user2):
+        # Share of sampled paths that visit both users.
+        if self.n_paths == 0:
+            return 0.0
+        shared = np.intersect1d(self.paths_of(user1), self.paths_of(user2), assume_unique=True)
+        return len(shared) / self.n_paths
+
+    def ppr_similarity(self, user1, user2):
+        # Monte Carlo personalized PageRank of user2 with restarts at user1, on the user -> item -> user walk.
+        return float(np.count_nonzero(self.ppr_endpoints[user1] == user2)) / self.ppr_endpoints.shape[1]
+
+    def panther_neighbours(self, user, n):
+        paths = self.paths_of(user)
+        members = np.concatenate([self.path_users[self.path_users_indptr[path]:self.path_users_indptr[path + 1]]
+                                  for path in paths]) if len(paths) else np.empty(0, dtype=np.int64)
+        return self.top_counts(members, user, n, self.n_paths)
+
+    def ppr_neighbours(self, user, n):
+        return self.top_counts(self.ppr_endpoints[user], user, n, self.ppr_endpoints.shape[1])
+
+    def top_counts(self, members, user, n, total):
+        members = members[members != user]
+        if len(members) == 0 or total == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        users, counts = np.unique(members, return_counts=True)
+        order = np.lexsort((users, -counts))[:n]
+        return users[order], counts[order] / total
@@ -1,13 +1,57 @@
+import os
+import random
+import time
+import numpy as np
+import torch
 from recbole.quick_start import load_data_and_model
 from recbole.utils.case_study import full_sort_topk
+from recvizapi.AnnIndex import AnnIndex, get_model_embeddings
+from recvizapi.Metrics import timed, count_cache
+
+cpu_inference = os.environ.get("RECVIZ_CPU_INFERENCE", "0") == "1"
+intra_op_threads = int(os.environ.get("RECVIZ_INTRA_OP_THREADS", "0"))
+inter_op_threads = int(os.environ.get("RECVIZ_INTER_OP_THREADS", "0"))
+model_precision = os.environ.get("RECVIZ_MODEL_PRECISION", "fp32")
+topk_batch_size = 2048
+
+low_precision_dtypes = {"fp16": torch.float16, "bf16": torch.bfloat16}
+
+def configure_cpu_threads():
+    if intra_op_threads > 0:
+        torch.set_num_threads(intra_op_threads)
+    if inter_op_threads > 0:
+        try:
+            torch.set_num_interop_threads(inter_op_threads)
+        except RuntimeError:
+            print("Inter-op thread count can only be set before any parallel work has started, keeping",
+                  torch.get_num_interop_threads())
+
+def prepare_cpu_model(model, precision):
+    model = model.to("cpu").eval()
+    if precision == "int8":
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    elif precision in low_precision_dtypes:
+        # recbole models read embedding weights directly in full_sort_predict, so the whole
+        # model is cast to keep the embedding tables and the layers consuming them in one dtype.
+        model = model.to(low_precision_dtypes[precision])
+    elif precision != "fp32":
+        raise ValueError(f"Unsupported model precision: {precision}")
+    return model
 
 class RecommendationService:
-    def __init__(self, dataset_manager):
+    def __init__(self, dataset_manager, cache_dir=None):
         self.dataset_manager = dataset_manager
+        self.cache_dir = cache_dir
         self._model_cache = {}
+        self._lookup_cache = {}
+        self._ann_cache = {}
+        self._reference_cache = {}
+        if cpu_inference:
+            configure_cpu_threads()
 
     def load_model(self, dataset_name, model_name):
         key = (dataset_name, model_name)
+        count_cache("model", key in self._model_cache)
         if key in self._model_cache:
             return self._model_cache[key]
 
@@ -16,38 +60,213 @@ class RecommendationService:
             ds_obj = dsm_entry['dataset_obj']
             models = ds_obj.get_models()
             if model_name in models:
-                config, model, dataset, train_data, valid_data, test_data = load_data_and_model(
-                    model_file=models[model_name]
-                )
+                with timed("model_load"):
+                    config, model, dataset, train_data, valid_data, test_data = load_data_and_model(
+                        model_file=models[model_name]
+                    )
+                    if cpu_inference:
+                        config['device'] = torch.device("cpu")
+                        model = prepare_cpu_model(model, model_precision)
                 result = (config, model, dataset, train_data, valid_data, test_data, ds_obj)
                 self._model_cache[key] = result
                 return result
 
-    def get_topk(self, config, ds_obj, dataset, uid_series, model, test_data, k):
-        topk_score, topk_iid_list = full_sort_topk(uid_series, model, test_data, k=k, device=config['device'])
-        external_item_list = dataset.id2token(dataset.iid_field, topk_iid_list.cpu())
-        recommendations = {}
-        item_mapping = ds_obj.get_item_mapping()
-        for idx, uid in enumerate(uid_series):
-            item_score_pair = list(zip(external_item_list[idx], topk_score[idx].tolist()))
-            item_score_pair = [
-                [
-                    item_mapping.get(str(pair[0]), {}).get("movie_title", f"Unknown ID {pair[0]}"),
-                    f'item-{pair[0]}',
-                    pair[1]
-                ]
-                for pair in item_score_pair
-            ]
-            item_score_pair.sort(key=lambda x: x[2], reverse=True)
-            recommendations[f'user-{dataset.id2token(dataset.uid_field, [uid])[0]}'] = item_score_pair
-        return recommendations
-
-    def get_topk_all(self, dataset_name, model_name, k):
+    def get_lookup(self, ds_obj, dataset):
+        # Code -> title / node id arrays, indexed by recbole's internal user and item ids.
+        key = (id(ds_obj), id(dataset))
+        if key not in self._lookup_cache:
+            item_mapping = ds_obj.get_item_mapping()
+            item_tokens = dataset.field2id_token[dataset.iid_field]
+            item_titles = np.array(
+                [item_mapping.get(str(token), {}).get("movie_title", f"Unknown ID {token}") for token in item_tokens],
+                dtype=object
+            )
+            item_node_ids = np.array([f'item-{token}' for token in item_tokens], dtype=object)
+            user_node_ids = np.array([f'user-{token}' for token in dataset.field2id_token[dataset.uid_field]], dtype=object)
+            self._lookup_cache[key] = (item_titles, item_node_ids, user_node_ids)
+        return self._lookup_cache[key]
+
+    def get_ann(self, dataset_name, model_name):
+        # Returns (index, user_vectors), or None when the model does not score by inner product.
+        key = (dataset_name, model_name)
+        count_cache("ann", key in self._ann_cache)
+        if key in self._ann_cache:
+            return self._ann_cache[key]
+        config, model, dataset, train_data, valid_data, test_data, ds_obj = self.load_model(dataset_name, model_name)
+        ann = None
+        if not getattr(test_data, "is_sequential", False):
+            with torch.inference_mode():
+                embeddings = get_model_embeddings(model)
+            if embeddings is not None:
+                user_vectors, item_vectors = embeddings
+                index_path = None
+                if self.cache_dir is not None:
+                    index_path = os.path.join(self.cache_dir, f"{dataset_name}_{os.path.splitext(model_name)[0]}_ann")
+                model_file = ds_obj.get_models()[model_name]
+                metadata = {"model_file": model_file, "model_mtime": os.path.getmtime(model_file),
+                            "items": len(item_vectors)}
+                index = AnnIndex(index_path)
+                if not index.load(metadata, item_vectors.shape[1]):
+                    with timed("ann_build"):
+                        index.build(item_vectors, metadata)
+                    index.save()
+                    print("BUILT ANN INDEX", dataset_name, model_name)
+                ann = (index, user_vectors)
+        self._ann_cache[key] = ann
+        return ann
+
+    def get_topk_arrays(self, config, uid_series, model, test_data, k, ann=None):
+        if ann is not None:
+            index, user_vectors = ann
+            uids = np.asarray(uid_series)
+            history = [test_data.uid2history_item[uid] for uid in uids]
+            exclude = [np.asarray(items) if items is not None else np.empty(0, dtype=np.int64) for items in history]
+            with timed("ann_search"):
+                topk_scores, topk_iids = index.search(user_vectors[uids], k, exclude)
+            # Users the index could not give k candidates (after leaving out their history) are scored exactly.
+            short = ~np.isfinite(topk_scores).all(axis=1)
+            if short.any():
+                topk_scores[short], topk_iids[short] = self.get_topk_arrays(config, uids[short], model, test_data, k)
+            return topk_scores, topk_iids
+        with timed("model_inference"), torch.inference_mode():
+            topk_score, topk_iid_list = full_sort_topk(uid_series, model, test_data, k=k, device=config['device'])
+            return topk_score.float().cpu().numpy(), topk_iid_list.cpu().numpy()
+
+    def get_topk(self, config, ds_obj, dataset, uid_series, model, test_data, k, ann=None):
+        topk_scores, topk_iids = self.get_topk_arrays(config, uid_series, model, test_data, k, ann)
+        with timed("topk_postprocess"):
+            item_titles, item_node_ids, user_node_ids = self.get_lookup(ds_obj, dataset)
+            titles = item_titles[topk_iids].tolist()
+            node_ids = item_node_ids[topk_iids].tolist()
+            scores = topk_scores.tolist()
+            user_keys = user_node_ids[np.asarray(uid_series)].tolist()
+            # full_sort_topk already returns each row in descending score order.
+            return {
+                user_key: [list(entry) for entry in zip(titles[idx], node_ids[idx], scores[idx])]
+                for idx, user_key in enumerate(user_keys)
+            }
+
+    def get_topk_columnar(self, config, ds_obj, dataset, uid_series, model, test_data, k, ann=None):
+        # Same content as get_topk as parallel arrays: row r of item_index/scores belongs to users[r],
+        # and item_index points into the deduplicated items/titles tables.
+        topk_scores, topk_iids = self.get_topk_arrays(config, uid_series, model, test_data, k, ann)
+        with timed("topk_postprocess"):
+            item_titles, item_node_ids, user_node_ids = self.get_lookup(ds_obj, dataset)
+            unique_iids, item_index = np.unique(topk_iids, return_inverse=True)
+        return {
+            "format": "columnar",
+            "k": k,
+            "users": dataset.field2id_token[dataset.uid_field][np.asarray(uid_series)],
+            "items": dataset.field2id_token[dataset.iid_field][unique_iids],
+            "titles": item_titles[unique_iids],
+            "item_index": item_index.reshape(topk_iids.shape).astype(np.int32),
+            "scores": topk_scores.astype(np.float32),
+        }
+
+    def get_topk_all(self, dataset_name, model_name, k, use_ann=False, columnar=False):
         config, model, dataset, train_data, valid_data, test_data, ds_obj = self.load_model(dataset_name, model_name)
         uid_series = dataset.token2id(dataset.uid_field, ds_obj.get_user_ids())
-        return self.get_topk(config, ds_obj, dataset, uid_series, model, test_data, k)
+        ann = self.get_ann(dataset_name, model_name) if use_ann else None
+        if columnar:
+            return self.get_topk_columnar(config, ds_obj, dataset, uid_series, model, test_data, k, ann)
+        return self.get_topk(config, ds_obj, dataset, uid_series, model, test_data, k, ann)
 
-    def get_topk_uid(self, dataset_name, model_name, k, uid):
+    def get_topk_uid(self, dataset_name, model_name, k, uid, use_ann=False):
         config, model, dataset, train_data, valid_data, test_data, ds_obj = self.load_model(dataset_name, model_name)
         uid_series = dataset.token2id(dataset.uid_field, [str(uid)])
-        return self.get_topk(config, ds_obj, dataset, uid_series, model, test_data, k)
+        ann = self.get_ann(dataset_name, model_name) if use_ann else None
+        return self.get_topk(config, ds_obj, dataset, uid_series, model, test_data, k, ann)
+
+    def get_topk_users(self, dataset_name, model_name, k, user_ids):
+        # get_topk for many users at once, scored in batches; users the model does not know are left out.
+        config, model, dataset, train_data, valid_data, test_data, ds_obj = self.load_model(dataset_name, model_name)
+        known = dataset.field2token_id[dataset.uid_field]
+        user_ids = [user_id for user_id in dict.fromkeys(str(user_id) for user_id in user_ids) if user_id in known]
+        topk = {}
+        for start in range(0, len(user_ids), topk_batch_size):
+            uid_series = dataset.token2id(dataset.uid_field, user_ids[start:start + topk_batch_size])
+            batch = self.get_topk(config, ds_obj, dataset, uid_series, model, test_data, k)
+            topk.update(zip(user_ids[start:start + topk_batch_size], batch.values()))
+        return topk
+
+    def get_topk_tokens(self, dataset_name, model_name, k, user_ids=None):
+        # Top-k external item tokens for many users, scored in batches to bound peak memory.
+        config, model, dataset, train_data, valid_data, test_data, ds_obj = self.load_model(dataset_name, model_name)
+        if user_ids is None:
+            user_ids = ds_obj.get_user_ids()
+        uid_series = np.asarray(dataset.token2id(dataset.uid_field, list(user_ids)))
+        batches = []
+        for start in range(0, len(uid_series), topk_batch_size):
+            _, topk_iids = self.get_topk_arrays(config, uid_series[start:start + topk_batch_size], model, test_data, k)
+            batches.append(topk_iids)
+        topk_iids = np.concatenate(batches) if batches else np.empty((0, k), dtype=np.int64)
+        return dataset.id2token(dataset.iid_field, topk_iids)
+
+    def load_reference_model(self, dataset_name, model_name):
+        # The checkpoint's fp32 weights on the CPU, kept next to the served model it is compared with. Only
+        # prepare_cpu_model changes the served weights, so without CPU inference the served model is the reference;
+        # otherwise a new instance of its class gets the checkpoint's state dict, reusing the loaded recbole data.
+        key = (dataset_name, model_name)
+        count_cache("reference_model", key in self._reference_cache)
+        if key not in self._reference_cache:
+            config, model, dataset, train_data, valid_data, test_data, ds_obj = self.load_model(dataset_name, model_name)
+            if not cpu_inference:
+                self._reference_cache[key] = (config, model, test_data)
+                return self._reference_cache[key]
+            with timed("model_load"):
+                checkpoint = torch.load(ds_obj.get_models()[model_name], map_location="cpu")
+                ref_model = type(model)(config, train_data._dataset)
+                ref_model.load_state_dict(checkpoint["state_dict"])
+                ref_model.load_other_parameter(checkpoint.get("other_parameter"))
+            self._reference_cache[key] = (config, ref_model.to("cpu").float().eval(), test_data)
+        return self._reference_cache[key]
+
+    def check_ranking_agreement(self, dataset_name, model_name, k, sample_size=1000):
+        # Compares the served model against an fp32 reference of the same checkpoint on a user sample.
+        config, model, dataset, train_data, valid_data, test_data, ds_obj = self.load_model(dataset_name, model_name)
+        ref_config, ref_model, ref_test = self.load_reference_model(dataset_name, model_name)
+
+        user_ids = list(ds_obj.get_user_ids())
+        if len(user_ids) > sample_size:
+            user_ids = random.Random(42).sample(user_ids, sample_size)
+        uid_series = dataset.token2id(dataset.uid_field, user_ids)
+
+        _, served_iids = self.get_topk_arrays(config, uid_series, model, test_data, k)
+        _, ref_iids = self.get_topk_arrays(ref_config, uid_series, ref_model, ref_test, k)
+        overlap = (served_iids[:, :, None] == ref_iids[:, None, :]).any(axis=2).sum(axis=1) / k
+        return {
+            "precision": model_precision if cpu_inference else "fp32",
+            "k": k,
+            "users": len(user_ids),
+            "mean_overlap": float(overlap.mean()),
+            "min_overlap": float(overlap.min()),
+            "exact_order": float((served_iids == ref_iids).all(axis=1).mean()),
+            "top1_agreement": float((served_iids[:, 0] == ref_iids[:, 0]).mean()),
+        }
+
+    def check_ann_recall(self, dataset_name, model_name, k, sample_size=1000):
+        config, model, dataset, train_data, valid_data, test_data, ds_obj = self.load_model(dataset_name, model_name)
+        ann = self.get_ann(dataset_name, model_name)
+        if ann is None:
+            return {"error": "Model does not expose user/item embeddings scored by inner product"}
+
+        user_ids = list(ds_obj.get_user_ids())
+        if len(user_ids) > sample_size:
+            user_ids = random.Random(42).sample(user_ids, sample_size)
+        uid_series = dataset.token2id(dataset.uid_field, user_ids)
+
+        start = time.perf_counter()
+        _, exact_iids = self.get_topk_arrays(config, uid_series, model, test_data, k)
+        exact_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        _, ann_iids = self.get_topk_arrays(config, uid_series, model, test_data, k, ann)
+        ann_seconds = time.perf_counter() - start
+        recall = (ann_iids[:, :, None] == exact_iids[:, None, :]).any(axis=2).sum(axis=1) / k
+        return {
+            "k": k,
+            "users": len(user_ids),
+            "recall": float(recall.mean()),
+            "min_recall": float(recall.min()),
+            "exact_seconds": exact_seconds,
+            "ann_seconds": ann_seconds,
+        }
@@ -0,0 +1,60 @@
+import os
+import hashlib
+import threading
+import numpy as np
+
+def source_fingerprint(paths):
+    # Changes whenever one of the dataset files is replaced, edited or appended to.
+    digest = hashlib.sha1()
+    for path in sorted(paths):
+        if os.path.exists(path):
+            stat = os.stat(path)
+            digest.update(f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    return digest.hexdigest()[:16]
+
+def save_atomically(path, save, *args, **kwargs):
+    # save(file, *args, **kwargs) writes a temporary file next to path that is renamed into place, so a process
+    # loading path concurrently never reads a partial file.
+    directory, name = os.path.split(path)
+    temporary = os.path.join(directory, f".{name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(temporary, "wb") as f:
+            save(f, *args, **kwargs)
+        os.replace(temporary, path)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+class SharedArrays:
+    # Arrays derived from one dataset, written once as .npy files and memory-mapped read-only by every process
+    # that loads the dataset. The mapped pages live in the page cache, so worker processes share a single copy,
+    # and reference counting after a fork only touches the array headers, never the data.
+    def __init__(self, directory, fingerprint, source_mtime=0.0):
+        self.directory = directory
+        self.fingerprint = fingerprint
+        self.source_mtime = source_mtime
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{self.fingerprint}_{key}.npy")
+
+    def load(self, keys):
+        # {key: read-only array}, or None unless every key was stored for this fingerprint.
+        if not all(os.path.exists(self.path(key)) for key in keys):
+            return None
+        return {key: np.load(self.path(key), mmap_mode="r") for key in keys}
+
+    def store(self, arrays):
+        # Writes through temporary files renamed into place, so a process attaching concurrently never maps a
+        # partial file, then maps the stored arrays back. Arrays of other fingerprints written before the dataset
+        # files last changed are stale and removed; processes still mapping them keep their pages until they let go.
+        os.makedirs(self.directory, exist_ok=True)
+        for key, array in arrays.items():
+            temporary = os.path.join(self.directory, f".{self.fingerprint}_{key}.{os.getpid()}.npy")
+            np.save(temporary, np.ascontiguousarray(array))
+            os.replace(temporary, self.path(key))
+        for file in os.listdir(self.directory):
+            path = os.path.join(self.directory, file)
+            if file.endswith(".npy") and not file.startswith((self.fingerprint + "_", ".")) \
+                    and os.path.getmtime(path) < self.source_mtime:
+                os.remove(path)
+        return self.load(list(arrays))
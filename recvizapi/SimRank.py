@@ -0,0 +1,152 @@
+import os
+import networkx as nx
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.linalg import svds
+from recvizapi.SharedArrays import save_atomically
+
+importance_factor = 0.9
+max_iterations = 1000
+tolerance = 1e-4
+# Graphs with more nodes than this on either side use the low-rank approximation.
+simrank_exact_limit = 4000
+simrank_rank = 64
+
+def row_normalize(matrix):
+    sums = np.asarray(matrix.sum(axis=1)).ravel()
+    inverse = np.divide(1.0, sums, out=np.zeros_like(sums, dtype=float), where=sums != 0)
+    return (sp.diags(inverse) @ matrix).tocsr()
+
+def simrank_bipartite(biadjacency, c=importance_factor, iterations=max_iterations, atol=tolerance):
+    # Same fixed point as nx.simrank_similarity (S = max(C * A^T S A, I) on the weighted, column
+    # normalised adjacency), iterated per side since nodes on opposite sides never become similar.
+    biadjacency = sp.csr_matrix(biadjacency, dtype=float)
+    walk_a = row_normalize(biadjacency)
+    walk_b = row_normalize(biadjacency.T.tocsr())
+    sim_a = np.eye(biadjacency.shape[0])
+    sim_b = np.eye(biadjacency.shape[1])
+    for _ in range(iterations):
+        new_a = c * np.asarray(walk_a @ (walk_a @ sim_b).T)
+        new_b = c * np.asarray(walk_b @ (walk_b @ sim_a).T)
+        np.fill_diagonal(new_a, 1.0)
+        np.fill_diagonal(new_b, 1.0)
+        converged = np.allclose(sim_a, new_a, atol=atol) and np.allclose(sim_b, new_b, atol=atol)
+        sim_a, sim_b = new_a, new_b
+        if converged:
+            break
+    return sim_a, sim_b
+
+def simrank_low_rank(biadjacency, rank=simrank_rank, c=importance_factor, iterations=max_iterations, atol=tolerance):
+    # Linearised SimRank (S = C * W S W^T + (1 - C) * I) with each walk matrix replaced by its
+    # rank-r SVD, so the iteration runs on r x r cores. Returns factors Y with S ~ Y Y^T off the diagonal.
+    biadjacency = sp.csr_matrix(biadjacency, dtype=float)
+    rank = max(1, min(rank, min(biadjacency.shape) - 1))
+    left_a, sigma_a, right_a = svds(row_normalize(biadjacency), k=rank, random_state=42)
+    left_b, sigma_b, right_b = svds(row_normalize(biadjacency.T.tocsr()), k=rank, random_state=42)
+    # right_a and left_b are both bases on side b (right_b and left_a on side a); these map between them.
+    project_ab = right_a @ left_b
+    project_ba = right_b @ left_a
+    core_a = np.zeros((rank, rank))
+    core_b = np.zeros((rank, rank))
+    for _ in range(iterations):
+        new_a = c * sigma_a[:, None] * ((1 - c) * np.eye(rank) + project_ab @ core_b @ project_ab.T) * sigma_a[None, :]
+        new_b = c * sigma_b[:, None] * ((1 - c) * np.eye(rank) + project_ba @ core_a @ project_ba.T) * sigma_b[None, :]
+        converged = np.allclose(core_a, new_a, atol=atol) and np.allclose(core_b, new_b, atol=atol)
+        core_a, core_b = new_a, new_b
+        if converged:
+            break
+    return factorize(left_a, core_a), factorize(left_b, core_b)
+
+def factorize(basis, core):
+    values, vectors = np.linalg.eigh((core + core.T) / 2)
+    return basis @ (vectors * np.sqrt(np.maximum(values, 0)))
+
+class SimRankIndex:
+    def __init__(self, index_path=None):
+        self.index_path = index_path
+        self.nodes = [np.empty(0, dtype=str), np.empty(0, dtype=str)]
+        self.positions = [{}, {}]
+        self.mode = None
+        # Exact mode keeps the dense per-side matrices, low-rank mode keeps the per-side factors.
+        self.values = [None, None]
+
+    def build(self, biadjacency, nodes_a, nodes_b, mode=None):
+        # mode is "exact" or "low_rank"; by default graphs above simrank_exact_limit nodes per side are low-rank.
+        self.nodes = [np.asarray(nodes_a, dtype=str), np.asarray(nodes_b, dtype=str)]
+        self.positions = [{node: idx for idx, node in enumerate(side)} for side in self.nodes]
+        if mode is None:
+            mode = "exact" if max(biadjacency.shape) <= simrank_exact_limit else "low_rank"
+        if mode == "exact":
+            self.values = list(simrank_bipartite(biadjacency))
+        elif mode == "low_rank":
+            self.values = list(simrank_low_rank(biadjacency))
+        else:
+            raise ValueError(f"Unsupported SimRank mode: {mode}")
+        self.mode = mode
+        return self
+
+    def build_from_graph(self, g, is_side_a=None, mode=None):
+        # is_side_a picks the nodes of the first side; by default a two-colouring of g is used.
+        if is_side_a is None:
+            colors = nx.bipartite.color(g)
+            is_side_a = lambda node: colors[node] == 0
+        nodes_a = [node for node in g.nodes if is_side_a(node)]
+        nodes_b = [node for node in g.nodes if not is_side_a(node)]
+        index_a = {node: idx for idx, node in enumerate(nodes_a)}
+        index_b = {node: idx for idx, node in enumerate(nodes_b)}
+        rows, cols, weights = [], [], []
+        for u, v, weight in g.edges(data="weight", default=1):
+            if u in index_b:
+                u, v = v, u
+            rows.append(index_a[u])
+            cols.append(index_b[v])
+            weights.append(float(weight))
+        biadjacency = sp.csr_matrix((weights, (rows, cols)), shape=(len(nodes_a), len(nodes_b)))
+        return self.build(biadjacency, [str(node) for node in nodes_a], [str(node) for node in nodes_b], mode)
+
+    def save(self):
+        if self.index_path is None:
+            return
+        save_atomically(self.index_path + ".npz", np.savez, mode=self.mode, nodes_a=self.nodes[0], nodes_b=self.nodes[1],
+                        values_a=self.values[0].astype(np.float32), values_b=self.values[1].astype(np.float32))
+
+    def load(self):
+        if self.index_path is None or not os.path.exists(self.index_path + ".npz"):
+            return False
+        arrays = np.load(self.index_path + ".npz")
+        self.mode = str(arrays["mode"])
+        self.nodes = [arrays["nodes_a"], arrays["nodes_b"]]
+        self.positions = [{node: idx for idx, node in enumerate(side.tolist())} for side in self.nodes]
+        self.values = [arrays["values_a"], arrays["values_b"]]
+        return True
+
+    def locate(self, node):
+        for side in (0, 1):
+            if str(node) in self.positions[side]:
+                return side, self.positions[side][str(node)]
+        raise KeyError(node)
+
+    def similarity(self, node1, node2):
+        side1, pos1 = self.locate(node1)
+        side2, pos2 = self.locate(node2)
+        if side1 != side2:
+            return 0.0
+        if pos1 == pos2:
+            return 1.0
+        values = self.values[side1]
+        if self.mode == "exact":
+            return float(values[pos1, pos2])
+        return float(values[pos1] @ values[pos2])
+
+    def most_similar(self, node, n):
+        side, pos = self.locate(node)
+        values = self.values[side]
+        scores = values[pos] if self.mode == "exact" else values @ values[pos]
+        scores = np.asarray(scores, dtype=float).copy()
+        scores[pos] = -np.inf
+        n = min(n, len(scores) - 1)
+        if n <= 0:
+            return []
+        best = np.argpartition(-scores, n - 1)[:n]
+        best = best[np.lexsort((best, -scores[best]))]
+        return [[str(self.nodes[side][idx]), float(scores[idx])] for idx in best]
@@ -1,8 +1,45 @@
+import os
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 import networkx as nx
 import numpy as np
+from recvizapi.NeighbourIndex import NeighbourIndex
+from recvizapi.RandomWalkIndex import RandomWalkIndex
+from recvizapi.SimRank import SimRankIndex
+from recvizapi.GraphEditDistance import bounded_graph_edit_distance
+from recvizapi.Metrics import timed, count_cache
+
+batch_metrics = ["overlap_coefficient", "sorenson_dice", "jaccard", "list_cosine"]
+
+_worker_service = None
+
+def set_worker_similarity_service(similarity_service):
+    # Like GraphService.set_worker_service: the graph pool's fork server holds the service for the jobs below.
+    global _worker_service
+    _worker_service = similarity_service
+
+def build_random_walks_in_worker(dataset_name):
+    # The parent loads the saved index rather than receiving it through the pipe.
+    _worker_service.build_random_walk_index(dataset_name)
+
+def safe_divide(numerator, denominator):
+    numerator = np.asarray(numerator, dtype=float)
+    denominator = np.asarray(denominator, dtype=float)
+    return np.divide(numerator, denominator, out=np.zeros(np.broadcast(numerator, denominator).shape), where=denominator != 0)
+
 class SimilarityService:
-    def __init__(self):
-        pass
+    def __init__(self, dataset_manager=None, cache_dir=None, job_pool=None):
+        self.dataset_manager = dataset_manager
+        self.cache_dir = cache_dir
+        self._matrix_cache = {}
+        self._neighbour_cache = {}
+        self._random_walk_cache = {}
+        # Pool the random walk index builds go through (the graph pool of the views); a local thread without one.
+        self.job_pool = job_pool
+        self.random_walk_jobs = {}
+        self.random_walk_lock = threading.Lock()
+        self.random_walk_executor = ThreadPoolExecutor(max_workers=1)
 
     def overlap_coefficient(self, a, b):
         set_a = set(a)
@@ -41,8 +78,266 @@ class SimilarityService:
 
         return np.dot(sparse_vec_a, sparse_vec_b) / (np.linalg.norm(sparse_vec_a) * np.linalg.norm(sparse_vec_b))
 
+    def metric_suite(self, a, b, metrics=None):
+        # Computes the requested list metrics from one pass of shared counts instead of one call each.
+        counts_a = Counter(a)
+        counts_b = Counter(b)
+        size_a = len(counts_a)
+        size_b = len(counts_b)
+        shared = counts_a.keys() & counts_b.keys()
+        intersection = len(shared)
+        results = {}
+        for metric in metrics or batch_metrics:
+            if metric == "overlap_coefficient":
+                denominator = min(size_a, size_b)
+                results[metric] = intersection / denominator if denominator else 0.0
+            elif metric == "sorenson_dice":
+                denominator = size_a + size_b
+                results[metric] = 2 * intersection / denominator if denominator else 0.0
+            elif metric == "jaccard":
+                denominator = size_a + size_b - intersection
+                results[metric] = intersection / denominator if denominator else 0.0
+            elif metric == "list_cosine":
+                dot = sum(counts_a[elt] * counts_b[elt] for elt in shared)
+                norm_a = np.sqrt(sum(count * count for count in counts_a.values()))
+                norm_b = np.sqrt(sum(count * count for count in counts_b.values()))
+                results[metric] = float(dot / (norm_a * norm_b)) if norm_a and norm_b else 0.0
+            else:
+                raise ValueError(f"Unsupported similarity metric: {metric}")
+        return results
+
+    def get_matrices(self, dataset_name):
+        # Binary and count user x item matrices plus the per-user sizes and norms the metrics need.
+        count_cache("similarity_matrices", dataset_name in self._matrix_cache)
+        if dataset_name not in self._matrix_cache:
+            ds_obj = self.dataset_manager.get_dataset(dataset_name)["dataset_obj"]
+            with timed("interaction_matrix"):
+                counts = ds_obj.get_interaction_matrix().tocsr()
+            binary = counts.copy()
+            binary.data[:] = 1
+            self._matrix_cache[dataset_name] = {
+                "user_index": ds_obj.get_user_index(),
+                "user_ids": ds_obj.get_user_ids(),
+                "counts": counts,
+                "binary": binary,
+                "sizes": np.diff(binary.indptr),
+                "norms": np.sqrt(np.asarray(counts.multiply(counts).sum(axis=1)).ravel()),
+            }
+        return self._matrix_cache[dataset_name]
+
+    def combine_metric(self, metric, intersection, sizes_a, sizes_b, dot=None, norms_a=None, norms_b=None):
+        if metric == "overlap_coefficient":
+            return safe_divide(intersection, np.minimum(sizes_a, sizes_b))
+        if metric == "sorenson_dice":
+            return safe_divide(2 * intersection, sizes_a + sizes_b)
+        if metric == "jaccard":
+            return safe_divide(intersection, sizes_a + sizes_b - intersection)
+        if metric == "list_cosine":
+            return safe_divide(dot, norms_a * norms_b)
+        raise ValueError(f"Unsupported similarity metric: {metric}")
+
+    def batch_similarity(self, dataset_name, metric, pairs):
+        # pairs: iterable of (uid1, uid2) dataset user ids; returns one score per pair.
+        matrices = self.get_matrices(dataset_name)
+        user_index = matrices["user_index"]
+        rows_a = np.array([user_index[str(uid1)] for uid1, uid2 in pairs], dtype=np.int64)
+        rows_b = np.array([user_index[str(uid2)] for uid1, uid2 in pairs], dtype=np.int64)
+        with timed("similarity_batch"):
+            intersection = np.asarray(matrices["binary"][rows_a].multiply(matrices["binary"][rows_b]).sum(axis=1)).ravel()
+            dot = None
+            if metric == "list_cosine":
+                dot = np.asarray(matrices["counts"][rows_a].multiply(matrices["counts"][rows_b]).sum(axis=1)).ravel()
+        return self.combine_metric(metric, intersection, matrices["sizes"][rows_a], matrices["sizes"][rows_b],
+                                   dot, matrices["norms"][rows_a], matrices["norms"][rows_b])
+
+    def one_vs_all(self, dataset_name, metric, uid):
+        # Scores for one user against every user, aligned with the dataset's user_ids.
+        matrices = self.get_matrices(dataset_name)
+        row = matrices["user_index"][str(uid)]
+        source = "counts" if metric == "list_cosine" else "binary"
+        with timed("similarity_one_vs_all"):
+            products = np.asarray((matrices[source] @ matrices[source][row].T).todense()).ravel()
+        sizes = matrices["sizes"]
+        norms = matrices["norms"]
+        return self.combine_metric(metric, products, sizes[row], sizes, products, norms[row], norms)
+
+    def cohort_similarity(self, dataset_name, metric, uids):
+        # Full pairwise matrix within a cohort of users.
+        matrices = self.get_matrices(dataset_name)
+        rows = np.array([matrices["user_index"][str(uid)] for uid in uids], dtype=np.int64)
+        source = "counts" if metric == "list_cosine" else "binary"
+        cohort = matrices[source][rows]
+        with timed("similarity_cohort"):
+            products = np.asarray((cohort @ cohort.T).todense())
+        sizes = matrices["sizes"][rows]
+        norms = matrices["norms"][rows]
+        return self.combine_metric(metric, products, sizes[:, None], sizes[None, :], products, norms[:, None], norms[None, :])
+
+    def get_neighbour_index(self, dataset_name):
+        count_cache("neighbour_index", dataset_name in self._neighbour_cache)
+        if dataset_name not in self._neighbour_cache:
+            counts = self.get_matrices(dataset_name)["counts"]
+            index = NeighbourIndex(self.index_path(dataset_name, "neighbours"))
+            if not index.load((counts.shape[0], counts.shape[1], counts.nnz)):
+                with timed("neighbour_index_build"):
+                    index.build(counts)
+                index.save()
+                print("BUILT NEIGHBOUR INDEX", dataset_name)
+            self._neighbour_cache[dataset_name] = index
+        return self._neighbour_cache[dataset_name]
+
+    def most_similar_users(self, dataset_name, uid, n, metric="jaccard"):
+        matrices = self.get_matrices(dataset_name)
+        row = matrices["user_index"][str(uid)]
+        index = self.get_neighbour_index(dataset_name)
+        with timed("similarity_neighbours"):
+            if metric == "jaccard":
+                rows, scores = index.query_jaccard(row, n)
+            elif metric == "list_cosine":
+                rows, scores = index.query_cosine(row, n)
+            else:
+                raise ValueError(f"Unsupported neighbour metric: {metric}")
+        user_ids = matrices["user_ids"]
+        return [[user_ids[neighbour], float(score)] for neighbour, score in zip(rows, scores)]
+
+    def build_random_walk_index(self, dataset_name):
+        counts = self.get_matrices(dataset_name)["counts"]
+        index = RandomWalkIndex(self.index_path(dataset_name, "random_walks"))
+        with timed("random_walk_index_build"):
+            index.build(counts)
+        index.save()
+        print("BUILT RANDOM WALK INDEX", dataset_name)
+        return index
+
+    def get_random_walk_index(self, dataset_name):
+        # Returns the random walk index, or None while its background job is still running. Sampling forks
+        # processes, so it runs in a job process of the graph pool instead of a request thread; the job saves the
+        # index, which is loaded once the job is done. A failed job raises here once.
+        count_cache("random_walk_index", dataset_name in self._random_walk_cache)
+        if dataset_name in self._random_walk_cache:
+            return self._random_walk_cache[dataset_name]
+        with self.random_walk_lock:
+            job = self.random_walk_jobs.get(dataset_name)
+            if job is not None and not job.done():
+                return None
+            built = None
+            if job is not None:
+                del self.random_walk_jobs[dataset_name]
+                built = job.result()
+            counts = self.get_matrices(dataset_name)["counts"]
+            index = RandomWalkIndex(self.index_path(dataset_name, "random_walks"))
+            if index.load((counts.shape[0], counts.shape[1], counts.nnz)):
+                self._random_walk_cache[dataset_name] = index
+                return index
+            if built is not None and built.fingerprint.tolist() == [counts.shape[0], counts.shape[1], counts.nnz]:
+                # Built by the local thread without a cache directory to save it to.
+                self._random_walk_cache[dataset_name] = built
+                return built
+            if self.job_pool is None:
+                self.random_walk_jobs[dataset_name] = self.random_walk_executor.submit(self.build_random_walk_index, dataset_name)
+            else:
+                self.random_walk_jobs[dataset_name] = self.job_pool.submit(build_random_walks_in_worker, dataset_name)
+            return None
+
+    def invalidate_dataset(self, dataset_name, appended):
+        # appended: summary of Dataset.append_rows. The matrices are rebuilt from the updated interaction matrix,
+        # the neighbour index rehashes the users that changed, and the random walks, which only follow which
+        # pairs exist, are resampled on next use if new pairs appeared.
+        self._matrix_cache.pop(dataset_name, None)
+        if dataset_name in self._neighbour_cache:
+            with timed("neighbour_index_update"):
+                self._neighbour_cache[dataset_name].update(self.get_matrices(dataset_name)["counts"], appended["users"])
+            self._neighbour_cache[dataset_name].save()
+        else:
+            NeighbourIndex(self.index_path(dataset_name, "neighbours")).remove()
+        if appended["new_pairs"]:
+            self._random_walk_cache.pop(dataset_name, None)
+            RandomWalkIndex(self.index_path(dataset_name, "random_walks")).remove()
+
+    def index_path(self, dataset_name, suffix):
+        if self.cache_dir is None:
+            return None
+        return os.path.join(self.cache_dir, f"{dataset_name}_{suffix}")
+
+    def random_walk_similarity(self, dataset_name, uid1, uid2):
+        user_index = self.get_matrices(dataset_name)["user_index"]
+        row1, row2 = user_index[str(uid1)], user_index[str(uid2)]
+        index = self.get_random_walk_index(dataset_name)
+        if index is None:
+            return None
+        with timed("similarity_random_walk"):
+            return {
+                "panther_similarity": index.panther_similarity(row1, row2),
+                "ppr_similarity": index.ppr_similarity(row1, row2),
+            }
+
+    def random_walk_neighbours(self, dataset_name, uid, n, method="panther"):
+        if method not in ("panther", "ppr"):
+            raise ValueError(f"Unsupported random walk method: {method}")
+        matrices = self.get_matrices(dataset_name)
+        row = matrices["user_index"][str(uid)]
+        index = self.get_random_walk_index(dataset_name)
+        if index is None:
+            return None
+        with timed("similarity_random_walk_neighbours"):
+            if method == "panther":
+                rows, scores = index.panther_neighbours(row, n)
+            else:
+                rows, scores = index.ppr_neighbours(row, n)
+        user_ids = matrices["user_ids"]
+        return [[user_ids[neighbour], float(score)] for neighbour, score in zip(rows, scores)]
+
+    def topk_agreement(self, a, b, chunk_size=4096):
+        # a, b: (users x k) arrays of top-k items per user, compared row by row.
+        a = np.asarray(a)
+        b = np.asarray(b)
+        _, codes = np.unique(np.concatenate((a.ravel(), b.ravel())), return_inverse=True)
+        a_codes = codes[:a.size].reshape(a.shape)
+        b_codes = codes[a.size:].reshape(b.shape)
+        k = a.shape[1]
+        ranks = np.arange(k)
+        intersection = np.empty(len(a), dtype=np.int64)
+        footrule = np.empty(len(a), dtype=np.int64)
+        for start in range(0, len(a), chunk_size):
+            matches = a_codes[start:start + chunk_size, :, None] == b_codes[start:start + chunk_size, None, :]
+            intersection[start:start + chunk_size] = matches.sum(axis=(1, 2))
+            # Spearman footrule with location parameter k (Fagin et al.): an item missing
+            # from the other list is placed at rank k.
+            a_rank_in_b = np.where(matches.any(axis=2), matches.argmax(axis=2), k)
+            b_missing_from_a = ~matches.any(axis=1)
+            footrule[start:start + chunk_size] = np.abs(ranks - a_rank_in_b).sum(axis=1) + \
+                ((k - ranks) * b_missing_from_a).sum(axis=1)
+        return {
+            "overlap": intersection,
+            "overlap_coefficient": intersection / k,
+            "jaccard": intersection / (2 * k - intersection),
+            "sorenson": intersection / k,
+            # Footrule rescaled so identical lists score 1 and disjoint lists score -1.
+            "rank_correlation": 1 - 2 * footrule / (k * (k + 1)),
+        }
+
+    def summarize_distribution(self, values, value_range=(0, 1), bins=10):
+        values = np.asarray(values, dtype=float)
+        if values.size == 0:
+            return {}
+        histogram, edges = np.histogram(values, bins=bins, range=value_range)
+        quantiles = np.quantile(values, [0, 0.1, 0.25, 0.5, 0.75, 0.9, 1])
+        return {
+            "mean": float(values.mean()),
+            "std": float(values.std()),
+            "quantiles": dict(zip(["min", "p10", "p25", "p50", "p75", "p90", "max"], quantiles.tolist())),
+            "histogram": {"counts": histogram.tolist(), "edges": edges.tolist()},
+        }
+
     def graph_edit_distance(self, g1, g2):
         return nx.graph_edit_distance(g1, g2)
 
+    def bounded_graph_edit_distance(self, g1, g2, time_budget=1.0, label_attr="label"):
+        with timed("similarity_graph_edit_distance"):
+            return bounded_graph_edit_distance(g1, g2, time_budget, label_attr)
+
     def simrank_similarity(self, g, user1, user2):
-        return nx.simrank_similarity(g, source=user1, target=user2)
\ No newline at end of file
+        if not nx.is_bipartite(g):
+            return nx.simrank_similarity(g, source=user1, target=user2)
+        # Always exact, like nx.simrank_similarity; the low-rank approximation is only used by the cached graph indexes.
+        return SimRankIndex().build_from_graph(g, mode="exact").similarity(user1, user2)
\ No newline at end of file
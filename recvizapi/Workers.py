@@ -0,0 +1,270 @@
+import os
+import sys
+import time
+import uuid
+import pickle
+import signal
+import asyncio
+import contextvars
+import functools
+import multiprocessing
+import threading
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+from multiprocessing import reduction
+from multiprocessing.connection import Connection
+from recvizapi import Metrics, Profiling
+
+class PoolBusy(Exception):
+    pass
+
+class WorkerCrashed(Exception):
+    pass
+
+def run_child(sender, payload):
+    # payload: the pickled (function, args, profile part path or None) of the job. Metrics recorded in the child
+    # are shipped back with the result and merged by the parent.
+    Metrics.reset_state()
+    try:
+        function, args, part_path = pickle.loads(payload)
+        value = Profiling.run_profiled(part_path, function, args) if part_path is not None else function(*args)
+        sender.send((True, value, Metrics.export_state()))
+    except BaseException as e:
+        sender.send((False, f"{type(e).__name__}: {e}\n{traceback.format_exc()}", Metrics.export_state()))
+    finally:
+        sender.close()
+
+def serve_jobs(conn, refresh):
+    # Fork server of a process pool: it was forked while the parent had no other threads and stays single
+    # threaded, so every job forks from a process whose locks are all free. Each job arrives as the parent's
+    # state for refresh, the pickled job and the write end of its result pipe; the server answers with the pid.
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    while True:
+        try:
+            state, payload = conn.recv()
+            fd = reduction.recv_handle(conn)
+        except (EOFError, OSError):
+            os._exit(0)
+        if refresh is not None:
+            try:
+                refresh(state)
+            except Exception as e:
+                print("WORKER REFRESH FAILED:", e)
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            conn.close()
+            try:
+                run_child(Connection(fd, readable=False), payload)
+            finally:
+                sys.stdout.flush()
+                os._exit(0)
+        os.close(fd)
+        conn.send(pid)
+
+def timed_job(pool_name, submitted, function):
+    Metrics.observe(f"{pool_name}_queue_wait", time.perf_counter() - submitted)
+    collector = Profiling.active_profile.get()
+    if collector is None:
+        return function()
+    with collector.profiled():
+        return function()
+
+def wait_for_exit(pid, timeout=5.0):
+    # Job processes are reaped by their fork server, not by this process, so the pid is polled until it is gone.
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return
+        time.sleep(0.01)
+
+class WorkPool:
+    # Bounded offload target for async views. Thread pools share the process' caches (models,
+    # indexes); process pools fork one child per job from a fork server, so a cancelled request can kill its work.
+    # At most max_workers jobs run at once and max_pending are admitted, running or waiting; beyond that run raises
+    # PoolBusy.
+    def __init__(self, name, max_workers, max_pending=None, use_processes=False):
+        self.name = name
+        self.max_workers = max_workers
+        self.use_processes = use_processes
+        self.max_pending = max_pending or max_workers
+        self.slots = threading.BoundedSemaphore(self.max_pending)
+        self.in_flight = 0
+        self.in_flight_lock = threading.Lock()
+        self.executor = None if use_processes else ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        # Process jobs hold one of these while their child runs; the admitted jobs past max_workers wait for one
+        # in a waiter thread.
+        self.workers = threading.Semaphore(max_workers)
+        self.waiters = ThreadPoolExecutor(max_workers=self.max_pending, thread_name_prefix=f"{name}-waiting") if use_processes else None
+        # Threads waiting on jobs started by submit, which outlive the request that started them.
+        self.background = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-background")
+        # Key -> future of the job running for it, so concurrent requests for the same result share one job.
+        self.shared_jobs = {}
+        self.shared_lock = threading.Lock()
+        self.server = None
+        self.server_conn = None
+        self.server_lock = threading.Lock()
+        self.refresh = None
+        self.snapshot = None
+
+    def start(self, refresh=None, snapshot=None):
+        # Forks the fork server of a process pool. Call it while the process has no other threads (at import, before
+        # any pool is used): the server keeps the state of that moment. Before each job, snapshot() is taken in the
+        # parent and refresh(snapshot) runs in the server to bring its state up to date.
+        self.refresh = refresh
+        self.snapshot = snapshot
+        with self.server_lock:
+            self.start_server()
+
+    def start_server(self):
+        if self.server is not None and self.server.is_alive():
+            return
+        context = multiprocessing.get_context("fork")
+        self.server_conn, server_end = context.Pipe()
+        self.server = context.Process(target=serve_jobs, args=(server_end, self.refresh), daemon=True)
+        self.server.start()
+        server_end.close()
+
+    def acquire(self):
+        if not self.slots.acquire(blocking=False):
+            Metrics.increment("recviz_pool_rejections_total", pool=self.name)
+            raise PoolBusy(f"The {self.name} pool is at capacity, retry shortly")
+        with self.in_flight_lock:
+            self.in_flight += 1
+
+    def release(self):
+        with self.in_flight_lock:
+            self.in_flight -= 1
+        self.slots.release()
+
+    async def run(self, function, *args):
+        self.acquire()
+        if self.use_processes:
+            try:
+                submitted = time.perf_counter()
+                await self.acquire_worker()
+                Metrics.observe(f"{self.name}_queue_wait", time.perf_counter() - submitted)
+                try:
+                    return await self.run_process(function, args)
+                finally:
+                    self.workers.release()
+            finally:
+                self.release()
+        # A slot stays taken until the thread is really done, even if the request went away.
+        # The job runs in a copy of the request's context so its stage timings reach the response.
+        context = contextvars.copy_context()
+        future = self.executor.submit(context.run, timed_job, self.name, time.perf_counter(), functools.partial(function, *args))
+        future.add_done_callback(lambda _: self.release())
+        # Cancelling the awaiting task cancels the job if it has not started yet.
+        return await asyncio.wrap_future(future)
+
+    async def acquire_worker(self):
+        if self.workers.acquire(blocking=False):
+            return
+        waiting = asyncio.get_running_loop().run_in_executor(self.waiters, self.workers.acquire)
+        try:
+            await asyncio.shield(waiting)
+        except asyncio.CancelledError:
+            # The waiter thread still gets the worker, which is handed straight back.
+            waiting.add_done_callback(lambda _: self.workers.release())
+            raise
+
+    async def run_shared(self, key, function, *args):
+        # Like run, but a request for a key whose job is already running waits for that job's result.
+        with self.shared_lock:
+            shared = self.shared_jobs.get(key)
+            if shared is None:
+                self.shared_jobs[key] = Future()
+        if shared is not None:
+            return await asyncio.shield(asyncio.wrap_future(shared))
+        try:
+            value = await self.run(function, *args)
+        except asyncio.CancelledError:
+            # The requests waiting on the job are asked to retry rather than cancelled with it.
+            self.finish_shared(key, exception=PoolBusy(f"The {self.name} job was cancelled, retry shortly"))
+            raise
+        except BaseException as e:
+            self.finish_shared(key, exception=e)
+            raise
+        self.finish_shared(key, value=value)
+        return value
+
+    def finish_shared(self, key, value=None, exception=None):
+        with self.shared_lock:
+            shared = self.shared_jobs.pop(key)
+        if exception is not None:
+            shared.set_exception(exception)
+        else:
+            shared.set_result(value)
+
+    def submit(self, function, *args):
+        # For jobs that outlive the request starting them: returns a concurrent.futures.Future that fails with
+        # PoolBusy when the pool is full.
+        return self.background.submit(asyncio.run, self.run(function, *args))
+
+    def send_job(self, payload, sender):
+        state = self.snapshot() if self.snapshot is not None else None
+        with self.server_lock:
+            self.start_server()
+            try:
+                self.server_conn.send((state, payload))
+                reduction.send_handle(self.server_conn, sender.fileno(), self.server.pid)
+                return self.server_conn.recv()
+            except (EOFError, OSError) as e:
+                self.server = None
+                raise WorkerCrashed(f"{self.name} fork server is gone: {e}")
+
+    async def run_process(self, function, args):
+        loop = asyncio.get_running_loop()
+        collector = Profiling.active_profile.get()
+        job_id = uuid.uuid4().hex
+        payload = pickle.dumps((function, args, None if collector is None else collector.part_path(job_id)))
+        receiver, sender = multiprocessing.get_context("fork").Pipe(duplex=False)
+        try:
+            pid = self.send_job(payload, sender)
+        except BaseException:
+            receiver.close()
+            raise
+        finally:
+            sender.close()
+        ready = loop.create_future()
+        loop.add_reader(receiver.fileno(), lambda: ready.done() or ready.set_result(None))
+        try:
+            await ready
+            try:
+                ok, value, metrics_state = receiver.recv()
+            except EOFError:
+                raise WorkerCrashed(f"{self.name} worker {pid} exited without a result")
+            Metrics.merge_state(metrics_state)
+            if collector is not None:
+                collector.add_child(job_id)
+            if not ok:
+                raise WorkerCrashed(value)
+            return value
+        except asyncio.CancelledError:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+            print("CANCELLED", self.name, "JOB IN PROCESS", pid)
+            await loop.run_in_executor(None, wait_for_exit, pid)
+            raise
+        finally:
+            loop.remove_reader(receiver.fileno())
+            receiver.close()
+
+model_pool = WorkPool("model", int(os.environ.get("RECVIZ_MODEL_WORKERS", "2")),
+                      int(os.environ.get("RECVIZ_MODEL_QUEUE", "16")))
+similarity_pool = WorkPool("similarity", int(os.environ.get("RECVIZ_SIMILARITY_WORKERS", str(os.cpu_count() or 1))),
+                           int(os.environ.get("RECVIZ_SIMILARITY_QUEUE", "64")))
+graph_pool = WorkPool("graph", int(os.environ.get("RECVIZ_GRAPH_WORKERS", "2")),
+                      int(os.environ.get("RECVIZ_GRAPH_QUEUE", "8")), use_processes=True)
+
+Metrics.register_gauge("recviz_pool_in_flight",
+                       lambda: {(("pool", pool.name),): pool.in_flight for pool in (model_pool, similarity_pool, graph_pool)},
+                       "Jobs running or queued per worker pool.")
+Metrics.register_gauge("recviz_pool_capacity",
+                       lambda: {(("pool", pool.name),): pool.max_pending for pool in (model_pool, similarity_pool, graph_pool)},
+                       "Maximum jobs running or queued per worker pool.")
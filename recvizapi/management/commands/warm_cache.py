@@ -0,0 +1,127 @@
+import os
+import time
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from urllib.parse import parse_qs
+from django.core.management.base import BaseCommand, CommandError
+from recvizapi.DatasetManager import DatasetManager
+from recvizapi.GraphService import GraphService, compute_graph_key, set_worker_service, warm_in_worker
+from recvizapi.SimilarityService import SimilarityService, set_worker_similarity_service, build_random_walks_in_worker
+
+# Per-user bookkeeping fields that are not features to filter on.
+ignored_features = {"user_id", "user_history_length", "interaction_history", "interaction_history_str"}
+
+def set_worker_services(graph_service, similarity_service):
+    set_worker_service(graph_service)
+    set_worker_similarity_service(similarity_service)
+
+def parse_preset(preset):
+    # Same shape as the query string the graph endpoints take, e.g. "gender=M&age=20-29".
+    filters = parse_qs(preset, keep_blank_values=False)
+    if not filters:
+        raise CommandError(f"Filter preset {preset!r} has no feature=value pairs")
+    return filters
+
+def common_value_presets(ds_obj, top_values, features=None):
+    # One single-value preset for each of the most frequent values of every user feature.
+    user_mapping = ds_obj.get_user_mapping()
+    features = features or [feature for feature in ds_obj.get_user_features() if feature not in ignored_features]
+    presets = []
+    for feature in features:
+        counts = Counter(str(user[feature]) for user in user_mapping.values() if feature in user)
+        for value, _ in counts.most_common(top_values):
+            presets.append({feature: [value]})
+    return presets
+
+class Command(BaseCommand):
+    help = "Precompute graph layouts (gexf) and Louvain partitions into RECVIZ_CACHE_PATH."
+
+    def add_arguments(self, parser):
+        parser.add_argument("datasets", nargs="*", help="datasets to warm, all loaded datasets by default")
+        parser.add_argument("--filter", action="append", default=[], dest="presets",
+                            help='filter preset in query string form, e.g. "gender=M&age=20-29"; repeatable')
+        parser.add_argument("--top-values", type=int, default=0,
+                            help="also warm a preset for the N most common values of each user feature")
+        parser.add_argument("--features", help="comma separated user features for --top-values")
+        parser.add_argument("--no-full", action="store_true", help="skip the unfiltered graph")
+        parser.add_argument("--workers", type=int,
+                            default=int(os.environ.get("RECVIZ_GRAPH_WORKERS", str(os.cpu_count() or 1))))
+        parser.add_argument("--force", action="store_true", help="rebuild even if the cached files are up to date")
+        parser.add_argument("--indexes", action="store_true", help="also build the neighbourhood, similar-user and random walk indexes of each dataset")
+
+    def handle(self, *args, **options):
+        if "RECVIZ_CACHE_PATH" not in os.environ:
+            raise CommandError("Environment variable RECVIZ_CACHE_PATH is not set")
+        if "RECVIZ_DS_PATH" not in os.environ:
+            raise CommandError("Environment variable RECVIZ_DS_PATH is not set")
+        dataset_manager = DatasetManager()
+        graph_service = GraphService(os.environ["RECVIZ_CACHE_PATH"], dataset_manager)
+
+        datasets = options["datasets"] or dataset_manager.get_available_datasets()
+        presets = [parse_preset(preset) for preset in options["presets"]]
+        features = [feature for feature in (options["features"] or "").split(",") if feature]
+        entries = []
+        for dataset_name in datasets:
+            dsm_entry = dataset_manager.get_dataset(dataset_name)
+            if dsm_entry is None:
+                raise CommandError(f"Dataset {dataset_name!r} is not loaded")
+            dataset_presets = ([] if options["no_full"] else [None]) + presets
+            if options["top_values"]:
+                dataset_presets += common_value_presets(dsm_entry["dataset_obj"], options["top_values"], features)
+            keys = set()
+            for filters in dataset_presets:
+                graph_key = compute_graph_key(dataset_name, filters)
+                if graph_key not in keys:
+                    keys.add(graph_key)
+                    entries.append((graph_key, dataset_name, filters))
+
+        similarity_service = SimilarityService(dataset_manager, os.environ["RECVIZ_CACHE_PATH"])
+        if options["indexes"]:
+            for dataset_name in datasets:
+                start = time.perf_counter()
+                graph_service.get_adjacency_index(dataset_name)
+                self.stdout.write(f"{dataset_name} ADJACENCY INDEX READY IN {time.perf_counter() - start:.1f}s")
+                start = time.perf_counter()
+                similarity_service.get_neighbour_index(dataset_name)
+                self.stdout.write(f"{dataset_name} NEIGHBOUR INDEX READY IN {time.perf_counter() - start:.1f}s")
+
+        self.stdout.write(f"WARMING {len(entries)} GRAPHS WITH {options['workers']} WORKERS")
+        start = time.perf_counter()
+        failures = 0
+        # Forked workers inherit the loaded datasets instead of parsing them again. They are forked before the pool
+        # starts its own thread, so the random walk index, which forks its sampling processes, is built in them too.
+        context = multiprocessing.get_context("fork")
+        with ProcessPoolExecutor(max_workers=max(options["workers"], 1), mp_context=context, initializer=set_worker_services,
+                                 initargs=(graph_service, similarity_service)) as executor:
+            if options["indexes"]:
+                index_futures = {executor.submit(build_random_walks_in_worker, dataset_name): (dataset_name, time.perf_counter())
+                                 for dataset_name in datasets}
+            futures = {executor.submit(warm_in_worker, dataset_name, filters, options["force"]): graph_key
+                       for graph_key, dataset_name, filters in entries}
+            for done, future in enumerate(as_completed(futures), start=1):
+                graph_key = futures[future]
+                try:
+                    report = future.result()
+                except Exception as e:
+                    failures += 1
+                    self.stderr.write(f"[{done}/{len(entries)}] {graph_key} FAILED: {type(e).__name__}: {e}")
+                    continue
+                if report["built"]:
+                    timings = ", ".join(f"{artifact} {seconds:.1f}s" for artifact, seconds in report["seconds"].items())
+                    self.stdout.write(f"[{done}/{len(entries)}] {graph_key} BUILT {timings} "
+                                      f"({report['nodes']} nodes, {report['edges']} edges)")
+                else:
+                    self.stdout.write(f"[{done}/{len(entries)}] {graph_key} UP TO DATE")
+            if options["indexes"]:
+                for future, (dataset_name, submitted) in index_futures.items():
+                    try:
+                        future.result()
+                    except Exception as e:
+                        failures += 1
+                        self.stderr.write(f"{dataset_name} RANDOM WALK INDEX FAILED: {type(e).__name__}: {e}")
+                        continue
+                    self.stdout.write(f"{dataset_name} RANDOM WALK INDEX READY IN {time.perf_counter() - submitted:.1f}s")
+        self.stdout.write(f"DONE IN {time.perf_counter() - start:.1f}s")
+        if failures:
+            raise CommandError(f"{failures} of {len(entries)} graphs or indexes failed")
@@ -0,0 +1,109 @@
+import networkx as nx
+import numpy as np
+import pytest
+import scipy.sparse as sp
+from recvizapi.AdjacencyIndex import AdjacencyIndex, read_layout
+
+@pytest.fixture
+def counts():
+    # user 1 - items 1, 2 (twice); user 2 - item 2; user 3 - items 2, 3; user 4 has no history.
+    return sp.csr_matrix(np.array([
+        [1, 2, 0],
+        [0, 1, 0],
+        [0, 1, 1],
+        [0, 0, 0],
+    ], dtype=np.float32))
+
+@pytest.fixture
+def index(counts):
+    return AdjacencyIndex().build(counts, ["1", "2", "3", "4"], ["1", "2", "3"])
+
+def labels(index, rows):
+    return index.nodes[rows].tolist()
+
+def test_k_hop_matches_networkx(index, counts):
+    graph = nx.Graph()
+    for user, item in zip(*counts.nonzero()):
+        graph.add_edge(f"user-{user + 1}", f"item-{item + 1}")
+    for hops in (1, 2, 3):
+        rows, depths, truncated = index.neighbourhood("user-1", hops)
+        expected = nx.single_source_shortest_path_length(graph, "user-1", cutoff=hops)
+        assert dict(zip(labels(index, rows), depths.tolist())) == expected
+        assert not truncated
+
+def test_caps_keep_heaviest_edges(index):
+    rows, depths, _ = index.neighbourhood("user-1", 1, caps=[1])
+    assert labels(index, rows) == ["user-1", "item-2"]
+    # The last cap applies to every further hop; ties go to the lower row.
+    rows, depths, _ = index.neighbourhood("user-1", 3, caps=[2, 1])
+    assert labels(index, rows) == ["user-1", "item-1", "item-2", "user-2"]
+    assert depths.tolist() == [0, 1, 1, 2]
+
+def test_max_nodes_truncates_expansion(index):
+    rows, depths, truncated = index.neighbourhood("item-2", 2, max_nodes=3)
+    assert truncated
+    assert labels(index, rows) == ["item-2", "user-1", "user-2"]
+
+def test_induced_edges_with_weights(index):
+    rows, _, _ = index.neighbourhood("user-1", 1)
+    sources, targets, weights = index.edges(rows)
+    edges = sorted(zip(labels(index, rows[sources]), labels(index, rows[targets]), weights.tolist()))
+    assert edges == [("user-1", "item-1", 1.0), ("user-1", "item-2", 2.0)]
+
+def test_isolated_node_and_unknown_node(index):
+    rows, depths, _ = index.neighbourhood("user-4", 2)
+    assert labels(index, rows) == ["user-4"]
+    with pytest.raises(KeyError):
+        index.neighbourhood("user-9")
+
+def test_cached_layout_positions(index, tmp_path):
+    graph = nx.Graph()
+    for row, node in enumerate(index.nodes.tolist()):
+        graph.add_node(node, x=float(row), y=-float(row), interaction_history_str="[]")
+    gexf_path = str(tmp_path / "ds1.gexf")
+    nx.write_gexf(graph, gexf_path)
+    assert read_layout(gexf_path)["item-3"] == (6.0, -6.0)
+    assert index.attach_layout(gexf_path)
+    assert not index.attach_layout(gexf_path)
+    rows, depths, _ = index.neighbourhood("user-2", 1)
+    x, y, layout = index.layout(rows, depths, *index.edges(rows))
+    assert layout == "cached"
+    assert x.tolist() == [1.0, 5.0]
+
+def test_local_layout_without_cached_positions(index):
+    rows, depths, _ = index.neighbourhood("user-1", 2)
+    x, y, layout = index.layout(rows, depths, *index.edges(rows))
+    assert layout == "local"
+    assert len(x) == len(rows) and np.isfinite(x).all()
+
+def test_save_and_load(index, counts, tmp_path):
+    index.index_path = str(tmp_path / "ds1_adjacency")
+    index.save()
+    loaded = AdjacencyIndex(index.index_path)
+    assert loaded.load((4, 3, counts.nnz))
+    assert labels(loaded, loaded.neighbourhood("user-3", 1)[0]) == ["user-3", "item-2", "item-3"]
+    assert not AdjacencyIndex(index.index_path).load((4, 3, counts.nnz + 1))
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["ds1_adjacency.npz", "ds1_adjacency_nodes.npz"]
+
+def test_failed_save_keeps_previous_index(index, counts, tmp_path, monkeypatch):
+    index.index_path = str(tmp_path / "ds1_adjacency")
+    index.save()
+
+    def failing_savez(file, **arrays):
+        file.write(b"partial")
+        raise OSError("disk full")
+
+    monkeypatch.setattr("recvizapi.AdjacencyIndex.np.savez", failing_savez)
+    with pytest.raises(OSError):
+        index.save()
+    assert AdjacencyIndex(index.index_path).load((4, 3, counts.nnz))
+    assert not [path for path in tmp_path.iterdir() if path.name.startswith(".")]
+
+def test_add_updates_weights_both_ways(index):
+    delta = sp.csr_matrix(([1.0, 1.0], ([3, 0], [0, 1])), shape=(4, 3))
+    index.add(delta)
+    assert index.matches((4, 3, 6))
+    rows, depths, _ = index.neighbourhood("user-4", 1)
+    assert labels(index, rows) == ["user-4", "item-1"]
+    sources, targets, weights = index.edges(np.array([index.rows["user-1"], index.rows["item-2"]]))
+    assert weights.tolist() == [3.0]
@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+import torch
+from recvizapi.AnnIndex import AnnIndex, get_model_embeddings
+
+@pytest.fixture(autouse=True)
+def force_ivf(monkeypatch):
+    monkeypatch.setattr("recvizapi.AnnIndex.use_hnsw", False)
+
+@pytest.fixture
+def item_vectors():
+    rng = np.random.default_rng(0)
+    return rng.normal(size=(200, 8)).astype(np.float32)
+
+def exact_topk(queries, item_vectors, k):
+    scores = queries @ item_vectors.T
+    scores[:, 0] = -np.inf
+    return np.argsort(-scores, axis=1)[:, :k]
+
+def test_search_matches_exact_when_probing_all_lists(item_vectors, monkeypatch):
+    monkeypatch.setattr("recvizapi.AnnIndex.ivf_probe_lists", 1000)
+    queries = item_vectors[:5] + 0.1
+    index = AnnIndex().build(item_vectors)
+    scores, ids = index.search(queries, 10)
+    assert ids.tolist() == exact_topk(queries, item_vectors, 10).tolist()
+    assert np.all(np.diff(scores, axis=1) <= 0)
+
+def test_search_never_returns_padding_item(item_vectors):
+    index = AnnIndex().build(item_vectors)
+    _, ids = index.search(item_vectors[:3], 5)
+    assert 0 not in ids
+
+def test_search_excludes_history_items(item_vectors, monkeypatch):
+    monkeypatch.setattr("recvizapi.AnnIndex.ivf_probe_lists", 1000)
+    queries = item_vectors[:1]
+    best = exact_topk(queries, item_vectors, 3)[0]
+    _, ids = AnnIndex().build(item_vectors).search(queries, 3, exclude=[best[:2]])
+    assert best[0] not in ids[0] and best[1] not in ids[0]
+    assert ids[0][0] == best[2]
+
+def test_save_and_load_round_trip(item_vectors, tmp_path):
+    index_path = str(tmp_path / "ds1_model_ann")
+    metadata = {"model_file": "model.pth", "items": 200}
+    built = AnnIndex(index_path).build(item_vectors, metadata)
+    built.save()
+    loaded = AnnIndex(index_path)
+    assert loaded.load(metadata, item_vectors.shape[1])
+    assert loaded.search(item_vectors[:2], 5)[1].tolist() == built.search(item_vectors[:2], 5)[1].tolist()
+
+def test_load_rejects_stale_metadata(item_vectors, tmp_path):
+    index_path = str(tmp_path / "ds1_model_ann")
+    AnnIndex(index_path).build(item_vectors, {"items": 200}).save()
+    assert not AnnIndex(index_path).load({"items": 201}, item_vectors.shape[1])
+
+class BPR(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.user_embedding = torch.nn.Embedding(3, 4)
+        self.item_embedding = torch.nn.Embedding(5, 4)
+
+class NCL(BPR):
+    def forward(self):
+        return self.user_embedding.weight * 2, self.item_embedding.weight, []
+
+class ENMF(BPR):
+    pass
+
+def test_get_model_embeddings_from_embedding_tables():
+    user_vectors, item_vectors = get_model_embeddings(BPR())
+    assert user_vectors.shape == (3, 4)
+    assert item_vectors.shape == (5, 4)
+
+def test_get_model_embeddings_from_propagated_embeddings():
+    model = NCL()
+    user_vectors, item_vectors = get_model_embeddings(model)
+    assert np.allclose(user_vectors, model.user_embedding.weight.detach().numpy() * 2)
+
+def test_get_model_embeddings_unsupported_model():
+    # Embedding tables alone do not make a model an inner-product scorer.
+    assert get_model_embeddings(ENMF()) is None
+    assert get_model_embeddings(torch.nn.Linear(2, 2)) is None
+
+def test_search_pads_rows_without_enough_candidates(item_vectors):
+    scores, ids = AnnIndex().build(item_vectors[:4]).search(item_vectors[:1], 5)
+    assert ids[0, 3:].tolist() == [0, 0]
+    assert np.isinf(scores[0, 3:]).all()
+
+def test_long_history_does_not_widen_other_queries(item_vectors, monkeypatch):
+    monkeypatch.setattr("recvizapi.AnnIndex.ivf_probe_lists", 1000)
+    monkeypatch.setattr("recvizapi.AnnIndex.max_excluded_fetch", 50)
+    index = AnnIndex().build(item_vectors)
+    fetched = []
+    search_ivf = index.search_ivf
+    monkeypatch.setattr(index, "search_ivf", lambda queries, fetch: fetched.append((len(queries), fetch)) or search_ivf(queries, fetch))
+    queries = item_vectors[:3]
+    best = exact_topk(queries, item_vectors, 150)
+    scores, ids = index.search(queries, 3, exclude=[np.empty(0, dtype=np.int64), best[1, :1], best[2]])
+    assert sorted(fetched) == [(1, 3), (1, 4), (1, 53)]
+    assert ids[1].tolist() == best[1, 1:4].tolist()
+    # Capped at max_excluded_fetch extra candidates, the long history leaves the row short for exact rescoring.
+    assert not np.isfinite(scores[2]).all()
+
+def test_save_leaves_no_temporary_files(item_vectors, tmp_path):
+    AnnIndex(str(tmp_path / "ds1_model_ann")).build(item_vectors, {"items": 200}).save()
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["ds1_model_ann.json", "ds1_model_ann.npz"]
@@ -1,3 +1,5 @@
+import os
+import numpy as np
 import pytest
 
 from recvizapi.Dataset import Dataset
@@ -45,8 +47,8 @@ def test_user_history_length(dataset_instance):
     assert user_mapping['1']["user_history_length"] == 1
 
 def test_user_interaction_history_length(dataset_instance):
-    user_mapping = dataset_instance.get_user_mapping()
-    assert len(user_mapping['1']["interaction_history"]) == 1
+    assert len(dataset_instance.get_user_history('1')) == 1
+    assert "interaction_history" not in dataset_instance.get_user_mapping()['1']
 
 def test_user_features_contains_default(dataset_instance):
     assert "user_history_length" in dataset_instance.get_user_features()
@@ -64,14 +66,164 @@ def test_item_mapping_feature(dataset_instance):
     item_mapping = dataset_instance.get_item_mapping()
     assert item_mapping['item1']["type"] == "book"
 
-def test_interaction_history_contains_timestamp(dataset_instance):
-    assert "1743179400" in dataset_instance.get_interaction_history()
+def test_history_index_contains_timestamp(dataset_instance):
+    assert dataset_instance.get_history_index().timestamps.tolist() == [1743179400]
 
-def test_timestamps(dataset_instance):
-    assert dataset_instance.get_timestamps() == ["1743179400"]
+def test_user_history_records(tmp_path):
+    (tmp_path / "ds.user").write_text("user_id:token\n1\n2\n", encoding='utf-8')
+    (tmp_path / "ds.item").write_text("item_id:token\na\nb\n", encoding='utf-8')
+    (tmp_path / "ds.inter").write_text("user_id:token\titem_id:token\trating:float\ttimestamp:float\n"
+                                       "1\tb\t4\t300\n1\ta\t5\t100\n", encoding='utf-8')
+    ds = Dataset(str(tmp_path), ["ds.inter"], ["ds.user"], ["ds.item"], "ds", [])
+    assert ds.get_user_history("1") == [{"item_id": "a", "rating": "5"}, {"item_id": "b", "rating": "4"}]
+    assert ds.get_user_history("2") == []
+    assert ds.get_user_history("3") is None
 
 def test_dataset_name(dataset_instance):
     assert dataset_instance.get_dataset_name() == "test_dataset"
 
 def test_models(dataset_instance):
     assert dataset_instance.get_models() == []
+
+def test_user_and_item_index(dataset_instance):
+    assert dataset_instance.get_user_index() == {'1': 0}
+    assert dataset_instance.get_item_index() == {'item1': 0}
+
+def test_interaction_matrix(dataset_instance):
+    matrix = dataset_instance.get_interaction_matrix()
+    assert matrix.shape == (1, 1)
+    assert matrix[0, 0] == 1
+
+def test_interaction_arrays_sorted_by_timestamp(tmp_path):
+    (tmp_path / "ds.user").write_text("user_id:token\n1\n2\n", encoding='utf-8')
+    (tmp_path / "ds.item").write_text("item_id:token\na\nb\n", encoding='utf-8')
+    (tmp_path / "ds.inter").write_text("user_id:token\titem_id:token\ttimestamp:float\n"
+                                       "2\tb\t300\n1\ta\t100\n1\tb\t1000\n2\ta\t100\n", encoding='utf-8')
+    ds = Dataset(str(tmp_path), ["ds.inter"], ["ds.user"], ["ds.item"], "ds", [])
+    arrays = ds.get_interaction_arrays()
+    assert arrays["timestamps"].tolist() == [100, 100, 300, 1000]
+    pairs = arrays["distinct_pairs"][arrays["pair_ids"]]
+    assert sorted(pairs[:2].tolist()) == [0, 2]
+    assert pairs[2:].tolist() == [3, 1]
+    assert ds.get_window_bounds(100, 300) == (0, 2)
+    assert ds.get_window_bounds(150, None) == (2, 4)
+    assert ds.get_window_bounds(2000, 100) == (4, 4)
+
+@pytest.fixture
+def appendable_dataset(tmp_path):
+    (tmp_path / "ds.user").write_text("user_id:token\n1\n2\n", encoding='utf-8')
+    (tmp_path / "ds.item").write_text("item_id:token\na\nb\n", encoding='utf-8')
+    (tmp_path / "ds.inter").write_text("user_id:token\titem_id:token\ttimestamp:float\n"
+                                       "1\ta\t100\n2\tb\t300\n", encoding='utf-8')
+    return Dataset(str(tmp_path), ["ds.inter"], ["ds.user"], ["ds.item"], "ds", [])
+
+def test_ingest_appended_lines(appendable_dataset, tmp_path):
+    ds = appendable_dataset
+    ds.get_interaction_arrays()
+    with open(tmp_path / "ds.inter", "a", encoding='utf-8') as f:
+        f.write("1\tb\t200\n1\ta\t300\n3\ta\t400\n2\tb\t50")
+    appended = ds.ingest_appended()
+    # The unknown user is skipped and the unterminated last line waits for its newline.
+    assert (appended["appended"], appended["skipped"], appended["new_pairs"]) == (2, 1, 1)
+    assert appended["users"].tolist() == [0]
+    assert ds.get_user_mapping()["1"]["user_history_length"] == 3
+    assert ds.get_user_history("1") == [{"item_id": "a"}, {"item_id": "b"}, {"item_id": "a"}]
+    assert ds.get_interaction_matrix().toarray().tolist() == [[2, 1], [0, 1]]
+    merged = ds.get_interaction_arrays()
+    assert merged["timestamps"].tolist() == [100, 200, 300, 300]
+    pairs = merged["distinct_pairs"][merged["pair_ids"]].tolist()
+    # Interactions with equal timestamps may come in either order.
+    assert pairs[:2] == [0, 1] and sorted(pairs[2:]) == [0, 3]
+
+    with open(tmp_path / "ds.inter", "a", encoding='utf-8') as f:
+        f.write("\n")
+    assert ds.ingest_appended()["appended"] == 1
+    assert ds.ingest_appended()["appended"] == 0
+
+def test_ingest_appended_up_to_another_reader(appendable_dataset, tmp_path):
+    ds = appendable_dataset
+    with open(tmp_path / "ds.inter", "a", encoding='utf-8') as f:
+        f.write("1\tb\t200\n")
+    end_offsets = {path: os.path.getsize(path) for path in ds.inter_offsets}
+    with open(tmp_path / "ds.inter", "a", encoding='utf-8') as f:
+        f.write("2\ta\t400\n")
+    # Lines past the other reader's offsets are left for a later read.
+    assert ds.ingest_appended(end_offsets)["appended"] == 1
+    assert ds.inter_offsets == end_offsets
+    assert ds.ingest_appended()["appended"] == 1
+
+def test_write_interactions(appendable_dataset, tmp_path):
+    ds = appendable_dataset
+    written = ds.write_interactions([{"user_id": "2", "item_id": "a", "timestamp": 500},
+                                     {"user_id": "9", "item_id": "a", "timestamp": 500}])
+    assert written == (1, 1)
+    assert (tmp_path / "ds.inter").read_text(encoding='utf-8').endswith("300\n2\ta\t500\n")
+    assert ds.ingest_appended()["appended"] == 1
+    with pytest.raises(ValueError):
+        ds.write_interactions([{"user_id": "2", "item_id": "a"}])
+
+def test_shared_arrays_are_mapped_by_every_loader(appendable_dataset, tmp_path):
+    shared_dir = tmp_path / "shared"
+    first = Dataset(str(tmp_path), ["ds.inter"], ["ds.user"], ["ds.item"], "ds", [], str(shared_dir))
+    matrix = first.get_interaction_matrix()
+    arrays = first.get_interaction_arrays()
+    assert not matrix.data.flags.writeable and not arrays["timestamps"].flags.writeable
+    second = Dataset(str(tmp_path), ["ds.inter"], ["ds.user"], ["ds.item"], "ds", [], str(shared_dir))
+    assert second.get_interaction_matrix().toarray().tolist() == appendable_dataset.get_interaction_matrix().toarray().tolist()
+    assert second.get_interaction_arrays()["pair_ids"].tolist() == appendable_dataset.get_interaction_arrays()["pair_ids"].tolist()
+    assert isinstance(second.get_interaction_arrays()["timestamps"], np.memmap)
+    assert first.get_history_index().entries(1).tolist() == [1]
+    assert isinstance(second.get_history_index().items, np.memmap)
+
+    # Ingesting replaces the mapped arrays with private ones; a dataset loaded afterwards gets a new fingerprint.
+    with open(tmp_path / "ds.inter", "a", encoding='utf-8') as f:
+        f.write("2\ta\t400\n")
+    assert second.ingest_appended()["appended"] == 1
+    assert second.get_interaction_matrix().toarray().tolist() == [[1, 0], [1, 1]]
+    assert second.get_history_index().entries(1).tolist() == [1, 0]
+    third = Dataset(str(tmp_path), ["ds.inter"], ["ds.user"], ["ds.item"], "ds", [], str(shared_dir))
+    assert third.shared.fingerprint != first.shared.fingerprint
+    assert third.get_interaction_arrays()["timestamps"].tolist() == [100, 300, 400]
+
+def test_later_loader_attaches_without_parsing(tmp_path, monkeypatch):
+    (tmp_path / "ds.user").write_text("user_id:token\n1\n2\n", encoding='utf-8')
+    (tmp_path / "ds.item").write_text("item_id:token\na\nb\n", encoding='utf-8')
+    (tmp_path / "ds.inter").write_text("user_id:token\titem_id:token\treview:token_seq\ttimestamp:float\n"
+                                       "1\ta\t" + "x" * 1000 + "\t100\n1\tb\tok\t200\n2\tb\tok\t300\n", encoding='utf-8')
+    shared_dir = tmp_path / "shared"
+    first = Dataset(str(tmp_path), ["ds.inter"], ["ds.user"], ["ds.item"], "ds", [], str(shared_dir))
+    # Values are stored once in a vocabulary and referenced by code.
+    assert first.get_history_index().field_codes.dtype == np.int32
+    monkeypatch.setattr(Dataset, "parse_interactions", lambda *args, **kwargs: pytest.fail("parsed again"))
+    second = Dataset(str(tmp_path), ["ds.inter"], ["ds.user"], ["ds.item"], "ds", [], str(shared_dir))
+    monkeypatch.undo()
+    assert second.get_validity()
+    assert second.get_user_mapping()["1"]["user_history_length"] == 2
+    assert second.get_user_history("1") == first.get_user_history("1")
+
+    with open(tmp_path / "ds.inter", "a", encoding='utf-8') as f:
+        f.write("2\ta\tnew\t400\n")
+    assert second.ingest_appended()["appended"] == 1
+    assert second.get_user_history("2") == [{"item_id": "b", "review": "ok"}, {"item_id": "a", "review": "new"}]
+    assert second.get_user_mapping()["2"]["user_history_length"] == 2
+
+def test_history_index_slices(tmp_path):
+    (tmp_path / "ds.user").write_text("user_id:token\n1\n2\n", encoding='utf-8')
+    (tmp_path / "ds.item").write_text("item_id:token\tmovie_title:token_seq\na\tAlpha\nb\tBeta\n", encoding='utf-8')
+    (tmp_path / "ds.inter").write_text("user_id:token\titem_id:token\ttimestamp:float\n"
+                                       "1\tb\t300\n1\ta\t100\n2\tz\t50\n1\tz\t200\n", encoding='utf-8')
+    ds = Dataset(str(tmp_path), ["ds.inter"], ["ds.user"], ["ds.item"], "ds", [])
+    history_index = ds.get_history_index()
+    assert history_index.titles_of(history_index.entries(0)) == ["Alpha", "Unknown ID z", "Beta"]
+    assert history_index.titles_of(history_index.entries(0, k=2)) == ["Unknown ID z", "Beta"]
+    assert history_index.titles_of(history_index.entries(0, start=150, end=300)) == ["Unknown ID z"]
+    assert history_index.titles_of(history_index.entries(1)) == ["Unknown ID z"]
+    assert "interaction_history_str" not in ds.get_user_mapping()["1"]
+
+    with open(tmp_path / "ds.inter", "a", encoding='utf-8') as f:
+        f.write("2\ta\t60\n1\ta\t250\n1\tb\t10\n")
+    ds.ingest_appended()
+    assert history_index.titles_of(history_index.entries(0)) == ["Beta", "Alpha", "Unknown ID z", "Alpha", "Beta"]
+    assert history_index.titles_of(history_index.entries(1)) == ["Unknown ID z", "Alpha"]
+    reloaded = Dataset(str(tmp_path), ["ds.inter"], ["ds.user"], ["ds.item"], "ds", []).get_history_index()
+    assert reloaded.titles_of(reloaded.entries(0)) == history_index.titles_of(history_index.entries(0))
@@ -2,7 +2,7 @@ import pytest
 from recvizapi.DatasetManager import DatasetManager
 
 class FakeDataset:
-    def __init__(self, dataset_dir_path, inter_files, user_files, item_files, dataset_sub_dir, models):
+    def __init__(self, dataset_dir_path, inter_files, user_files, item_files, dataset_sub_dir, models, shared_dir=None):
         self.dataset_dir_path = dataset_dir_path
         self.inter_files = inter_files
         self.user_files = user_files
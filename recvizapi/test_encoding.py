@@ -0,0 +1,43 @@
+import gzip
+import json
+import numpy as np
+import pytest
+from recvizapi.Encoding import accepted_encodings, dumps, encode_payload
+
+@pytest.fixture(params=[True, False])
+def json_backend(request, monkeypatch):
+    if request.param:
+        pytest.importorskip("orjson")
+    monkeypatch.setattr("recvizapi.Encoding.use_orjson", request.param)
+    return request.param
+
+def test_dumps_handles_numpy(json_backend):
+    payload = {"users": np.array(["1", "2"], dtype=object), "scores": np.array([[0.5, 0.25]], dtype=np.float32),
+               "k": np.int64(2)}
+    assert json.loads(dumps(payload)) == {"users": ["1", "2"], "scores": [[0.5, 0.25]], "k": 2}
+
+def test_accepted_encodings_parses_quality():
+    assert accepted_encodings("gzip;q=0.5, br") == {"gzip": 0.5, "br": 1.0}
+    assert accepted_encodings(None) == {}
+
+def test_small_bodies_are_not_compressed():
+    body, encoding = encode_payload({"a": 1}, "gzip")
+    assert encoding is None
+    assert json.loads(body) == {"a": 1}
+
+def test_gzip_negotiation(monkeypatch):
+    monkeypatch.setattr("recvizapi.Encoding.use_brotli", False)
+    payload = {"titles": ["Some Movie Title"] * 500}
+    body, encoding = encode_payload(payload, "br, gzip")
+    assert encoding == "gzip"
+    assert json.loads(gzip.decompress(body)) == payload
+    body, encoding = encode_payload(payload, "gzip;q=0")
+    assert encoding is None
+
+def test_brotli_negotiation(monkeypatch):
+    brotli = pytest.importorskip("brotli")
+    monkeypatch.setattr("recvizapi.Encoding.use_brotli", True)
+    payload = {"titles": ["Some Movie Title"] * 500}
+    body, encoding = encode_payload(payload, "gzip, br")
+    assert encoding == "br"
+    assert json.loads(brotli.decompress(body)) == payload
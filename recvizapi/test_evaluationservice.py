@@ -0,0 +1,129 @@
+import numpy as np
+import pytest
+from recvizapi.EvaluationService import EvaluationService, ranking_metrics, bucket_labels
+from recvizapi.HistoryIndex import HistoryIndex, history_arrays
+
+ITEMS = ["a", "b", "c", "d"]
+
+class FakeDataset:
+    def __init__(self, model_file, interactions=None):
+        self.model_file = model_file
+        # (user row, item, timestamp) in file order
+        self.interactions = interactions or [(0, "c", 1), (0, "a", 2), (1, "a", 1), (1, "d", 2)]
+
+    def get_validity(self):
+        return True
+
+    def get_models(self):
+        return {"model1.pth": self.model_file}
+
+    def get_user_ids(self):
+        return ["1", "2"]
+
+    def get_item_ids(self):
+        return ITEMS
+
+    def get_user_index(self):
+        return {"1": 0, "2": 1}
+
+    def get_history_index(self):
+        rows, items, timestamps = zip(*self.interactions)
+        arrays = history_arrays(rows, [ITEMS.index(item) for item in items], np.array(timestamps, dtype=np.float64), 2)
+        return HistoryIndex(arrays["history_indptr"], arrays["history_items"], arrays["history_timestamps"],
+                            ITEMS, [], {item: {} for item in ITEMS})
+
+    def get_user_mapping(self):
+        return {
+            "1": {"age": "25", "interaction_history": [{"item_id": "c"}, {"item_id": "a"}]},
+            "2": {"age": "40", "interaction_history": [{"item_id": "a"}, {"item_id": "d"}]},
+        }
+
+class FakeDatasetManager:
+    def __init__(self, model_file, interactions=None):
+        self.model_file = model_file
+        self.interactions = interactions
+
+    def get_dataset(self, ds_name):
+        return {"dataset_obj": FakeDataset(self.model_file, self.interactions)}
+
+class FakeRecboleDataset:
+    uid_field = "uid"
+    iid_field = "iid"
+
+    def token2id(self, field, tokens):
+        return [int(token) for token in tokens]
+
+    def id2token(self, field, ids):
+        return np.array(["[PAD]"] + ITEMS)[ids]
+
+class FakeTestData:
+    def __init__(self, masked):
+        self.uid2history_item = np.array([None] + masked, dtype=object)
+
+class FakeRecommendationService:
+    def __init__(self, masked=None):
+        self.calls = 0
+        self.masked = masked or [np.array([], dtype=np.int64), np.array([], dtype=np.int64)]
+
+    def load_model(self, dataset_name, model_name):
+        return None, None, FakeRecboleDataset(), None, None, FakeTestData(self.masked), None
+
+    def get_topk_tokens(self, dataset_name, model_name, k, user_ids=None):
+        self.calls += 1
+        return np.array([["a", "b"], ["b", "c"]])
+
+@pytest.fixture
+def evaluation_service(tmp_path):
+    model_file = tmp_path / "model1.pth"
+    model_file.write_text("weights")
+    return EvaluationService(FakeDatasetManager(str(model_file)), FakeRecommendationService(), str(tmp_path))
+
+def test_ranking_metrics():
+    hits = np.array([[False, True], [False, False]])
+    metrics = ranking_metrics(hits, np.array([1, 1]))
+    assert metrics["recall"].tolist() == [1.0, 0.0]
+    assert metrics["precision"].tolist() == [0.5, 0.0]
+    assert metrics["mrr"].tolist() == [0.5, 0.0]
+    assert metrics["ndcg"][0] == pytest.approx(1 / np.log2(3))
+
+def test_bucket_labels():
+    assert bucket_labels(["25", "40", "x"], ["18-30", "31-50"]) == ["18-30", "31-50", None]
+    assert bucket_labels(["M", "F"], []) == ["M", "F"]
+
+def test_evaluate_last_interaction(evaluation_service):
+    result = evaluation_service.evaluate("ds1", "model1.pth", 2, n=1)
+    assert result["users"] == 2
+    assert result["metrics"]["recall"] == 0.5
+    assert result["metrics"]["hit_rate"] == 0.5
+    assert result["coverage"] == 0.75
+
+def test_evaluate_breakdown(evaluation_service):
+    result = evaluation_service.evaluate("ds1", "model1.pth", 2, n=2, group_by="age", bins=["18-30", "31-50"])
+    groups = result["breakdown"]["groups"]
+    assert groups["18-30"]["recall"] == 0.5
+    assert groups["31-50"]["recall"] == 0.0
+
+def test_evaluate_is_cached_on_disk(evaluation_service, tmp_path):
+    evaluation_service.evaluate("ds1", "model1.pth", 2)
+    evaluation_service.cached = {}
+    evaluation_service.evaluate("ds1", "model1.pth", 2)
+    assert evaluation_service.recommendation_service.calls == 1
+    assert list(tmp_path.glob("ds1_model1_eval_*.json"))
+
+def test_evaluate_unknown_model(evaluation_service):
+    assert evaluation_service.evaluate("ds1", "missing.pth", 2) is None
+
+def test_ground_truth_is_in_timestamp_order_without_masked_items(tmp_path):
+    model_file = tmp_path / "model1.pth"
+    model_file.write_text("weights")
+    interactions = [(0, "a", 5), (0, "c", 1), (1, "b", 3), (1, "d", 2)]
+    # user 2's "b" (recbole id 2) is in its training history, so full_sort_topk never recommends it
+    recommendation_service = FakeRecommendationService([np.array([], dtype=np.int64), np.array([2])])
+    service = EvaluationService(FakeDatasetManager(str(model_file), interactions), recommendation_service)
+    ds_obj = FakeDataset(str(model_file), interactions)
+    masked = service.get_masked_items("ds1", "model1.pth", ["1", "2"])
+    assert masked == [set(), {"b"}]
+    assert service.get_ground_truth(ds_obj, ["1", "2"], 1, masked) == [["a"], []]
+    result = service.evaluate("ds1", "model1.pth", 2, n=1)
+    assert result["users"] == 1
+    assert result["metrics"]["hit_rate"] == 1.0
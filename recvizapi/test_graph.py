@@ -1,7 +1,9 @@
 from pathlib import Path
 import pytest
 import networkx as nx
-from recvizapi.Graph import Graph
+import numpy as np
+import scipy.sparse as sp
+from recvizapi.Graph import Graph, WindowEdges
 
 class FakeDataset:
     def get_user_mapping(self):
@@ -10,11 +12,17 @@ class FakeDataset:
     def get_item_mapping(self):
         return {"a": {"category": "test"}}
 
-    def get_timestamps(self):
-        return [0]
+    def get_user_ids(self):
+        return ["1"]
 
-    def get_interaction_history(self):
-        return {0: [{"user_id": "1", "item_id": "a"}]}
+    def get_item_ids(self):
+        return ["a"]
+
+    def get_interaction_matrix(self):
+        return sp.csr_matrix(np.ones((1, 1), dtype=np.float32))
+
+    def get_user_history(self, user_id):
+        return [{"item_id": "a"}] if user_id == "1" else None
 
 class FakeDatasetManager:
     def get_dataset(self, ds_name):
@@ -63,3 +71,61 @@ def test_layout_coordinates_updated(graph_instance):
         x = graph_instance.nx_graph.nodes[node]["x"]
         y = graph_instance.nx_graph.nodes[node]["y"]
         assert (x, y) == (0.5, 0.5)
+
+def test_window_edges_slide_matches_rebuild():
+    rng = np.random.default_rng(0)
+    distinct_pairs, pair_ids = np.unique(rng.integers(0, 30, 500), return_inverse=True)
+    arrays = {"pair_ids": pair_ids, "distinct_pairs": distinct_pairs}
+    edges = WindowEdges.from_arrays(arrays, None, 0, 100)
+    for lo, hi in [(50, 150), (60, 120), (0, 400), (390, 500), (10, 20), (10, 20), (0, 0)]:
+        edges = edges.slide(arrays, None, lo, hi)
+        expected = WindowEdges.from_arrays(arrays, None, lo, hi)
+        assert edges.counts.tolist() == expected.counts.tolist()
+        assert edges.edges()[0].tolist() == np.unique(distinct_pairs[pair_ids[lo:hi]]).tolist()
+
+class WindowDataset(FakeDataset):
+    def get_user_ids(self):
+        return ["1"]
+
+    def get_item_ids(self):
+        return ["a"]
+
+def test_window_graph_uses_edge_table(cache_dir, monkeypatch):
+    monkeypatch.setattr(FakeDatasetManager, "get_dataset", lambda self, ds_name: {"dataset_obj": WindowDataset()})
+    empty = Graph("ds1", {}, cache_dir, "w0", FakeDatasetManager(), build=False,
+                  window_edges=WindowEdges(None, 0, 0, np.array([0], dtype=np.int32), np.array([0])))
+    empty.run_stages(layout=False)
+    assert empty.nx_graph.number_of_nodes() == 2
+    assert empty.nx_graph.number_of_edges() == 0
+    graph = Graph("ds1", {}, cache_dir, "w1", FakeDatasetManager(), build=False,
+                  window_edges=WindowEdges(None, 0, 3, np.array([3], dtype=np.int32), np.array([0])))
+    graph.run_stages(layout=False)
+    assert graph.nx_graph["user-1"]["item-a"]["weight"] == 3
+
+def test_seeded_layout_keeps_known_positions(cache_dir, monkeypatch):
+    calls = []
+    monkeypatch.setattr(nx, "forceatlas2_layout", lambda g, pos, gravity, max_iter: calls.append(max_iter) or pos)
+    graph = Graph("ds1", {}, cache_dir, "seeded", FakeDatasetManager(), build=False, seed_positions={"user-1": (5.0, 7.0)})
+    graph.run_stages()
+    positions = graph.get_positions()
+    assert positions["user-1"] == (5.0, 7.0)
+    assert positions["item-a"] != (5.0, 7.0)
+    assert calls == [100]
+
+def test_gexf_carries_history_string_without_keeping_it(cache_dir, monkeypatch):
+    user_mapping = {"1": {"age": "30"}}
+    monkeypatch.setattr(FakeDataset, "get_user_mapping", lambda self: user_mapping)
+    graph_obj = Graph("ds1", {}, cache_dir, "historygraph", FakeDatasetManager())
+    assert "[{'item_id': 'a'}]" in Path(graph_obj.get_gexf_path()).read_text()
+    assert "interaction_history_str" not in graph_obj.nx_graph.nodes["user-1"]
+    assert "interaction_history_str" not in user_mapping["1"]
+
+def test_node_attributes_leave_mappings_untouched(cache_dir, monkeypatch):
+    user_mapping = {"1": {"age": "30"}}
+    item_mapping = {"a": {"category": "test"}}
+    monkeypatch.setattr(FakeDataset, "get_user_mapping", lambda self: user_mapping)
+    monkeypatch.setattr(FakeDataset, "get_item_mapping", lambda self: item_mapping)
+    graph_obj = Graph("ds1", {"age": ["25-35"], "category": ["test"]}, cache_dir, "filtered", FakeDatasetManager())
+    assert graph_obj.nx_graph.nodes["user-1"]["filter_query"] == "25-35"
+    assert user_mapping == {"1": {"age": "30"}}
+    assert item_mapping == {"a": {"category": "test"}}
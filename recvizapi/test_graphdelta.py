@@ -0,0 +1,44 @@
+import networkx as nx
+import pytest
+from recvizapi.GraphDelta import read_graph_tables, graph_delta
+
+def write_graph(path, nodes, edges):
+    graph = nx.Graph()
+    for node, attributes in nodes.items():
+        graph.add_node(node, label=node.title(), **attributes)
+    graph.add_weighted_edges_from(edges)
+    nx.write_gexf(graph, str(path))
+    return str(path)
+
+@pytest.fixture
+def base(tmp_path):
+    return read_graph_tables(write_graph(tmp_path / "base.gexf", {
+        "user-1": {"x": 0.0, "y": 0.0, "age": "20"},
+        "user-2": {"x": 100.0, "y": 0.0, "age": "30"},
+        "item-1": {"x": 50.0, "y": 50.0, "size": 2},
+    }, [("user-1", "item-1", 1), ("item-1", "user-2", 2)]))
+
+def test_read_graph_tables(base):
+    nodes, edges = base
+    assert nodes["item-1"] == {"label": "Item-1", "x": 50.0, "y": 50.0, "size": 2}
+    assert edges == {("item-1", "user-1"): 1.0, ("item-1", "user-2"): 2.0}
+
+def test_identical_graphs_have_empty_delta(base):
+    delta = graph_delta(base, base)
+    assert all(not value for part in delta.values() for value in part.values())
+
+def test_delta_by_set_difference(base, tmp_path):
+    target = read_graph_tables(write_graph(tmp_path / "target.gexf", {
+        "user-1": {"x": 0.1, "y": 0.0, "age": "21"},
+        "item-1": {"x": 50.0, "y": 80.0, "size": 2},
+        "item-2": {"x": 10.0, "y": 10.0, "size": 1},
+    }, [("user-1", "item-1", 3), ("user-1", "item-2", 1)]))
+    delta = graph_delta(base, target)
+    assert delta["nodes"]["added"] == [{"id": "item-2", "label": "Item-2", "x": 10.0, "y": 10.0, "size": 1}]
+    assert delta["nodes"]["removed"] == ["user-2"]
+    # user-1 moved by less than the tolerance of the base layout's extent.
+    assert delta["nodes"]["moved"] == {"item-1": [50.0, 80.0]}
+    assert delta["nodes"]["changed"] == {"user-1": {"age": "21"}}
+    assert delta["edges"]["added"] == [["item-2", "user-1", 1.0]]
+    assert delta["edges"]["removed"] == [["item-1", "user-2"]]
+    assert delta["edges"]["changed"] == [["item-1", "user-1", 3.0]]
@@ -0,0 +1,89 @@
+import networkx as nx
+import pytest
+from scipy.optimize import linear_sum_assignment
+from recvizapi.GraphEditDistance import (assignment_upper_bound, bounded_graph_edit_distance,
+                                         label_lower_bound, mapping_cost)
+
+def labelled_graph(edges, labels):
+    g = nx.Graph()
+    for node, label in labels.items():
+        g.add_node(node, label=label)
+    g.add_edges_from(edges)
+    return g
+
+def user_graph(uid, items):
+    g = nx.Graph()
+    g.add_node(f"user_{uid}", label="user")
+    for item in items:
+        g.add_edge(f"user_{uid}", item)
+    return g
+
+def exact_ged(g1, g2):
+    return nx.graph_edit_distance(g1, g2, node_subst_cost=lambda a, b: 0 if a["label"] == b["label"] else 1)
+
+@pytest.fixture
+def small_graphs():
+    g1 = labelled_graph([(1, 2), (2, 3), (3, 1), (3, 4)], {1: "a", 2: "a", 3: "b", 4: "b"})
+    g2 = labelled_graph([(1, 2), (2, 3)], {1: "a", 2: "b", 3: "b"})
+    return g1, g2
+
+def test_bounds_bracket_exact_distance(small_graphs):
+    g1, g2 = small_graphs
+    exact = exact_ged(g1, g2)
+    assert label_lower_bound(g1, g2) <= exact <= assignment_upper_bound(g1, g2)[0]
+
+def test_mapping_cost_of_identity_is_zero(small_graphs):
+    g1, _ = small_graphs
+    assert mapping_cost(g1, g1, {node: node for node in g1.nodes}) == 0
+    assert mapping_cost(g1, g1, {}) == 2 * (g1.number_of_nodes() + g1.number_of_edges())
+
+def test_refinement_reaches_exact_distance(small_graphs):
+    g1, g2 = small_graphs
+    result = bounded_graph_edit_distance(g1, g2, time_budget=5)
+    assert result["exact"]
+    assert result["estimate"] == result["lower_bound"] == result["upper_bound"] == exact_ged(g1, g2)
+
+def test_zero_budget_still_returns_bounds(small_graphs):
+    g1, g2 = small_graphs
+    result = bounded_graph_edit_distance(g1, g2, time_budget=0)
+    assert result["lower_bound"] <= exact_ged(g1, g2) <= result["upper_bound"]
+
+def test_large_graphs_skip_refinement(monkeypatch):
+    g1 = nx.gnm_random_graph(6, 8, seed=0)
+    g2 = nx.gnm_random_graph(6, 8, seed=100)
+    for g in (g1, g2):
+        nx.set_node_attributes(g, "x", "label")
+    monkeypatch.setattr("recvizapi.GraphEditDistance.refinement_max_nodes", 5)
+    monkeypatch.setattr("recvizapi.GraphEditDistance.nx.optimize_edit_paths", lambda *args, **kwargs: pytest.fail("searched"))
+    result = bounded_graph_edit_distance(g1, g2, time_budget=5)
+    assert not result["exact"]
+    assert result["lower_bound"] <= exact_ged(g1, g2) <= result["upper_bound"]
+
+def test_user_graphs_are_solved_by_bounds():
+    g1 = user_graph(1, [f"item {idx}" for idx in range(200)])
+    g2 = user_graph(2, [f"item {idx}" for idx in range(150, 400)])
+    result = bounded_graph_edit_distance(g1, g2, time_budget=0)
+    assert result["exact"]
+    # 200 unmatched items are inserted or substituted, and 50 more edges are needed.
+    assert result["estimate"] == 250
+
+def test_sides_are_assigned_separately(monkeypatch):
+    graphs = []
+    for uid, items in [(1, range(200)), (2, range(150, 400))]:
+        g = user_graph(uid, [f"item {idx}" for idx in items])
+        nx.set_node_attributes(g, "item", "type")
+        g.nodes[f"user_{uid}"]["type"] = "user"
+        graphs.append(g)
+    shapes = []
+    monkeypatch.setattr("recvizapi.GraphEditDistance.linear_sum_assignment",
+                        lambda cost: shapes.append(cost.shape) or linear_sum_assignment(cost))
+    cost, mapping = assignment_upper_bound(*graphs)
+    assert sorted(shapes) == [(2, 2), (450, 450)]
+    assert mapping["user_1"] == "user_2"
+    assert cost == 250
+
+def test_unlabelled_nodes_use_their_key():
+    g1 = nx.Graph([("x", "y")])
+    g2 = nx.Graph([("x", "z")])
+    result = bounded_graph_edit_distance(g1, g2)
+    assert result["estimate"] == 1
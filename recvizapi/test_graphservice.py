@@ -1,5 +1,12 @@
+import os
+import networkx as nx
+import numpy as np
 import pytest
-from recvizapi.GraphService import GraphService, compute_graph_key
+import scipy.sparse as sp
+from concurrent.futures import Future
+from recvizapi.GraphService import (GraphService, compute_graph_key, seeded_graph_key, louvain_columnar,
+                                    refresh_worker_service, build_window_gexf_in_worker)
+from recvizapi.Workers import PoolBusy
 
 class FakeDatasetManager:
     def get_dataset(self, ds_name):
@@ -13,6 +20,22 @@ class FakeGraph:
         self.graph_key = graph_key
         self.dataset_manager = dataset_manager
 
+class FakeWindowDataset:
+    inter_offsets = {}
+    arrays = {"timestamps": np.array([100, 200, 300, 400]), "pair_ids": np.array([0, 1, 0, 2]),
+              "distinct_pairs": np.array([10, 11, 12])}
+    def get_interaction_arrays(self):
+        return self.arrays
+    def get_window_bounds(self, start, end):
+        return tuple(np.searchsorted(self.arrays["timestamps"], [start, end]).tolist())
+    def ingest_appended(self, offsets):
+        return {"appended": 0}
+
+class FakeWindowDatasetManager:
+    dataset = FakeWindowDataset()
+    def get_dataset(self, ds_name):
+        return {"dataset_obj": self.dataset}
+
 @pytest.fixture
 def fake_dataset_manager():
     return FakeDatasetManager()
@@ -57,3 +80,208 @@ def test_compute_graph_key_with_filters():
 def test_compute_graph_key_without_filters():
     key = compute_graph_key("ds1", None)
     assert key == "ds1"
+
+def test_get_simrank_runs_in_background_and_caches(tmp_path, fake_dataset_manager, monkeypatch):
+    monkeypatch.setattr("recvizapi.GraphService.Graph", FakeStagedGraph)
+    monkeypatch.setattr(FakeStagedGraph, "built", [])
+    graph = nx.Graph([("user-1", "item-1"), ("user-2", "item-1")])
+    service = GraphService(str(tmp_path), fake_dataset_manager)
+    assert service.get_simrank("ds1") is None
+    service.simrank_jobs["ds1"].result()
+    index = service.get_simrank("ds1")
+    assert index.similarity("user-1", "user-2") == pytest.approx(nx.simrank_similarity(graph, "user-1", "user-2"))
+    assert (tmp_path / "ds1_simrank.npz").exists()
+    # SimRank needs the edges only, so no layout is computed for it.
+    assert FakeStagedGraph.built == [("ds1", False, True)]
+    assert GraphService(str(tmp_path), fake_dataset_manager).get_simrank("ds1") is not None
+
+class FakeJobPool:
+    def __init__(self, exception=None):
+        self.exception = exception
+        self.submitted = []
+
+    def submit(self, function, *args):
+        self.submitted.append((function.__name__, args))
+        future = Future()
+        future.set_exception(self.exception)
+        return future
+
+def test_get_simrank_reports_a_failed_job_once(tmp_path, fake_dataset_manager):
+    pool = FakeJobPool(PoolBusy("busy"))
+    service = GraphService(str(tmp_path), fake_dataset_manager, pool)
+    assert service.get_simrank("ds1") is None
+    assert pool.submitted == [("build_simrank_in_worker", ("ds1", None, "ds1"))]
+    with pytest.raises(PoolBusy):
+        service.get_simrank("ds1")
+    assert service.get_simrank("ds1") is None
+    assert len(pool.submitted) == 2
+
+def test_louvain_columnar():
+    table = louvain_columnar({"user-1": 0, "user-2": 1, "user-3": 0})
+    assert table["users"] == ["1", "2", "3"]
+    assert table["communities"] == [0, 1, 0]
+
+class FakeSourceDataset:
+    def __init__(self, mtime):
+        self.mtime = mtime
+
+    def get_source_mtime(self):
+        return self.mtime
+
+    def get_interaction_matrix(self):
+        return sp.csr_matrix(np.array([[1], [1]], dtype=np.float32))
+
+    def get_item_ids(self):
+        return ["1"]
+
+class FakeStagedGraph:
+    built = []
+
+    def __init__(self, dataset_name, filters, cache_dir, graph_key, dataset_manager, build=True, window_edges=None,
+                 seed_positions=None):
+        self.cache_dir = cache_dir
+        self.graph_key = graph_key
+        self.seed_positions = seed_positions
+        self.nx_graph = nx.Graph([("user-1", "item-1"), ("user-2", "item-1")])
+
+    def run_stages(self, layout=True, write=True):
+        FakeStagedGraph.built.append((self.graph_key, layout, write))
+        if layout and write:
+            nx.write_gexf(self.nx_graph, f"{self.cache_dir}/{self.graph_key}.gexf")
+
+    def get_louvain_parts(self):
+        return {"user-1": 0, "user-2": 0}
+
+    def get_gexf_path(self):
+        return f"{self.cache_dir}/{self.graph_key}.gexf"
+
+def test_louvain_is_persisted_without_layout(tmp_path, fake_dataset_manager, monkeypatch):
+    monkeypatch.setattr("recvizapi.GraphService.Graph", FakeStagedGraph)
+    monkeypatch.setattr(FakeStagedGraph, "built", [])
+    service = GraphService(str(tmp_path), fake_dataset_manager)
+    assert service.get_louvain("ds1", {"age": ["30"]}) == {"user-1": 0, "user-2": 0}
+    assert FakeStagedGraph.built == [("ds1_age:30", False, True)]
+    assert GraphService(str(tmp_path), fake_dataset_manager).cached["ds1_age:30_louvain"] == {"user-1": 0, "user-2": 0}
+
+def test_warm_skips_up_to_date_entries(tmp_path, monkeypatch):
+    monkeypatch.setattr("recvizapi.GraphService.Graph", FakeStagedGraph)
+    monkeypatch.setattr(FakeStagedGraph, "built", [])
+    dataset = FakeSourceDataset(0)
+    manager = FakeDatasetManager()
+    monkeypatch.setattr(manager, "get_dataset", lambda ds_name: {"dataset_obj": dataset})
+    service = GraphService(str(tmp_path), manager)
+    report = service.warm("ds1")
+    assert report["built"] == ["gexf", "louvain", "stats"]
+    assert report["nodes"] == 3
+    assert service.cached["ds1_stats"]["edges"] == 2
+    assert service.warm("ds1")["built"] == []
+    # Dataset files edited after the cache was written make every artifact stale again.
+    dataset.mtime = (tmp_path / "ds1_stats.json").stat().st_mtime + 1
+    assert service.warm("ds1")["built"] == ["gexf", "louvain", "stats"]
+    dataset.mtime = 0
+    assert service.warm("ds1", force=True)["built"] == ["gexf", "louvain", "stats"]
+    assert len(FakeStagedGraph.built) == 3
+
+def test_compute_graph_key_with_empty_filters():
+    assert compute_graph_key("ds1", {}) == "ds1"
+
+def test_compute_graph_key_with_window():
+    assert compute_graph_key("ds1", {"age": ["30"]}, (874724710.0, None)) == "ds1_age:30_t:874724710.."
+    assert compute_graph_key("ds1", None, (None, 1.5)) == "ds1_t:..1.5"
+
+def test_invalidate_dataset_drops_only_its_graphs(tmp_path, monkeypatch):
+    manager = FakeDatasetManager()
+    monkeypatch.setattr(manager, "get_available_datasets", lambda: ["ds1", "ds1_small"], raising=False)
+    for name in ["ds1.gexf", "ds1_age:30.gexf", "ds1_louvain.json", "ds1_stats.json", "ds1_simrank.npz", "ds1_small.gexf"]:
+        (tmp_path / name).write_text("{}")
+    service = GraphService(str(tmp_path), manager)
+    service.window_edges["ds1"] = object()
+    service.invalidate_dataset("ds1", {"delta": None})
+    assert sorted(service.cached) == ["ds1_small"]
+    assert sorted(os.listdir(tmp_path)) == ["ds1_small.gexf"]
+    assert "ds1" not in service.window_edges
+
+def test_graph_delta_between_cached_graphs(tmp_path, fake_dataset_manager):
+    nx.write_gexf(nx.Graph([("user-1", "item-1"), ("user-2", "item-1")]), str(tmp_path / "ds1.gexf"))
+    nx.write_gexf(nx.Graph([("user-1", "item-1")]), str(tmp_path / "ds1_age:30.gexf"))
+    (tmp_path / "ds1_louvain.json").write_text("{}")
+    service = GraphService(str(tmp_path), fake_dataset_manager)
+    assert service.find_gexf_path("ds1_louvain") is None
+    delta = service.get_graph_delta(service.find_gexf_path("ds1"), service.find_gexf_path("ds1_age:30"))
+    assert delta["nodes"]["removed"] == ["user-2"]
+    assert delta["edges"]["removed"] == [["item-1", "user-2"]]
+    assert list(service.graph_tables) == [str(tmp_path / "ds1.gexf"), str(tmp_path / "ds1_age:30.gexf")]
+
+def test_graph_stats_match_the_filtered_graph(tmp_path, monkeypatch):
+    from recvizapi.Dataset import Dataset
+    from recvizapi.Graph import Graph
+    (tmp_path / "ds.user").write_text("user_id:token\tage:token\n1\t30\n2\t40\n3\t30\n", encoding='utf-8')
+    (tmp_path / "ds.item").write_text("item_id:token\tyear:token\na\t1990\nb\t1995\nc\t2000\n", encoding='utf-8')
+    (tmp_path / "ds.inter").write_text("user_id:token\titem_id:token\ttimestamp:float\n"
+                                       "1\ta\t1\n1\ta\t2\n1\tb\t3\n2\tc\t4\n3\tc\t5\n", encoding='utf-8')
+    dataset = Dataset(str(tmp_path), ["ds.inter"], ["ds.user"], ["ds.item"], "ds", [])
+    manager = FakeDatasetManager()
+    monkeypatch.setattr(manager, "get_dataset", lambda ds_name: {"dataset_obj": dataset})
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+    service = GraphService(str(cache_dir), manager)
+    for filters in [None, {"age": ["30"]}, {"age": ["30"], "year": ["1990-1995"]}]:
+        stats = service.build_graph_stats("ds", filters)
+        graph = Graph("ds", filters, str(cache_dir), "check", manager, build=False)
+        graph.run_stages(layout=False)
+        users = [node for node in graph.nx_graph if node.startswith("user-")]
+        assert (stats["users"], stats["items"]) == (len(users), graph.nx_graph.number_of_nodes() - len(users))
+        assert stats["edges"] == graph.nx_graph.number_of_edges()
+        assert stats["interactions"] == graph.nx_graph.size(weight="weight")
+        assert stats["components"]["count"] == nx.number_connected_components(graph.nx_graph)
+    assert GraphService(str(cache_dir), manager).get_cached_graph_stats("ds", {"age": ["30"]})["edges"] == 3
+
+def test_window_artifacts_are_bounded_and_not_reloaded(tmp_path, fake_dataset_manager, monkeypatch):
+    monkeypatch.setattr("recvizapi.GraphService.transient_cache_size", 2)
+    for name in ["ds1_t:1..2.gexf", "ds1_t:1..2_louvain.json", "ds1_age:30_t:..5_stats.json"]:
+        (tmp_path / name).write_text("{}")
+    (tmp_path / "ds1_louvain.json").write_text("{}")
+    service = GraphService(str(tmp_path), fake_dataset_manager)
+    assert list(service.cached) == ["ds1_louvain"]
+    assert sorted(os.listdir(tmp_path)) == ["ds1_louvain.json"]
+    for start in [1.0, 2.0, 3.0]:
+        gexf_path = tmp_path / (compute_graph_key("ds1", None, (start, None)) + ".gexf")
+        gexf_path.write_text("<gexf/>")
+        service.store("ds1", None, str(gexf_path), window=(start, None))
+    assert service.get_gexf_path("ds1", None, (1.0, None)) is None
+    assert not (tmp_path / "ds1_t:1...gexf").exists()
+    assert service.get_gexf_path("ds1", None, (3.0, None)) == str(tmp_path / "ds1_t:3...gexf")
+    service.store("ds1", None, {"user-1": 0}, "_louvain", (3.0, None))
+    assert service.get_cached_louvain("ds1", None, (3.0, None)) == {"user-1": 0}
+    assert "ds1_t:3.._louvain" not in service.cached
+
+def test_seeded_layout_is_kept_apart_from_the_full_layout(tmp_path, fake_dataset_manager, monkeypatch):
+    monkeypatch.setattr("recvizapi.GraphService.Graph", FakeStagedGraph)
+    monkeypatch.setattr(FakeStagedGraph, "built", [])
+    base = nx.Graph()
+    base.add_node("user-1", x=1.0, y=2.0)
+    nx.write_gexf(base, str(tmp_path / "ds1.gexf"))
+    service = GraphService(str(tmp_path), fake_dataset_manager)
+    graph_key = seeded_graph_key("ds1_age:30", "ds1")
+    assert graph_key.startswith("ds1_age:30_from:")
+    gexf_path = service.build_gexf("ds1", {"age": ["30"]}, str(tmp_path / "ds1.gexf"), graph_key)
+    assert gexf_path == str(tmp_path / (graph_key + ".gexf"))
+    service.store_transient(graph_key, gexf_path)
+    assert service.find_gexf_path(graph_key) == gexf_path
+    assert service.get_gexf_path("ds1", {"age": ["30"]}) is None
+    # Seeded layouts are not reused after a restart.
+    assert GraphService(str(tmp_path), fake_dataset_manager).find_gexf_path(graph_key) is None
+    assert not os.path.exists(gexf_path)
+
+def test_window_jobs_continue_from_the_fork_servers_counts(tmp_path, monkeypatch):
+    service = GraphService(str(tmp_path), FakeWindowDatasetManager())
+    monkeypatch.setattr("recvizapi.GraphService._worker_service", service)
+    refresh_worker_service({"offsets": {"ds1": {}}, "windows": {"ds1": (100, 300)}})
+    counted = service.window_edges["ds1"]
+    assert counted.counts.tolist() == [1, 1, 0]
+    # The job forked after the refresh reuses the server's counts instead of counting again.
+    monkeypatch.setattr("recvizapi.GraphService.WindowEdges.from_arrays", lambda *args: pytest.fail("counted"))
+    monkeypatch.setattr(service, "build_window_gexf", lambda dataset_name, filters, window_edges, seed: window_edges)
+    assert build_window_gexf_in_worker("ds1", None, (100, 300), None) is counted
+    refresh_worker_service({"offsets": {}, "windows": {"ds1": (200, 500)}})
+    assert service.window_edges["ds1"].counts.tolist() == [1, 1, 1]
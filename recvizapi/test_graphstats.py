@@ -0,0 +1,31 @@
+import numpy as np
+import scipy.sparse as sp
+from recvizapi.GraphStats import graph_statistics, log_histogram, distribution
+
+def test_log_histogram_bins():
+    histogram = log_histogram(np.array([0, 1, 1, 3, 4, 9]))
+    assert histogram["bins"] == [0, 1, 2, 4, 8, 16]
+    assert histogram["counts"] == [1, 2, 1, 1, 1]
+    assert log_histogram(np.array([])) == {"bins": [0, 1], "counts": [0]}
+
+def test_distribution():
+    assert distribution(np.array([2, 1, 2])) == {"values": [1, 2], "counts": [1, 2]}
+
+def test_graph_statistics():
+    # Users 0 and 1 share item a, user 2 only has c and item d has no interactions.
+    counts = sp.csr_matrix(np.array([[2, 1, 0, 0], [1, 0, 0, 0], [0, 0, 5, 0]], dtype=np.float32))
+    stats = graph_statistics(counts, ["a", "b", "c", "d"])
+    assert (stats["users"], stats["items"], stats["edges"], stats["interactions"]) == (3, 4, 4, 9)
+    assert stats["density"] == 4 / 12
+    assert stats["user_degree"]["distribution"] == {"values": [1, 2], "counts": [2, 1]}
+    assert stats["item_degree"]["max"] == 2
+    assert stats["user_activity"]["histogram"]["counts"] == [0, 1, 1, 1]
+    assert stats["item_popularity"]["top"][:2] == [["c", 5, 1], ["a", 3, 2]]
+    assert stats["components"]["largest"] == [4, 2, 1]
+    assert stats["components"]["isolated"] == 1
+    assert stats["components"]["largest_share"] == 4 / 7
+
+def test_graph_statistics_without_users():
+    stats = graph_statistics(sp.csr_matrix((0, 2), dtype=np.float32), ["a", "b"])
+    assert (stats["edges"], stats["density"]) == (0, 0.0)
+    assert stats["components"]["count"] == 2
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+from recvizapi.Dataset import Dataset
+from recvizapi.Ingest import Ingestor
+
+class FakeDatasetManager:
+    def __init__(self, ds_obj):
+        self.ds_obj = ds_obj
+
+    def get_dataset(self, ds_name):
+        return {"dataset_obj": self.ds_obj}
+
+    def get_available_datasets(self):
+        return ["ds"]
+
+class RecordingService:
+    def __init__(self):
+        self.calls = []
+
+    def invalidate_dataset(self, dataset_name, appended):
+        self.calls.append((dataset_name, appended["appended"], appended["users"].tolist()))
+
+@pytest.fixture
+def ingestor(tmp_path):
+    (tmp_path / "ds.user").write_text("user_id:token\n1\n2\n", encoding='utf-8')
+    (tmp_path / "ds.item").write_text("item_id:token\na\nb\n", encoding='utf-8')
+    (tmp_path / "ds.inter").write_text("user_id:token\titem_id:token\ttimestamp:float\n1\ta\t100\n", encoding='utf-8')
+    ds_obj = Dataset(str(tmp_path), ["ds.inter"], ["ds.user"], ["ds.item"], "ds", [])
+    return Ingestor(FakeDatasetManager(ds_obj), [RecordingService()])
+
+def test_append_writes_and_invalidates(ingestor):
+    report = ingestor.append("ds", [{"user_id": "2", "item_id": "b", "timestamp": "200"},
+                                    {"user_id": "3", "item_id": "b", "timestamp": "200"}])
+    assert report["written"] == 1
+    assert report["appended"] == 1
+    assert report["skipped"] == 1
+    assert ingestor.services[0].calls == [("ds", 1, [1])]
+    user_mapping = ingestor.dataset_manager.ds_obj.get_user_mapping()
+    assert user_mapping["2"]["user_history_length"] == 1
+
+def test_nothing_appended_invalidates_nothing(ingestor):
+    assert ingestor.ingest_all()[0]["appended"] == 0
+    assert ingestor.services[0].calls == []
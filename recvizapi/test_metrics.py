@@ -0,0 +1,96 @@
+import asyncio
+import pytest
+from recvizapi import Metrics
+from recvizapi.Workers import WorkPool
+
+@pytest.fixture(autouse=True)
+def clean_metrics():
+    Metrics.reset_state()
+    Metrics.request_timings.set(None)
+    yield
+    Metrics.reset_state()
+    Metrics.request_timings.set(None)
+
+def timed_stage(name):
+    with Metrics.timed(name):
+        pass
+    return name
+
+class FakeResolverMatch:
+    url_name = "get_louvain"
+
+class FakeRequest:
+    resolver_match = FakeResolverMatch()
+
+class FakeResponse(dict):
+    status_code = 200
+
+def test_timed_records_histogram_and_request_timings():
+    timings = []
+    Metrics.request_timings.set(timings)
+    Metrics.observe("louvain", 0.02)
+    timed_stage("graph_layout")
+    assert [stage for stage, _ in timings] == ["louvain", "graph_layout"]
+    text = Metrics.render_prometheus()
+    assert 'recviz_stage_seconds_bucket{stage="louvain",le="0.01"} 0' in text
+    assert 'recviz_stage_seconds_bucket{stage="louvain",le="0.025"} 1' in text
+    assert 'recviz_stage_seconds_count{stage="graph_layout"} 1' in text
+
+def test_cache_counters_and_gauges(monkeypatch):
+    monkeypatch.setattr(Metrics, "_gauge_callbacks", {})
+    Metrics.count_cache("graph", True)
+    Metrics.count_cache("graph", True)
+    Metrics.count_cache("graph", False)
+    Metrics.register_gauge("recviz_cache_entries", lambda: {(("cache", "model"),): 3}, "Entries.")
+    text = Metrics.render_prometheus()
+    assert 'recviz_cache_requests_total{cache="graph",result="hit"} 2' in text
+    assert 'recviz_cache_requests_total{cache="graph",result="miss"} 1' in text
+    assert 'recviz_cache_entries{cache="model"} 3' in text
+    assert "recviz_process_resident_bytes " in text
+
+def test_merge_state_adds_worker_metrics():
+    # As in a forked worker: the state starts empty and collects the child's own timings.
+    Metrics.reset_state()
+    Metrics.observe("louvain", 0.5)
+    state = Metrics.export_state()
+    Metrics.reset_state()
+    Metrics.observe("louvain", 0.5)
+    timings = []
+    Metrics.request_timings.set(timings)
+    Metrics.merge_state(state)
+    assert 'recviz_stage_seconds_count{stage="louvain"} 2' in Metrics.render_prometheus()
+    assert timings == [("louvain", 0.5)]
+
+def test_server_timing_header_sums_repeated_stages():
+    header = Metrics.server_timing_header([("model_inference", 0.01), ("model_inference", 0.02), ("serialize", 0.001)], 0.05)
+    assert header == "model_inference;dur=30.0, serialize;dur=1.0, total;dur=50.0"
+
+def test_middleware_collects_stages_from_pool_jobs():
+    pool = WorkPool("test", 1)
+
+    async def view(request):
+        await pool.run(timed_stage, "model_inference")
+        Metrics.observe("serialize", 0.001)
+        return FakeResponse()
+
+    middleware = Metrics.ServerTimingMiddleware(view)
+    response = asyncio.run(middleware(FakeRequest()))
+    assert response["Server-Timing"].startswith("test_queue_wait;dur=")
+    assert "model_inference;dur=" in response["Server-Timing"]
+    assert "serialize;dur=1.0" in response["Server-Timing"]
+    text = Metrics.render_prometheus()
+    assert 'recviz_requests_total{route="get_louvain",status="200"} 1' in text
+    assert 'recviz_request_seconds_count{route="get_louvain"} 1' in text
+
+def test_process_pool_merges_child_metrics():
+    pool = WorkPool("test", 1, use_processes=True)
+
+    async def scenario():
+        timings = []
+        Metrics.request_timings.set(timings)
+        await pool.run(timed_stage, "graph_layout")
+        return timings
+
+    timings = asyncio.run(scenario())
+    assert [stage for stage, _ in timings] == ["test_queue_wait", "graph_layout"]
+    assert 'recviz_stage_seconds_count{stage="graph_layout"} 1' in Metrics.render_prometheus()
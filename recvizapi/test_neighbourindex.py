@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+import scipy.sparse as sp
+from recvizapi.NeighbourIndex import NeighbourIndex, minhash_signatures
+
+@pytest.fixture
+def counts():
+    rng = np.random.default_rng(0)
+    dense = (rng.random((60, 40)) < 0.15).astype(np.float32)
+    dense[1] = dense[0]
+    dense[2] = 0
+    return sp.csr_matrix(dense)
+
+def exact_jaccard(counts, row):
+    binary = (counts.toarray() > 0).astype(float)
+    intersection = binary @ binary[row]
+    union = binary.sum(axis=1) + binary[row].sum() - intersection
+    return np.divide(intersection, union, out=np.zeros_like(union), where=union != 0)
+
+def test_minhash_signature_equal_for_identical_rows(counts):
+    signatures = minhash_signatures(counts, 16)
+    assert signatures[0].tolist() == signatures[1].tolist()
+    assert np.all(signatures[2] == (1 << 31) - 1)
+
+def test_minhash_signature_block_boundaries(counts, monkeypatch):
+    expected = minhash_signatures(counts, 8)
+    monkeypatch.setattr("recvizapi.NeighbourIndex.minhash_block_nnz", 5)
+    assert minhash_signatures(counts, 8).tolist() == expected.tolist()
+
+def test_query_jaccard_finds_identical_user(counts):
+    index = NeighbourIndex().build(counts)
+    rows, scores = index.query_jaccard(0, 1)
+    assert rows.tolist() == [1]
+    assert scores.tolist() == [1.0]
+
+def test_query_jaccard_scores_are_exact(counts):
+    index = NeighbourIndex().build(counts)
+    rows, scores = index.query_jaccard(5, 10)
+    assert 5 not in rows
+    assert scores == pytest.approx(exact_jaccard(counts, 5)[rows])
+    assert np.all(np.diff(scores) <= 0)
+
+def test_query_cosine_matches_brute_force(counts):
+    index = NeighbourIndex().build(counts)
+    rows, scores = index.query_cosine(5, 5)
+    dense = counts.toarray()
+    norms = np.linalg.norm(dense, axis=1)
+    expected = dense @ dense[5] / np.where(norms == 0, 1, norms) / norms[5]
+    expected[5] = -1
+    assert sorted(scores.tolist(), reverse=True) == pytest.approx(sorted(expected, reverse=True)[:5])
+
+def test_save_and_load(counts, tmp_path):
+    index_path = str(tmp_path / "ds1_neighbours")
+    NeighbourIndex(index_path).build(counts).save()
+    loaded = NeighbourIndex(index_path)
+    assert loaded.load((60, 40, counts.nnz))
+    assert loaded.query_jaccard(0, 1)[0].tolist() == [1]
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["ds1_neighbours_binary.npz", "ds1_neighbours_lsh.npz",
+                                                                "ds1_neighbours_normalized.npz"]
+
+def test_failed_save_keeps_previous_index(counts, tmp_path, monkeypatch):
+    index_path = str(tmp_path / "ds1_neighbours")
+    NeighbourIndex(index_path).build(counts).save()
+
+    def failing_savez(file, **arrays):
+        file.write(b"partial")
+        raise OSError("disk full")
+
+    monkeypatch.setattr("recvizapi.NeighbourIndex.np.savez", failing_savez)
+    with pytest.raises(OSError):
+        NeighbourIndex(index_path).build(counts).save()
+    assert NeighbourIndex(index_path).load((60, 40, counts.nnz))
+    assert not [path for path in tmp_path.iterdir() if path.name.startswith(".")]
+
+def test_load_rejects_stale_index(counts, tmp_path):
+    index_path = str(tmp_path / "ds1_neighbours")
+    NeighbourIndex(index_path).build(counts).save()
+    assert not NeighbourIndex(index_path).load((60, 40, counts.nnz + 1))
+
+def test_update_matches_rebuild(counts):
+    index = NeighbourIndex().build(counts)
+    dense = counts.toarray()
+    dense[2, [3, 5]] = 1
+    dense[7, 0] += 2
+    grown = sp.csr_matrix(dense)
+    index.update(grown, np.array([2, 7]))
+    rebuilt = NeighbourIndex().build(grown)
+    assert index.query_keys.tolist() == rebuilt.query_keys.tolist()
+    assert index.band_sorted_keys.tolist() == rebuilt.band_sorted_keys.tolist()
+    assert (index.normalized != rebuilt.normalized).nnz == 0
@@ -0,0 +1,90 @@
+import asyncio
+import os
+import pstats
+import pytest
+from django.core.exceptions import MiddlewareNotUsed
+from recvizapi import Profiling
+from recvizapi.Workers import WorkPool
+
+def busy_work(n):
+    return sum(i * i for i in range(n))
+
+class FakeQuery(dict):
+    def get(self, key, default=None):
+        return self[key][-1] if key in self else default
+
+    def lists(self):
+        return list(self.items())
+
+class FakeResolverMatch:
+    url_name = "get_inter_graph"
+
+class FakeRequest:
+    method = "GET"
+    path = "/recvizapi/get_inter_graph/ds1/"
+    resolver_match = FakeResolverMatch()
+
+    def __init__(self, client="10.0.0.1", query=None, headers=None):
+        self.META = {"REMOTE_ADDR": client}
+        self.GET = FakeQuery(query or {})
+        self.headers = headers or {}
+
+class FakeResponse(dict):
+    status_code = 200
+
+@pytest.fixture
+def profiling(tmp_path, monkeypatch):
+    monkeypatch.setattr(Profiling, "profile_clients", {"10.0.0.1"})
+    monkeypatch.setattr(Profiling, "profile_dir", str(tmp_path))
+    return tmp_path
+
+def test_middleware_is_dropped_without_allow_list(monkeypatch):
+    monkeypatch.setattr(Profiling, "profile_clients", set())
+    with pytest.raises(MiddlewareNotUsed):
+        Profiling.ProfilingMiddleware(lambda request: FakeResponse())
+
+def test_profile_stored_with_request_parameters(profiling):
+    def view(request):
+        busy_work(1000)
+        return FakeResponse()
+
+    middleware = Profiling.ProfilingMiddleware(view)
+    response = middleware(FakeRequest(query={"profile": ["1"], "gender": ["M"]}))
+    name = response[Profiling.profile_header]
+    assert (profiling / f"{name}.prof").exists()
+    profiles = Profiling.list_profiles()
+    assert [profile["name"] for profile in profiles] == [name]
+    assert profiles[0]["params"] == {"gender": ["M"]}
+    assert profiles[0]["route"] == "get_inter_graph"
+    metadata, prof_path = Profiling.load_profile(name)
+    assert "busy_work" in metadata["summary"]
+    assert any(function == "busy_work" for _, _, function in pstats.Stats(prof_path).stats)
+
+def test_unlisted_or_unflagged_requests_are_not_profiled(profiling):
+    middleware = Profiling.ProfilingMiddleware(lambda request: FakeResponse())
+    assert Profiling.profile_header not in middleware(FakeRequest(client="10.0.0.2", query={"profile": ["1"]}))
+    assert Profiling.profile_header not in middleware(FakeRequest())
+    assert Profiling.list_profiles() == []
+
+def test_pool_jobs_are_included(profiling):
+    thread_pool = WorkPool("test", 1)
+    process_pool = WorkPool("test", 1, use_processes=True)
+
+    async def view(request):
+        await thread_pool.run(busy_work, 1000)
+        await process_pool.run(busy_work, 2000)
+        return FakeResponse()
+
+    middleware = Profiling.ProfilingMiddleware(view)
+    response = asyncio.run(middleware(FakeRequest(headers={Profiling.profile_header: "1"})))
+    metadata, prof_path = Profiling.load_profile(response[Profiling.profile_header])
+    assert metadata["pool_jobs"] == 2
+    calls = [stats[1] for (_, _, function), stats in pstats.Stats(prof_path).stats.items() if function == "busy_work"]
+    assert sum(calls) == 2
+    assert not [name for name in os.listdir(profiling) if ".part." in name]
+
+def test_old_profiles_are_pruned(profiling, monkeypatch):
+    monkeypatch.setattr(Profiling, "profile_keep", 2)
+    middleware = Profiling.ProfilingMiddleware(lambda request: FakeResponse())
+    names = [middleware(FakeRequest(query={"profile": ["1"]}))[Profiling.profile_header] for _ in range(3)]
+    assert sorted(profile["name"] for profile in Profiling.list_profiles()) == sorted(names)[1:]
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+import scipy.sparse as sp
+from recvizapi.RandomWalkIndex import RandomWalkIndex
+
+@pytest.fixture(autouse=True)
+def small_walks(monkeypatch):
+    monkeypatch.setattr("recvizapi.RandomWalkIndex.panther_min_paths", 5000)
+    monkeypatch.setattr("recvizapi.RandomWalkIndex.random_walk_workers", 1)
+
+@pytest.fixture
+def counts():
+    # Users 0-2 share items 0-2, users 3-4 share items 3-4, user 5 has no history.
+    dense = np.zeros((6, 5), dtype=np.float32)
+    dense[0:3, 0:3] = 1
+    dense[3:5, 3:5] = 1
+    return sp.csr_matrix(dense)
+
+def test_panther_similarity_follows_components(counts):
+    index = RandomWalkIndex().build(counts)
+    assert index.panther_similarity(0, 1) > 0
+    assert index.panther_similarity(0, 3) == 0
+    assert index.panther_similarity(0, 5) == 0
+
+def test_ppr_similarity_follows_components(counts):
+    index = RandomWalkIndex().build(counts)
+    assert index.ppr_similarity(3, 4) > 0
+    assert index.ppr_similarity(3, 0) == 0
+    assert index.ppr_endpoints[5].tolist() == [5] * index.ppr_endpoints.shape[1]
+
+def test_neighbours_exclude_self_and_other_components(counts):
+    index = RandomWalkIndex().build(counts)
+    users, scores = index.panther_neighbours(0, 5)
+    assert sorted(users.tolist()) == [1, 2]
+    assert scores.tolist() == sorted(scores.tolist(), reverse=True)
+    users, _ = index.ppr_neighbours(3, 5)
+    assert users.tolist() == [4]
+    assert index.panther_neighbours(5, 5)[0].tolist() == []
+
+def test_build_with_process_pool(counts, monkeypatch):
+    index = RandomWalkIndex().build(counts)
+    monkeypatch.setattr("recvizapi.RandomWalkIndex.random_walk_workers", 2)
+    pooled = RandomWalkIndex().build(counts)
+    assert pooled.panther_similarity(0, 1) > 0
+    assert pooled.ppr_endpoints.shape == index.ppr_endpoints.shape
+
+def test_save_and_load_round_trip(counts, tmp_path):
+    index = RandomWalkIndex(str(tmp_path / "ds_random_walks")).build(counts)
+    index.save()
+    loaded = RandomWalkIndex(str(tmp_path / "ds_random_walks"))
+    assert loaded.load((6, 5, counts.nnz))
+    assert loaded.panther_similarity(0, 1) == index.panther_similarity(0, 1)
+    assert loaded.ppr_endpoints.tolist() == index.ppr_endpoints.tolist()
+    assert not RandomWalkIndex(str(tmp_path / "ds_random_walks")).load((6, 5, counts.nnz + 1))
+    assert [path.name for path in tmp_path.iterdir()] == ["ds_random_walks.npz"]
+
+def test_ppr_matches_exact_personalized_pagerank(monkeypatch):
+    monkeypatch.setattr("recvizapi.RandomWalkIndex.ppr_walks_per_user", 20000)
+    dense = np.array([[1, 1, 0, 0], [1, 0, 1, 0], [0, 0, 1, 1], [0, 0, 0, 1]], dtype=np.float32)
+    index = RandomWalkIndex().build(sp.csr_matrix(dense))
+    # Exact PPR of the user -> item -> user walk with the same restart probability.
+    to_items = dense / dense.sum(axis=1, keepdims=True)
+    to_users = dense.T / dense.sum(axis=0)[:, None]
+    restart = 0.15
+    exact = restart * np.linalg.inv(np.eye(4) - (1 - restart) * to_items @ to_users)
+    for source in range(4):
+        for target in range(4):
+            assert index.ppr_similarity(source, target) == pytest.approx(exact[source, target], abs=0.015)
@@ -1,28 +1,24 @@
+import numpy as np
 import pytest
-from recvizapi.RecommendationService import RecommendationService
+import torch
+from recvizapi.AnnIndex import AnnIndex
+from recvizapi.RecommendationService import RecommendationService, prepare_cpu_model
 from recvizapi.GraphService import compute_graph_key
 
-class FakeTensor:
-    def __init__(self, value):
-        self.value = value
-    def tolist(self):
-        return self.value
-    def cpu(self):
-        return self.value if isinstance(self.value, list) else [self.value]
-
 class FakeRecboleDataset:
     uid_field = "uid"
     iid_field = "iid"
+    field2id_token = {
+        "uid": np.array(["[PAD]", "1"]),
+        "iid": np.array(["[PAD]", "1", "2"]),
+    }
+    field2token_id = {"uid": {"[PAD]": 0, "1": 1}}
     def token2id(self, field, tokens):
         if field == self.uid_field:
             return [int(token) for token in tokens]
         return tokens
     def id2token(self, field, ids):
-        if field == self.iid_field:
-            return [[str(i) for i in sublist] for sublist in ids]
-        if field == self.uid_field:
-            return [str(token) for token in ids]
-        return ids
+        return self.field2id_token[field][ids]
 
 class FakeDatasetRec:
     def get_models(self):
@@ -36,18 +32,39 @@ class FakeDatasetManager:
     def get_dataset(self, ds_name):
         return {"dataset_obj": FakeDatasetRec()}
 
+class FakeModel(torch.nn.Module):
+    def __init__(self, config=None, dataset=None):
+        super().__init__()
+        self.user_embedding = torch.nn.Embedding(2, 2)
+        self.item_embedding = torch.nn.Embedding(3, 2)
+        with torch.no_grad():
+            self.user_embedding.weight.copy_(torch.tensor([[0.0, 0.0], [1.0, 0.0]]))
+            self.item_embedding.weight.copy_(torch.tensor([[0.0, 0.0], [0.9, 0.0], [0.8, 0.0]]))
+    def load_other_parameter(self, other_parameter):
+        pass
+
+class FakeTestData:
+    is_sequential = False
+    uid2history_item = np.array([None, torch.tensor([], dtype=torch.long)], dtype=object)
+
+class FakeTrainData:
+    _dataset = FakeRecboleDataset()
+
+class BPR(FakeModel):
+    pass
+
 def fake_load_data_and_model(model_file):
     config = {"device": "cpu"}
-    model = "fake_model"
+    model = BPR()
     dataset = FakeRecboleDataset()
-    train_data = "train"
+    train_data = FakeTrainData()
     valid_data = "valid"
-    test_data = "test"
+    test_data = FakeTestData()
     return config, model, dataset, train_data, valid_data, test_data
 
 def fake_full_sort_topk(uid_series, model, test_data, k, device):
-    topk_score = [FakeTensor([0.9, 0.8])]
-    topk_iid_list = FakeTensor([[1, 2]])
+    topk_score = torch.tensor([[0.9, 0.8]])
+    topk_iid_list = torch.tensor([[1, 2]])
     return topk_score, topk_iid_list
 
 @pytest.fixture(autouse=True)
@@ -72,15 +89,54 @@ def test_get_topk(rec_service):
     recommendations = rec_service.get_topk(config, ds_obj, dataset, uid_series, model, test_data, 2)
     assert "user-1" in recommendations
 
+def test_get_topk_resolves_titles_in_score_order(rec_service):
+    recs = rec_service.get_topk_uid("ds1", "model1", 2, "1")
+    titles = [title for title, item_id, score in recs["user-1"]]
+    item_ids = [item_id for title, item_id, score in recs["user-1"]]
+    scores = [score for title, item_id, score in recs["user-1"]]
+    assert titles == ["Test Movie", "Unknown ID 2"]
+    assert item_ids == ["item-1", "item-2"]
+    assert scores == pytest.approx([0.9, 0.8])
+
 def test_get_topk_all(rec_service):
     recs = rec_service.get_topk_all("ds1", "model1", 2)
     assert isinstance(recs, dict)
     assert "user-1" in recs
 
+def test_get_topk_all_columnar(rec_service):
+    table = rec_service.get_topk_all("ds1", "model1", 2, columnar=True)
+    assert table["users"].tolist() == ["1"]
+    assert table["items"][table["item_index"]].tolist() == [["1", "2"]]
+    assert table["titles"].tolist() == ["Test Movie", "Unknown ID 2"]
+    assert table["scores"][0].tolist() == pytest.approx([0.9, 0.8])
+
 def test_get_topk_uid(rec_service):
     recs = rec_service.get_topk_uid("ds1", "model1", 2, "1")
     assert "user-1" in recs
 
+def test_get_topk_uid_ann(rec_service, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "model1.pth").write_text("weights")
+    monkeypatch.setattr("recvizapi.AnnIndex.use_hnsw", False)
+    rec_service.cache_dir = str(tmp_path)
+    recs = rec_service.get_topk_uid("ds1", "model1", 2, "1", use_ann=True)
+    assert [item_id for title, item_id, score in recs["user-1"]] == ["item-1", "item-2"]
+    assert (tmp_path / "ds1_model1_ann.npz").exists()
+
+def test_ann_rows_without_enough_candidates_are_scored_exactly(rec_service, monkeypatch):
+    config, model, dataset, train_data, valid_data, test_data, ds_obj = rec_service.load_model("ds1", "model1")
+    index = AnnIndex().build(np.array([[0.0, 0.0], [0.9, 0.0]], dtype=np.float32))
+    scores, iids = rec_service.get_topk_arrays(config, np.array([1]), model, test_data, 2, (index, np.eye(2, dtype=np.float32)))
+    assert iids.tolist() == [[1, 2]]
+    assert scores[0].tolist() == pytest.approx([0.9, 0.8])
+
+def test_check_ann_recall(rec_service, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "model1.pth").write_text("weights")
+    monkeypatch.setattr("recvizapi.AnnIndex.use_hnsw", False)
+    report = rec_service.check_ann_recall("ds1", "model1", 2)
+    assert report["recall"] == 1.0
+
 def test_compute_graph_key_with_filters():
     filters = {"age": ["30", "25"]}
     key = compute_graph_key("ds1", filters)
@@ -89,3 +145,53 @@ def test_compute_graph_key_with_filters():
 def test_compute_graph_key_without_filters():
     key = compute_graph_key("ds1", None)
     assert key == "ds1"
+
+def test_prepare_cpu_model_int8_quantizes_linear_layers():
+    model = torch.nn.Sequential(torch.nn.Embedding(4, 3), torch.nn.Linear(3, 2))
+    prepared = prepare_cpu_model(model, "int8")
+    assert not prepared.training
+    assert not isinstance(prepared[1], torch.nn.Linear)
+
+def test_prepare_cpu_model_bf16_embedding_storage():
+    model = torch.nn.Sequential(torch.nn.Embedding(4, 3))
+    prepared = prepare_cpu_model(model, "bf16")
+    assert prepared[0].weight.dtype == torch.bfloat16
+
+def test_prepare_cpu_model_rejects_unknown_precision():
+    with pytest.raises(ValueError):
+        prepare_cpu_model(torch.nn.Linear(2, 2), "int4")
+
+def test_check_ranking_agreement(rec_service):
+    report = rec_service.check_ranking_agreement("ds1", "model1", 2)
+    assert report["users"] == 1
+    assert report["mean_overlap"] == 1.0
+    assert report["exact_order"] == 1.0
+
+def test_reference_model_is_loaded_once(rec_service, monkeypatch):
+    loads = []
+    monkeypatch.setattr("recvizapi.RecommendationService.load_data_and_model",
+                        lambda model_file: loads.append(model_file) or fake_load_data_and_model(model_file))
+    rec_service.check_ranking_agreement("ds1", "model1", 2)
+    rec_service.check_ranking_agreement("ds1", "model1", 2)
+    assert loads == ["model1.pth"]
+
+def test_reference_model_keeps_fp32_weights(rec_service, monkeypatch):
+    monkeypatch.setattr("recvizapi.RecommendationService.cpu_inference", True)
+    monkeypatch.setattr("recvizapi.RecommendationService.model_precision", "bf16")
+    monkeypatch.setattr("recvizapi.RecommendationService.torch.load",
+                        lambda model_file, map_location=None: {"state_dict": BPR().state_dict()})
+    served = rec_service.load_model("ds1", "model1")[1]
+    config, reference, test_data = rec_service.load_reference_model("ds1", "model1")
+    assert reference is not served
+    assert reference.item_embedding.weight.dtype == torch.float32
+    assert served.item_embedding.weight.dtype == torch.bfloat16
+    assert torch.equal(reference.item_embedding.weight, BPR().item_embedding.weight)
+
+def test_get_topk_tokens(rec_service):
+    tokens = rec_service.get_topk_tokens("ds1", "model1", 2)
+    assert tokens.tolist() == [["1", "2"]]
+
+def test_get_topk_users_skips_unknown_users(rec_service):
+    recs = rec_service.get_topk_users("ds1", "model1", 2, ["1", "7", 1])
+    assert list(recs) == ["1"]
+    assert [item_id for title, item_id, score in recs["1"]] == ["item-1", "item-2"]
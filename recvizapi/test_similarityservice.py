@@ -1,5 +1,32 @@
+from concurrent.futures import Future
 import networkx as nx
-from recvizapi.SimilarityService import SimilarityService
+import numpy as np
+import pytest
+import scipy.sparse as sp
+from recvizapi.SimilarityService import SimilarityService, set_worker_similarity_service
+
+HISTORIES = {"1": ["a", "b", "c"], "2": ["b", "c", "d", "d"], "3": ["e"]}
+ITEMS = ["a", "b", "c", "d", "e"]
+
+class FakeDataset:
+    def get_user_ids(self):
+        return list(HISTORIES.keys())
+
+    def get_user_index(self):
+        return {user_id: idx for idx, user_id in enumerate(HISTORIES)}
+
+    def get_interaction_matrix(self):
+        rows = [row for row, items in enumerate(HISTORIES.values()) for item in items]
+        cols = [ITEMS.index(item) for items in HISTORIES.values() for item in items]
+        return sp.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(HISTORIES), len(ITEMS)))
+
+class FakeDatasetManager:
+    def get_dataset(self, ds_name):
+        return {"dataset_obj": FakeDataset()}
+
+@pytest.fixture
+def batch_service():
+    return SimilarityService(FakeDatasetManager())
 
 def test_overlap_coefficient():
     service = SimilarityService()
@@ -30,9 +57,150 @@ def test_graph_edit_distance():
     result = service.graph_edit_distance(g1, g2)
     assert result is not None
 
+def test_bounded_graph_edit_distance():
+    service = SimilarityService()
+    g1 = nx.path_graph(3)
+    g2 = nx.path_graph(4)
+    result = service.bounded_graph_edit_distance(g1, g2, time_budget=1)
+    assert result["lower_bound"] <= result["estimate"] <= result["upper_bound"]
+    assert result["estimate"] == 2
+
 def test_simrank_similarity():
     service = SimilarityService()
     g = nx.Graph()
     g.add_edges_from([(1, 2), (2, 3), (3, 4)])
     result = service.simrank_similarity(g, 1, 3)
-    assert result is not None
\ No newline at end of file
+    assert result is not None
+
+def test_simrank_similarity_matches_networkx():
+    service = SimilarityService()
+    g = nx.Graph()
+    g.add_edges_from([("u1", "a"), ("u2", "a"), ("u2", "b"), ("u3", "b"), ("u3", "c")])
+    assert service.simrank_similarity(g, "u1", "u3") == pytest.approx(nx.simrank_similarity(g, "u1", "u3"))
+    triangle = nx.complete_graph(3)
+    assert service.simrank_similarity(triangle, 0, 1) == pytest.approx(nx.simrank_similarity(triangle, 0, 1))
+
+def test_topk_agreement_identical_lists():
+    service = SimilarityService()
+    metrics = service.topk_agreement([["a", "b", "c"]], [["a", "b", "c"]])
+    assert metrics["overlap"].tolist() == [3]
+    assert metrics["jaccard"].tolist() == [1.0]
+    assert metrics["rank_correlation"].tolist() == [1.0]
+
+def test_topk_agreement_disjoint_lists():
+    service = SimilarityService()
+    metrics = service.topk_agreement([["a", "b"]], [["c", "d"]])
+    assert metrics["jaccard"].tolist() == [0.0]
+    assert metrics["sorenson"].tolist() == [0.0]
+    assert metrics["rank_correlation"].tolist() == [-1.0]
+
+def test_topk_agreement_matches_pairwise_metrics():
+    service = SimilarityService()
+    a = [[1, 2, 3], [4, 5, 6]]
+    b = [[2, 3, 7], [6, 8, 9]]
+    metrics = service.topk_agreement(a, b)
+    for row in range(2):
+        assert metrics["jaccard"][row] == service.jaccard(a[row], b[row])
+        assert metrics["sorenson"][row] == service.sorenson_dice(a[row], b[row])
+        assert metrics["overlap_coefficient"][row] == service.overlap_coefficient(a[row], b[row])
+
+def test_topk_agreement_penalises_reordering():
+    service = SimilarityService()
+    metrics = service.topk_agreement([[1, 2, 3], [1, 2, 3]], [[1, 2, 3], [3, 2, 1]])
+    assert metrics["jaccard"].tolist() == [1.0, 1.0]
+    assert metrics["rank_correlation"][1] < metrics["rank_correlation"][0]
+
+def test_summarize_distribution():
+    service = SimilarityService()
+    summary = service.summarize_distribution([0.0, 0.5, 1.0], bins=2)
+    assert summary["mean"] == 0.5
+    assert summary["quantiles"]["p50"] == 0.5
+    assert summary["histogram"]["counts"] == [1, 2]
+
+@pytest.mark.parametrize("metric", ["overlap_coefficient", "sorenson_dice", "jaccard", "list_cosine"])
+def test_batch_similarity_matches_pairwise(batch_service, metric):
+    pairs = [("1", "2"), ("2", "3"), ("1", "1")]
+    scores = batch_service.batch_similarity("ds1", metric, pairs)
+    expected = [getattr(batch_service, metric)(HISTORIES[a], HISTORIES[b]) for a, b in pairs]
+    assert scores == pytest.approx(expected)
+
+@pytest.mark.parametrize("metric", ["jaccard", "list_cosine"])
+def test_one_vs_all_matches_pairwise(batch_service, metric):
+    scores = batch_service.one_vs_all("ds1", metric, "2")
+    expected = [getattr(batch_service, metric)(HISTORIES["2"], HISTORIES[uid]) for uid in HISTORIES]
+    assert scores == pytest.approx(expected)
+
+def test_cohort_similarity(batch_service):
+    matrix = batch_service.cohort_similarity("ds1", "jaccard", ["1", "2", "3"])
+    assert matrix.shape == (3, 3)
+    assert np.diag(matrix).tolist() == [1.0, 1.0, 1.0]
+    assert matrix[0, 1] == pytest.approx(0.5)
+    assert matrix[0, 2] == 0.0
+
+def test_batch_similarity_rejects_unknown_metric(batch_service):
+    with pytest.raises(ValueError):
+        batch_service.batch_similarity("ds1", "hamming", [("1", "2")])
+
+def test_most_similar_users(tmp_path):
+    service = SimilarityService(FakeDatasetManager(), str(tmp_path))
+    neighbours = service.most_similar_users("ds1", "1", 2, "jaccard")
+    assert neighbours[0] == ["2", pytest.approx(0.5)]
+    assert (tmp_path / "ds1_neighbours_lsh.npz").exists()
+
+def test_most_similar_users_cosine(batch_service):
+    neighbours = batch_service.most_similar_users("ds1", "2", 1, "list_cosine")
+    assert neighbours[0][0] == "1"
+    assert neighbours[0][1] == pytest.approx(batch_service.list_cosine(HISTORIES["2"], HISTORIES["1"]))
+
+def test_random_walk_similarity(tmp_path, monkeypatch):
+    monkeypatch.setattr("recvizapi.RandomWalkIndex.panther_min_paths", 2000)
+    monkeypatch.setattr("recvizapi.RandomWalkIndex.random_walk_workers", 1)
+    service = SimilarityService(FakeDatasetManager(), str(tmp_path))
+    # The index is built by a background job; requests see None until it is saved.
+    assert service.random_walk_similarity("ds1", "1", "2") is None
+    service.random_walk_jobs["ds1"].result()
+    scores = service.random_walk_similarity("ds1", "1", "2")
+    assert scores["panther_similarity"] > 0
+    assert 0 <= scores["ppr_similarity"] <= 1
+    neighbours = service.random_walk_neighbours("ds1", "1", 1, "panther")
+    assert neighbours[0][0] == "2"
+    assert (tmp_path / "ds1_random_walks.npz").exists()
+    with pytest.raises(ValueError):
+        service.random_walk_neighbours("ds1", "1", 1, "simrank")
+
+def test_metric_suite_matches_individual_metrics():
+    service = SimilarityService()
+    a = ["x", "y", "y", "z"]
+    b = ["y", "z", "w"]
+    suite = service.metric_suite(a, b)
+    assert suite["overlap_coefficient"] == service.overlap_coefficient(a, b)
+    assert suite["sorenson_dice"] == service.sorenson_dice(a, b)
+    assert suite["jaccard"] == service.jaccard(a, b)
+    assert suite["list_cosine"] == pytest.approx(service.list_cosine(a, b))
+
+def test_metric_suite_subset():
+    service = SimilarityService()
+    assert list(service.metric_suite([1, 2], [2, 3], ["jaccard"]).keys()) == ["jaccard"]
+
+def test_metric_suite_empty_lists():
+    service = SimilarityService()
+    assert service.metric_suite([], [1]) == {"overlap_coefficient": 0.0, "sorenson_dice": 0.0, "jaccard": 0.0, "list_cosine": 0.0}
+
+def test_random_walk_index_builds_in_job_pool(tmp_path, monkeypatch):
+    monkeypatch.setattr("recvizapi.RandomWalkIndex.panther_min_paths", 2000)
+    monkeypatch.setattr("recvizapi.RandomWalkIndex.random_walk_workers", 1)
+    submitted = []
+
+    class FakePool:
+        def submit(self, function, *args):
+            submitted.append((function.__name__, args))
+            future = Future()
+            future.set_result(function(*args))
+            return future
+
+    service = SimilarityService(FakeDatasetManager(), str(tmp_path), FakePool())
+    set_worker_similarity_service(service)
+    assert service.get_random_walk_index("ds1") is None
+    assert submitted == [("build_random_walks_in_worker", ("ds1",))]
+    assert service.get_random_walk_index("ds1").panther_similarity(0, 1) > 0
+    assert len(submitted) == 1
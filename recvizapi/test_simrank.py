@@ -0,0 +1,74 @@
+import networkx as nx
+import numpy as np
+import pytest
+import scipy.sparse as sp
+from recvizapi.SimRank import SimRankIndex, simrank_bipartite, simrank_low_rank
+
+@pytest.fixture
+def graph():
+    rng = np.random.default_rng(1)
+    g = nx.Graph()
+    for user in range(30):
+        for item in rng.choice(20, 4, replace=False):
+            g.add_edge(f"user-{user}", f"item-{item}", weight=int(rng.integers(1, 3)))
+    g.add_node("user-99")
+    return g
+
+def is_user(node):
+    return node.startswith("user-")
+
+def test_exact_matches_networkx(graph):
+    index = SimRankIndex().build_from_graph(graph, is_user)
+    expected = nx.simrank_similarity(graph)
+    for a in ["user-0", "user-5", "item-3", "user-99"]:
+        for b in graph.nodes:
+            assert index.similarity(a, b) == pytest.approx(expected[a][b], abs=1e-9)
+
+def test_low_rank_tracks_exact(graph):
+    users = [node for node in graph if is_user(node)]
+    items = [node for node in graph if not is_user(node)]
+    biadjacency = nx.bipartite.biadjacency_matrix(graph, users, items)
+    exact, _ = simrank_bipartite(biadjacency)
+    factors, _ = simrank_low_rank(biadjacency, rank=19)
+    off_diagonal = ~np.eye(len(users), dtype=bool)
+    assert np.corrcoef(exact[off_diagonal], (factors @ factors.T)[off_diagonal])[0, 1] > 0.95
+
+def test_low_rank_mode_used_for_large_graphs(graph, monkeypatch):
+    monkeypatch.setattr("recvizapi.SimRank.simrank_exact_limit", 10)
+    monkeypatch.setattr("recvizapi.SimRank.simrank_rank", 8)
+    index = SimRankIndex().build_from_graph(graph, is_user)
+    assert index.mode == "low_rank"
+    assert index.similarity("user-1", "user-1") == 1.0
+    assert index.similarity("user-1", "item-1") == 0.0
+    neighbours = index.most_similar("user-1", 3)
+    assert len(neighbours) == 3
+    assert neighbours[0][1] == pytest.approx(index.similarity("user-1", neighbours[0][0]))
+
+def test_mode_can_be_forced(graph, monkeypatch):
+    monkeypatch.setattr("recvizapi.SimRank.simrank_exact_limit", 10)
+    assert SimRankIndex().build_from_graph(graph, is_user, mode="exact").mode == "exact"
+    with pytest.raises(ValueError):
+        SimRankIndex().build_from_graph(graph, is_user, mode="approximate")
+
+def test_most_similar_is_sorted_and_excludes_self(graph):
+    index = SimRankIndex().build_from_graph(graph, is_user)
+    neighbours = index.most_similar("user-0", 5)
+    assert "user-0" not in [node for node, _ in neighbours]
+    scores = [score for _, score in neighbours]
+    assert scores == sorted(scores, reverse=True)
+    assert all(node.startswith("user-") for node, _ in neighbours)
+
+def test_save_and_load_round_trip(graph, tmp_path):
+    index = SimRankIndex(str(tmp_path / "ds1_simrank")).build_from_graph(graph, is_user)
+    index.save()
+    assert [path.name for path in tmp_path.iterdir()] == ["ds1_simrank.npz"]
+    loaded = SimRankIndex(str(tmp_path / "ds1_simrank"))
+    assert loaded.load()
+    assert loaded.mode == "exact"
+    assert loaded.similarity("user-0", "user-1") == pytest.approx(index.similarity("user-0", "user-1"), rel=1e-6)
+    assert not SimRankIndex(str(tmp_path / "missing")).load()
+
+def test_unknown_node_raises():
+    index = SimRankIndex().build(sp.csr_matrix(np.ones((2, 2))), ["user-1", "user-2"], ["item-1", "item-2"])
+    with pytest.raises(KeyError):
+        index.similarity("user-1", "user-3")
@@ -0,0 +1,112 @@
+import asyncio
+import os
+import time
+import pytest
+from recvizapi.Workers import PoolBusy, WorkerCrashed, WorkPool
+
+def slow_add(a, b, delay=0.0):
+    time.sleep(delay)
+    return a + b
+
+def failing():
+    raise ValueError("boom")
+
+def record_pid_and_sleep(path):
+    with open(path, "w") as f:
+        f.write(str(os.getpid()))
+    time.sleep(60)
+
+def test_thread_pool_runs_function():
+    pool = WorkPool("test", 2)
+    assert asyncio.run(pool.run(slow_add, 1, 2)) == 3
+
+def test_thread_pool_rejects_when_full():
+    pool = WorkPool("test", 1, 1)
+
+    async def scenario():
+        first = asyncio.ensure_future(pool.run(slow_add, 1, 2, 0.2))
+        await asyncio.sleep(0.05)
+        with pytest.raises(PoolBusy):
+            await pool.run(slow_add, 1, 2)
+        return await first
+
+    assert asyncio.run(scenario()) == 3
+    # The slot is given back once the job finishes.
+    assert asyncio.run(pool.run(slow_add, 2, 2)) == 4
+
+def test_process_pool_returns_result_and_errors():
+    pool = WorkPool("test", 1, use_processes=True)
+    assert asyncio.run(pool.run(slow_add, 3, 4)) == 7
+    with pytest.raises(WorkerCrashed, match="boom"):
+        asyncio.run(pool.run(failing))
+    assert asyncio.run(pool.run(slow_add, 1, 1)) == 2
+
+def test_process_pool_queues_jobs_past_its_workers():
+    pool = WorkPool("test", 1, 3, use_processes=True)
+
+    async def scenario():
+        started = time.perf_counter()
+        results = await asyncio.gather(*(pool.run(slow_add, idx, 1, 0.2) for idx in range(4)), return_exceptions=True)
+        return results, time.perf_counter() - started
+
+    results, seconds = asyncio.run(scenario())
+    assert results[:3] == [1, 2, 3] and isinstance(results[3], PoolBusy)
+    # One worker runs the three admitted jobs one after the other.
+    assert seconds >= 0.6
+    assert pool.workers.acquire(blocking=False)
+
+def test_cancelling_process_job_kills_worker(tmp_path):
+    pool = WorkPool("test", 1, use_processes=True)
+    pid_file = tmp_path / "pid"
+
+    async def scenario():
+        task = asyncio.ensure_future(pool.run(record_pid_and_sleep, str(pid_file)))
+        while not pid_file.exists() or not pid_file.read_text():
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+    with pytest.raises(ProcessLookupError):
+        os.kill(int(pid_file.read_text()), 0)
+
+calls = []
+
+def counted_add(a, b):
+    calls.append((a, b))
+    time.sleep(0.1)
+    return a + b
+
+def test_shared_jobs_run_once(monkeypatch):
+    monkeypatch.setattr("recvizapi.test_workers.calls", [])
+    pool = WorkPool("test", 2, 4)
+
+    async def scenario():
+        return await asyncio.gather(pool.run_shared("k", counted_add, 1, 2), pool.run_shared("k", counted_add, 1, 2))
+
+    assert asyncio.run(scenario()) == [3, 3]
+    assert calls == [(1, 2)]
+    assert pool.shared_jobs == {}
+
+refreshed_state = None
+
+def refresh_state(state):
+    global refreshed_state
+    refreshed_state = state
+
+def read_refreshed_state():
+    return refreshed_state
+
+def test_fork_server_refreshes_before_each_job():
+    snapshots = iter(["first", "second"])
+    pool = WorkPool("test", 1, use_processes=True)
+    pool.start(refresh_state, lambda: next(snapshots))
+    server_pid = pool.server.pid
+    assert asyncio.run(pool.run(read_refreshed_state)) == "first"
+    assert asyncio.run(pool.run(read_refreshed_state)) == "second"
+    assert pool.server.pid == server_pid
+
+def test_submitted_job_outlives_the_caller():
+    pool = WorkPool("test", 1, use_processes=True)
+    assert pool.submit(slow_add, 2, 5).result(timeout=10) == 7
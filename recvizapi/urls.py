@@ -4,14 +4,30 @@ from . import views
 
 urlpatterns = [
     path("", views.index, name="index"),
+    path("metrics", views.metrics, name="metrics"),
+    path("profiles", views.list_profiles, name="list_profiles"),
+    path("profiles/<str:name>", views.get_profile, name="get_profile"),
     path("get_available_datasets", views.get_available_datasets, name='get_available_datasets'),
     path("get_dataset_models/<slug:dataset_name>", views.get_dataset_models, name='get_dataset_models'),
     path("get_inter_graph/<slug:dataset_name>/", views.get_inter_graph, name='get_inter_graph'),
     path("get_louvain/<slug:dataset_name>/", views.get_louvain, name='get_louvain'),
+    path("get_graph_stats/<slug:dataset_name>/", views.get_graph_stats, name="get_graph_stats"),
+    path("get_neighbourhood/<slug:dataset_name>/<slug:node>", views.get_neighbourhood, name="get_neighbourhood"),
+    path("ingest/<slug:dataset_name>", views.ingest, name="ingest"),
+    path("get_simrank_similarity/<slug:dataset_name>/<slug:uid1>/<slug:uid2>", views.get_simrank_similarity, name="get_simrank_similarity"),
+    path("get_simrank_neighbours/<slug:dataset_name>/<slug:uid>/<int:n>", views.get_simrank_neighbours, name="get_simrank_neighbours"),
     path("get_features/<slug:dataset_name>", views.get_features, name='get_features'),
     path("get_topk_all/<slug:dataset_name>/<slug:model_name>/<int:k>", views.get_topk_all, name='get_topk_all'),
     path("get_topk_uid/<slug:dataset_name>/<slug:model_name>/<int:k>/<int:uid>", views.get_topk_uid, name='get_topk_uid'),
+    path("get_ranking_agreement/<slug:dataset_name>/<slug:model_name>/<int:k>", views.get_ranking_agreement, name='get_ranking_agreement'),
+    path("get_ann_recall/<slug:dataset_name>/<slug:model_name>/<int:k>", views.get_ann_recall, name='get_ann_recall'),
+    path("compare_models/<slug:dataset_name>/<slug:model1>/<slug:model2>/<int:k>", views.compare_models, name="compare_models"),
+    path("evaluate_model/<slug:dataset_name>/<slug:model_name>/<int:k>", views.evaluate_model, name="evaluate_model"),
+    path("get_cohort_similarity/<slug:dataset_name>/", views.get_cohort_similarity, name="get_cohort_similarity"),
+    path("get_similar_users/<slug:dataset_name>/<slug:uid>/<int:n>", views.get_similar_users, name="get_similar_users"),
     path("calculate_user_similarity_metrics/<slug:dataset_name>/<slug:model1>/<slug:model2>/<int:k>/<slug:uid1>/<slug:uid2>", views.calculate_user_similarity_metrics, name="calculate_user_similarity_metrics"),
+    path("batch_user_similarity_metrics/<slug:dataset_name>", views.batch_user_similarity_metrics, name="batch_user_similarity_metrics"),
     path("get_interaction_history_k/<slug:dataset_name>/<int:k>/<int:uid>", views.get_interaction_history_k, name="get_interaction_history_k"),
     path("get_user_interaction_graph_similarity_metrics/<slug:dataset_name>/<slug:uid1>/<slug:uid2>", views.get_user_interaction_graph_similarity_metrics, name="get_user_interaction_graph_similarity_metrics"),
+    path("get_random_walk_neighbours/<slug:dataset_name>/<slug:uid>/<int:n>", views.get_random_walk_neighbours, name="get_random_walk_neighbours"),
 ]
\ No newline at end of file
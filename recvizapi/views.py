@@ -1,12 +1,22 @@
 import networkx as nx
 from django.shortcuts import render
-from django.http import JsonResponse, FileResponse
+from django.http import JsonResponse, FileResponse, HttpResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 import os
+import json
 from .DatasetManager import DatasetManager
-from .GraphService import GraphService
+from .GraphService import (GraphService, compute_graph_key, seeded_graph_key, louvain_columnar, set_worker_service, refresh_worker_service,
+                           build_gexf_in_worker, build_window_gexf_in_worker, louvain_in_worker)
 from .RecommendationService import RecommendationService
-from .SimilarityService import SimilarityService
-import random
+from .SimilarityService import SimilarityService, batch_metrics, set_worker_similarity_service
+from .EvaluationService import EvaluationService
+from .Workers import PoolBusy, WorkerCrashed, model_pool, similarity_pool, graph_pool
+from .Encoding import encode_payload
+from .Ingest import Ingestor, is_allowed as ingest_allowed
+from .Metrics import timed, register_gauge, render_prometheus
+from . import Profiling
+import functools
 import numpy
 
 if 'RECVIZ_DS_PATH' not in os.environ:
@@ -16,200 +26,669 @@ if "RECVIZ_CACHE_PATH" not in os.environ:
     raise EnvironmentError("Environment variable RECVIZ_CACHE_PATH is not set")
 
 dataset_manager = DatasetManager()
-recommendation_service = RecommendationService(dataset_manager)
-graph_service = GraphService(os.environ['RECVIZ_CACHE_PATH'], dataset_manager)
-similarity_service = SimilarityService()
+recommendation_service = RecommendationService(dataset_manager, os.environ['RECVIZ_CACHE_PATH'])
+graph_service = GraphService(os.environ['RECVIZ_CACHE_PATH'], dataset_manager, graph_pool)
+similarity_service = SimilarityService(dataset_manager, os.environ['RECVIZ_CACHE_PATH'], graph_pool)
+evaluation_service = EvaluationService(dataset_manager, recommendation_service, os.environ['RECVIZ_CACHE_PATH'])
 
-def index(request):
-    return render(request, "recexplainapp/index.html", {})
+# The graph pool's fork server is forked here, before the ingestor thread starts, and keeps these services.
+set_worker_service(graph_service)
+set_worker_similarity_service(similarity_service)
+graph_pool.start(refresh_worker_service, graph_service.worker_state)
 
-def get_inter_graph(request, dataset_name):
-    filters = {}
-    for key, values in request.GET.lists():
-        filters[key] = values
-
-    graph_obj = graph_service.get_graph(dataset_name, filters)
-    gexf_path = None
-    if graph_obj:
-        if isinstance(graph_obj, str):
-            gexf_path = graph_obj
-        elif graph_obj.is_ready():
-            gexf_path = graph_obj.get_gexf_path()
-        if gexf_path is not None:
-            response = FileResponse(open(gexf_path, "rb"), content_type="application/xml")
-            response["Content-Disposition"] = "attachment; filename=inter_graph.gexf"
+ingestor = Ingestor(dataset_manager, [graph_service, similarity_service, evaluation_service])
+ingestor.start()
+
+register_gauge("recviz_cache_entries", lambda: {
+    (("cache", "model"),): len(recommendation_service._model_cache),
+    (("cache", "ann"),): len(recommendation_service._ann_cache),
+    (("cache", "graph"),): len(graph_service.cached),
+    (("cache", "transient_graph"),): len(graph_service.transient_cache),
+    (("cache", "adjacency_index"),): len(graph_service.adjacency_cache),
+    (("cache", "evaluation"),): len(evaluation_service.cached),
+    (("cache", "neighbour_index"),): len(similarity_service._neighbour_cache),
+    (("cache", "random_walk_index"),): len(similarity_service._random_walk_cache),
+}, "Entries held in each in-process cache.")
+
+def offloaded(view):
+    # Views that hand work to a bounded pool answer 503 instead of queueing without limit.
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        try:
+            return await view(request, *args, **kwargs)
+        except PoolBusy as e:
+            response = JsonResponse({"error": str(e)}, status=503)
+            response["Retry-After"] = "5"
             return response
-    return JsonResponse({"error": "Graph not found"}, status=404)
+        except WorkerCrashed as e:
+            # The job's traceback stays in the server log; the client gets its first line.
+            print("WORKER JOB FAILED:", e)
+            return JsonResponse({"error": str(e).partition("\n")[0]}, status=500)
+    return wrapper
+
+# Query parameters that select the response shape, time window or delta base rather than filter the graph.
+reserved_params = {"format", "start", "end", "base", Profiling.profile_param}
+# Graph responses name the graph key they are for, which later requests can pass as ?base= to get deltas.
+graph_key_header = "X-Recviz-Graph-Key"
 
-def get_louvain(request, dataset_name):
+def request_filters(request):
     filters = {}
     for key, values in request.GET.lists():
-        filters[key] = values
-    louvain_parts = graph_service.get_louvain(dataset_name, filters)
-    return JsonResponse(louvain_parts)
+        if key not in reserved_params:
+            filters[key] = values
+    return filters
+
+def request_window(request):
+    # ?start=&end= keep the interactions with start <= timestamp < end; None when neither is given.
+    start = request.GET.get("start") or None
+    end = request.GET.get("end") or None
+    if start is None and end is None:
+        return None
+    window = None if start is None else float(start), None if end is None else float(end)
+    if not all(bound is None or numpy.isfinite(bound) for bound in window):
+        raise ValueError("start and end must be finite")
+    return window
+
+def encoded_response(body, content_encoding):
+    response = HttpResponse(body, content_type="application/json")
+    response["Vary"] = "Accept-Encoding"
+    if content_encoding is not None:
+        response["Content-Encoding"] = content_encoding
+    return response
+
+async def index(request):
+    return render(request, "recexplainapp/index.html", {})
+
+async def metrics(request):
+    return HttpResponse(render_prometheus(), content_type="text/plain; version=0.0.4")
+
+async def list_profiles(request):
+    if not Profiling.is_allowed(request):
+        return JsonResponse({"error": "Profiling is not enabled for this client"}, status=403)
+    try:
+        n = int(request.GET.get("n", 50))
+    except ValueError:
+        return JsonResponse({"error": "n must be an integer"}, status=400)
+    if n < 1:
+        return JsonResponse({"error": "n must be at least 1"}, status=400)
+    return JsonResponse({"profiles": Profiling.list_profiles(n)})
+
+async def get_profile(request, name):
+    if not Profiling.is_allowed(request):
+        return JsonResponse({"error": "Profiling is not enabled for this client"}, status=403)
+    profile = Profiling.load_profile(name)
+    if profile is None:
+        return JsonResponse({"error": "Profile not found"}, status=404)
+    metadata, prof_path = profile
+    if request.GET.get("download") == "1":
+        return FileResponse(open(prof_path, "rb"), as_attachment=True, filename=os.path.basename(prof_path))
+    return JsonResponse(metadata)
+
+@offloaded
+async def get_inter_graph(request, dataset_name):
+    filters = request_filters(request)
+    try:
+        window = request_window(request)
+    except ValueError:
+        return JsonResponse({"error": "start and end must be timestamps"}, status=400)
+    # ?base=<graph key the client already has> answers with the differences from that graph instead of a gexf,
+    # as long as the base graph is still cached.
+    base_key = request.GET.get("base")
+    base_path = None
+    if base_key and graph_service.owns_key(dataset_name, base_key):
+        base_path = graph_service.find_gexf_path(base_key)
+    if base_path is not None and not os.path.exists(base_path):
+        base_path = None
+    graph_key = compute_graph_key(dataset_name, filters, window)
+    gexf_path = graph_service.get_gexf_path(dataset_name, filters, window)
+    if gexf_path is None and window is None and base_path is not None:
+        # Without a full layout of the graph, the delta is against a layout started from the base's positions. It is
+        # kept under its own key, which the client gets to ask for the next delta against.
+        graph_key = seeded_graph_key(graph_key, base_key)
+        gexf_path = graph_service.find_gexf_path(graph_key)
+        if gexf_path is None:
+            gexf_path = await graph_pool.run_shared(graph_key, build_gexf_in_worker, dataset_name, filters, base_path, graph_key)
+            graph_service.store_transient(graph_key, gexf_path)
+    elif gexf_path is None:
+        # Assembly and layout run in a forked worker that is killed if the client disconnects; concurrent requests
+        # for the same graph wait for one job.
+        if window is None:
+            gexf_path = await graph_pool.run_shared(graph_key, build_gexf_in_worker, dataset_name, filters, None, None)
+        else:
+            graph_service.latest_windows[dataset_name] = window
+            built = await graph_pool.run_shared(graph_key, build_window_gexf_in_worker, dataset_name, filters, window,
+                                                graph_service.get_window_positions(dataset_name, filters))
+            graph_service.store_window_positions(dataset_name, filters, built["positions"])
+            gexf_path = built["gexf_path"]
+        if gexf_path is not None:
+            graph_service.store(dataset_name, filters, gexf_path, window=window)
+    if gexf_path is None:
+        return JsonResponse({"error": "Graph not found"}, status=404)
+    if base_path is not None:
+        accept_encoding = request.headers.get("Accept-Encoding")
+
+        def encoded_delta():
+            delta = graph_service.get_graph_delta(base_path, gexf_path)
+            return encode_payload({"base": base_key, "graph_key": graph_key, **delta}, accept_encoding)
+
+        response = encoded_response(*await similarity_pool.run(encoded_delta))
+    else:
+        response = FileResponse(open(gexf_path, "rb"), content_type="application/xml")
+        response["Content-Disposition"] = "attachment; filename=inter_graph.gexf"
+    response[graph_key_header] = graph_key
+    return response
 
-def get_available_datasets(request):
+@offloaded
+async def get_louvain(request, dataset_name):
+    filters = request_filters(request)
+    try:
+        window = request_window(request)
+    except ValueError:
+        return JsonResponse({"error": "start and end must be timestamps"}, status=400)
+    louvain_parts = graph_service.get_cached_louvain(dataset_name, filters, window)
+    if louvain_parts is None:
+        if window is not None:
+            graph_service.latest_windows[dataset_name] = window
+        louvain_parts = await graph_pool.run_shared(compute_graph_key(dataset_name, filters, window) + "_louvain",
+                                                    louvain_in_worker, dataset_name, filters, window)
+        graph_service.store(dataset_name, filters, louvain_parts, "_louvain", window)
+    if request.GET.get("format") == "columnar":
+        louvain_parts = louvain_columnar(louvain_parts)
+    return encoded_response(*await similarity_pool.run(encode_payload, louvain_parts, request.headers.get("Accept-Encoding")))
+
+@offloaded
+async def get_graph_stats(request, dataset_name):
+    filters = request_filters(request)
+    try:
+        window = request_window(request)
+    except ValueError:
+        return JsonResponse({"error": "start and end must be timestamps"}, status=400)
+    dsm_entry = dataset_manager.get_dataset(dataset_name)
+    if not dsm_entry or not dsm_entry["dataset_obj"].get_validity():
+        return JsonResponse({"error": "Dataset not found"}, status=404)
+    stats = graph_service.get_cached_graph_stats(dataset_name, filters, window)
+    if stats is None:
+        window_edges = None
+        if window is not None:
+            window_edges = await similarity_pool.run(graph_service.get_window_edges, dataset_name, window)
+        stats = await similarity_pool.run(graph_service.build_graph_stats, dataset_name, filters, window_edges)
+    return JsonResponse(stats)
+
+max_neighbourhood_hops = 3
+# Neighbourhoods are cut at the hop that would take them past this many nodes.
+neighbourhood_max_nodes = int(os.environ.get("RECVIZ_NEIGHBOURHOOD_MAX_NODES", "5000"))
+
+@offloaded
+async def get_neighbourhood(request, dataset_name, node):
+    try:
+        hops = int(request.GET.get("hops", 1))
+        caps = [int(value) for entry in request.GET.getlist("cap") for value in entry.split(",") if value]
+        max_nodes = min(int(request.GET.get("max_nodes", neighbourhood_max_nodes)), neighbourhood_max_nodes)
+    except ValueError:
+        return JsonResponse({"error": "hops, cap and max_nodes must be integers"}, status=400)
+    if not 1 <= hops <= max_neighbourhood_hops:
+        return JsonResponse({"error": f"hops must be between 1 and {max_neighbourhood_hops}"}, status=400)
+    dsm_entry = dataset_manager.get_dataset(dataset_name)
+    if not dsm_entry or not dsm_entry["dataset_obj"].get_validity():
+        return JsonResponse({"error": "Dataset not found"}, status=404)
+    columnar = request.GET.get("format") == "columnar"
+    accept_encoding = request.headers.get("Accept-Encoding")
+
+    def encoded_neighbourhood():
+        return encode_payload(graph_service.get_neighbourhood(dataset_name, node, hops, caps, max_nodes, columnar), accept_encoding)
+
+    try:
+        return encoded_response(*await similarity_pool.run(encoded_neighbourhood))
+    except KeyError:
+        return JsonResponse({"error": "Node not found in graph"}, status=404)
+
+@csrf_exempt
+@require_POST
+@offloaded
+async def ingest(request, dataset_name):
+    # {"interactions": [{field: value}]} appends to the dataset's .inter file; an empty body only picks up
+    # lines appended to the files by other writers.
+    if not ingest_allowed(request):
+        return JsonResponse({"error": "Ingestion is not enabled for this client"}, status=403)
+    dsm_entry = dataset_manager.get_dataset(dataset_name)
+    if not dsm_entry or not dsm_entry["dataset_obj"].get_validity():
+        return JsonResponse({"error": "Dataset not found"}, status=404)
+    try:
+        records = json.loads(request.body).get("interactions") if request.body else None
+    except (ValueError, AttributeError):
+        return JsonResponse({"error": "Body must be a JSON object"}, status=400)
+    if records is None:
+        return JsonResponse(await similarity_pool.run(ingestor.ingest, dataset_name))
+    if not isinstance(records, list) or not all(isinstance(record, dict) for record in records):
+        return JsonResponse({"error": "interactions must be a list of objects"}, status=400)
+    try:
+        return JsonResponse(await similarity_pool.run(ingestor.append, dataset_name, records))
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+@offloaded
+async def get_simrank_similarity(request, dataset_name, uid1, uid2):
+    # Loading a saved index and answering from it run in the similarity pool; the index itself is built in the graph pool.
+    simrank = await similarity_pool.run(graph_service.get_simrank, dataset_name, request_filters(request))
+    if simrank is None:
+        return JsonResponse({"status": "pending"}, status=202)
+    try:
+        similarity = await similarity_pool.run(simrank.similarity, f"user-{uid1}", f"user-{uid2}")
+    except KeyError:
+        return JsonResponse({"error": "User not found in graph"}, status=404)
+    # method tells whether the graph was small enough for exact SimRank or used the low-rank approximation.
+    return JsonResponse({"simrank_similarity": similarity, "method": simrank.mode})
+
+@offloaded
+async def get_simrank_neighbours(request, dataset_name, uid, n):
+    simrank = await similarity_pool.run(graph_service.get_simrank, dataset_name, request_filters(request))
+    if simrank is None:
+        return JsonResponse({"status": "pending"}, status=202)
+    try:
+        neighbours = await similarity_pool.run(simrank.most_similar, f"user-{uid}", n)
+    except KeyError:
+        return JsonResponse({"error": "User not found in graph"}, status=404)
+    return JsonResponse({"uid": uid, "method": simrank.mode,
+                         "neighbours": [[node[len("user-"):], score] for node, score in neighbours]})
+
+async def get_available_datasets(request):
     return JsonResponse({"datasets": dataset_manager.get_available_datasets()})
 
-def get_dataset_models(request, dataset_name):
+async def get_dataset_models(request, dataset_name):
     model_dict = dataset_manager.get_available_models(dataset_name)
     if model_dict is not None:
         return JsonResponse({"models": list(model_dict.keys())})
     else:
         return JsonResponse({"models": []})
 
-def get_features(request, dataset_name):
+async def get_features(request, dataset_name):
     dsm_entry = dataset_manager.get_dataset(dataset_name)
     if dsm_entry and dsm_entry["dataset_obj"].get_validity():
         dataset_obj = dsm_entry["dataset_obj"]
         return JsonResponse({"fields": dataset_obj.get_features()})
 
-def get_item_mapping(request, dataset_name):
+async def get_item_mapping(request, dataset_name):
     dsm_entry = dataset_manager.get_dataset(dataset_name)
     if dsm_entry and dsm_entry["dataset_obj"].get_validity():
         dataset_obj = dsm_entry["dataset_obj"]
         return JsonResponse({"fields": dataset_obj.get_user_features()})
 
-def get_interaction_history_k(request, dataset_name, k, uid):
+async def get_interaction_history_k(request, dataset_name, k, uid):
     dsm_entry = dataset_manager.get_dataset(dataset_name)
     result = []
+    try:
+        window = request_window(request) or (None, None)
+    except ValueError:
+        return JsonResponse({"error": "start and end must be timestamps"}, status=400)
     if dsm_entry and dsm_entry["dataset_obj"].get_validity():
         dataset_obj = dsm_entry["dataset_obj"]
-        user_mapping = dataset_obj.get_user_mapping()
-        item_mapping = dataset_obj.get_item_mapping()
-        uid = str(uid)
-        if uid in user_mapping:
-            user = user_mapping[uid]
-            if "interaction_history" in user:
-                if len(user["interaction_history"]) >= k:
-                    for elt in user["interaction_history"][-k:]:
-                        result.append(item_mapping.get(elt["item_id"], {}).get("movie_title", f"Unknown ID {elt["item_id"]}"))
+        row = dataset_obj.get_user_index().get(str(uid))
+        if row is not None:
+            history_index = dataset_obj.get_history_index()
+            entries = history_index.entries(row, start=window[0], end=window[1])
+            if len(entries) >= k:
+                result = history_index.titles_of(entries[len(entries) - k:])
     return JsonResponse({"result": result})
 
-def get_topk_all(request, dataset_name, model_name, k):
-    return JsonResponse(recommendation_service.get_topk_all(dataset_name, model_name + ".pth", k))
-
-def get_topk_uid(request, dataset_name, model_name, k, uid):
-    return JsonResponse(recommendation_service.get_topk_uid(dataset_name, model_name + ".pth", k, uid))
-
-def calculate_user_similarity_metrics(request, dataset_name, model1, model2, k, uid1, uid2):
-    recs_1 = recommendation_service.get_topk_uid(dataset_name, model1 + ".pth", k, uid1)
-    recs_2 = recommendation_service.get_topk_uid(dataset_name, model2 + ".pth", k, uid2)
-    user_id_1, preds_1 = next(iter(recs_1.items()))
-    user_id_2, preds_2 = next(iter(recs_2.items()))
-    user1_recs = [title for title, item_id, rating in preds_1]
-    user2_recs = [title for title, item_id, rating in preds_2]
-    user1_rec_ids = [str(item_id).split('-')[-1] for title, item_id, rating in preds_1]
-    user2_rec_ids = [str(item_id).split('-')[-1] for title, item_id, rating in preds_2]
-    user1_history = None
-    user1_history_ids = None
-    user2_history = None
-    user2_history_ids = None
+@offloaded
+async def get_topk_all(request, dataset_name, model_name, k):
+    use_ann = request.GET.get("ann") == "1"
+    columnar = request.GET.get("format") == "columnar"
+    accept_encoding = request.headers.get("Accept-Encoding")
+
+    def encoded_topk():
+        # Encoding the full table is as heavy as scoring it, so it stays on the worker thread.
+        return encode_payload(recommendation_service.get_topk_all(dataset_name, model_name + ".pth", k, use_ann, columnar), accept_encoding)
+
+    return encoded_response(*await model_pool.run(encoded_topk))
+
+@offloaded
+async def get_topk_uid(request, dataset_name, model_name, k, uid):
+    use_ann = request.GET.get("ann") == "1"
+    return JsonResponse(await model_pool.run(recommendation_service.get_topk_uid, dataset_name, model_name + ".pth", k, uid, use_ann))
+
+# Model checks score at most this many sampled users per request.
+check_max_sample_size = int(os.environ.get("RECVIZ_CHECK_MAX_SAMPLE", "10000"))
+
+def request_sample_size(request):
+    sample_size = int(request.GET.get("sample_size", 1000))
+    if sample_size < 1:
+        raise ValueError("sample_size must be positive")
+    return min(sample_size, check_max_sample_size)
+
+@offloaded
+async def get_ranking_agreement(request, dataset_name, model_name, k):
+    try:
+        sample_size = request_sample_size(request)
+    except ValueError:
+        return JsonResponse({"error": "sample_size must be a positive integer"}, status=400)
+    return JsonResponse(await model_pool.run(recommendation_service.check_ranking_agreement, dataset_name, model_name + ".pth", k, sample_size))
+
+@offloaded
+async def get_ann_recall(request, dataset_name, model_name, k):
+    try:
+        sample_size = request_sample_size(request)
+    except ValueError:
+        return JsonResponse({"error": "sample_size must be a positive integer"}, status=400)
+    return JsonResponse(await model_pool.run(recommendation_service.check_ann_recall, dataset_name, model_name + ".pth", k, sample_size))
+
+# compare_models lists at most this many of its most divergent users.
+compare_max_top = int(os.environ.get("RECVIZ_COMPARE_MAX_TOP", "1000"))
+
+@offloaded
+async def compare_models(request, dataset_name, model1, model2, k):
+    try:
+        top = int(request.GET.get("top", 20))
+    except ValueError:
+        return JsonResponse({"error": "top must be an integer"}, status=400)
+    if top < 0:
+        return JsonResponse({"error": "top must not be negative"}, status=400)
+    top = min(top, compare_max_top)
     dsm_entry = dataset_manager.get_dataset(dataset_name)
-    if dsm_entry and dsm_entry["dataset_obj"].get_validity():
-        dataset_obj = dsm_entry["dataset_obj"]
-        user_mapping = dataset_obj.get_user_mapping()
-
-        if uid1 in user_mapping and uid2 in user_mapping:
-            user1_history = [str(elt) for elt in user_mapping[uid1]["interaction_history"]]
-            user1_history_ids = [str(elt['item_id']) for elt in user_mapping[uid1]["interaction_history"]]
-            user2_history = [str(elt) for elt in user_mapping[uid2]["interaction_history"]]
-            user2_history_ids = [str(elt['item_id']) for elt in user_mapping[uid2]["interaction_history"]]
-
-    if user1_history and user2_history:
-        results = {
-            "overlap_recs": similarity_service.overlap_coefficient(user1_recs, user2_recs),
-            "sorenson_recs": similarity_service.sorenson_dice(user1_recs, user2_recs),
-            "jaccard_recs": similarity_service.jaccard(user1_recs, user2_recs),
-            "cosine_recs": similarity_service.list_cosine(user1_recs, user2_recs),
-            "overlap_hist": similarity_service.overlap_coefficient(user1_history, user2_history),
-            "sorenson_hist": similarity_service.sorenson_dice(user1_history, user2_history),
-            "jaccard_hist": similarity_service.jaccard(user1_history, user2_history),
-            "cosine_hist": similarity_service.list_cosine(user1_history, user2_history),
-            "overlap_rh1": similarity_service.overlap_coefficient(user1_history_ids, user1_rec_ids),
-            "sorenson_rh1": similarity_service.sorenson_dice(user1_history_ids, user1_rec_ids),
-            "jaccard_rh1": similarity_service.jaccard(user1_history_ids, user1_rec_ids),
-            "cosine_rh1": similarity_service.list_cosine(user1_history_ids, user1_rec_ids),
-            "overlap_rh2": similarity_service.overlap_coefficient(user2_history_ids, user2_rec_ids),
-            "sorenson_rh2": similarity_service.sorenson_dice(user2_history_ids, user2_rec_ids),
-            "jaccard_rh2": similarity_service.jaccard(user2_history_ids, user2_rec_ids),
-            "cosine_rh2": similarity_service.list_cosine(user2_history_ids, user2_rec_ids),
-            "overlap_rg1": similarity_service.overlap_coefficient(user1_history_ids[-k:], user1_rec_ids),
-            "sorenson_rg1": similarity_service.sorenson_dice(user1_history_ids[-k:], user1_rec_ids),
-            "jaccard_rg1": similarity_service.jaccard(user1_history_ids[-k:], user1_rec_ids),
-            "cosine_rg1": similarity_service.list_cosine(user1_history_ids[-k:], user1_rec_ids),
-            "overlap_rg2": similarity_service.overlap_coefficient(user2_history_ids[-k:], user2_rec_ids),
-            "sorenson_rg2": similarity_service.sorenson_dice(user2_history_ids[-k:], user2_rec_ids),
-            "jaccard_rg2": similarity_service.jaccard(user2_history_ids[-k:], user2_rec_ids),
-            "cosine_rg2": similarity_service.list_cosine(user2_history_ids[-k:], user2_rec_ids),
+    if not dsm_entry or not dsm_entry["dataset_obj"].get_validity():
+        return JsonResponse({"error": "Dataset not found"}, status=404)
+    user_ids = dsm_entry["dataset_obj"].get_user_ids()
+    recs_1 = await model_pool.run(recommendation_service.get_topk_tokens, dataset_name, model1 + ".pth", k, user_ids)
+    recs_2 = await model_pool.run(recommendation_service.get_topk_tokens, dataset_name, model2 + ".pth", k, user_ids)
+    metrics = await similarity_pool.run(similarity_service.topk_agreement, recs_1, recs_2)
+
+    distributions = {}
+    for metric_name in ["overlap_coefficient", "jaccard", "sorenson"]:
+        distributions[metric_name] = similarity_service.summarize_distribution(metrics[metric_name])
+    distributions["rank_correlation"] = similarity_service.summarize_distribution(metrics["rank_correlation"], (-1, 1))
+
+    divergent = numpy.lexsort((metrics["rank_correlation"], metrics["jaccard"]))[:top]
+    most_divergent = [
+        {
+            "user": f"user-{user_ids[idx]}",
+            "overlap": int(metrics["overlap"][idx]),
+            "jaccard": float(metrics["jaccard"][idx]),
+            "sorenson": float(metrics["sorenson"][idx]),
+            "rank_correlation": float(metrics["rank_correlation"][idx]),
+            "recs_1": recs_1[idx].tolist(),
+            "recs_2": recs_2[idx].tolist(),
         }
-        return JsonResponse(results)
-    else:
+        for idx in divergent
+    ]
+    return JsonResponse({"users": len(user_ids), "k": k, "distributions": distributions, "most_divergent": most_divergent})
+
+@offloaded
+async def evaluate_model(request, dataset_name, model_name, k):
+    try:
+        n = int(request.GET.get("n", 1))
+    except ValueError:
+        return JsonResponse({"error": "n must be an integer"}, status=400)
+    if n < 1:
+        return JsonResponse({"error": "n must be at least 1"}, status=400)
+    group_by = request.GET.get("group_by")
+    bins = request.GET.getlist("bins")
+    result = await model_pool.run(evaluation_service.evaluate, dataset_name, model_name + ".pth", k, n, group_by, bins)
+    if result is None:
+        return JsonResponse({"error": "Dataset or model not found"}, status=404)
+    return JsonResponse(result)
+
+@offloaded
+async def get_cohort_similarity(request, dataset_name):
+    metric = request.GET.get("metric", "jaccard")
+    uids = request.GET.getlist("uid")
+    if metric not in batch_metrics:
+        return JsonResponse({"error": f"Unsupported similarity metric: {metric}"}, status=400)
+    dsm_entry = dataset_manager.get_dataset(dataset_name)
+    if not dsm_entry or not dsm_entry["dataset_obj"].get_validity():
+        return JsonResponse({"error": "Dataset not found"}, status=404)
+    try:
+        matrix = await similarity_pool.run(similarity_service.cohort_similarity, dataset_name, metric, uids)
+    except KeyError as e:
+        return JsonResponse({"error": f"Unknown user {e}"}, status=404)
+    return JsonResponse({"metric": metric, "users": uids, "similarity": matrix.tolist()})
+
+@offloaded
+async def get_similar_users(request, dataset_name, uid, n):
+    metric = request.GET.get("metric", "jaccard")
+    if metric == "cosine":
+        metric = "list_cosine"
+    try:
+        neighbours = await similarity_pool.run(similarity_service.most_similar_users, dataset_name, uid, n, metric)
+    except KeyError:
+        return JsonResponse({"error": "User not found"}, status=404)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    return JsonResponse({"metric": metric, "uid": uid, "neighbours": neighbours})
+
+metric_prefixes = {
+    "overlap": "overlap_coefficient",
+    "sorenson": "sorenson_dice",
+    "jaccard": "jaccard",
+    "cosine": "list_cosine",
+}
+comparison_pairs = ["recs", "hist", "rh1", "rh2", "rg1", "rg2"]
+
+def requested_similarity_metrics(request):
+    # ?metrics= takes metric families (jaccard) or single results (jaccard_recs); all by default.
+    return selected_similarity_metrics([value for entry in request.GET.getlist("metrics") for value in entry.split(",") if value])
+
+def selected_similarity_metrics(requested):
+    known = set(metric_prefixes) | set(comparison_pairs) | {f"{prefix}_{pair}" for prefix in metric_prefixes for pair in comparison_pairs}
+    unknown = sorted(set(requested) - known)
+    if unknown:
+        raise ValueError(f"Unknown similarity metrics: {', '.join(unknown)}")
+    selected = {}
+    for pair in comparison_pairs:
+        for prefix, metric in metric_prefixes.items():
+            key = f"{prefix}_{pair}"
+            if not requested or prefix in requested or pair in requested or key in requested:
+                selected.setdefault(pair, []).append(metric)
+    return selected
+
+def recommendation_lists(history_ids_1, history_ids_2, preds_1, preds_2, k):
+    # The lists compared for each recommendation metric; preds are [title, node id, score] entries.
+    rec_ids_1 = [str(item_id).split('-')[-1] for title, item_id, rating in preds_1]
+    rec_ids_2 = [str(item_id).split('-')[-1] for title, item_id, rating in preds_2]
+    return {
+        "recs": ([title for title, item_id, rating in preds_1], [title for title, item_id, rating in preds_2]),
+        "rh1": (history_ids_1, rec_ids_1),
+        "rh2": (history_ids_2, rec_ids_2),
+        "rg1": (history_ids_1[-k:], rec_ids_1),
+        "rg2": (history_ids_2[-k:], rec_ids_2),
+    }
+
+def similarity_results(lists, selected):
+    results = {}
+    for pair in comparison_pairs:
+        if pair in selected and pair in lists:
+            suite = similarity_service.metric_suite(*lists[pair], selected[pair])
+            for prefix, metric in metric_prefixes.items():
+                if metric in suite:
+                    results[f"{prefix}_{pair}"] = suite[metric]
+    return results
+
+@offloaded
+async def calculate_user_similarity_metrics(request, dataset_name, model1, model2, k, uid1, uid2):
+    try:
+        selected = requested_similarity_metrics(request)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    dsm_entry = dataset_manager.get_dataset(dataset_name)
+    if not dsm_entry or not dsm_entry["dataset_obj"].get_validity():
+        return JsonResponse({})
+    history_1 = dsm_entry["dataset_obj"].get_user_history(uid1)
+    history_2 = dsm_entry["dataset_obj"].get_user_history(uid2)
+    if not history_1 or not history_2:
         return JsonResponse({})
 
+    lists = {}
+    if selected.keys() - {"hist"}:
+        recs_1 = await model_pool.run(recommendation_service.get_topk_uid, dataset_name, model1 + ".pth", k, uid1)
+        recs_2 = await model_pool.run(recommendation_service.get_topk_uid, dataset_name, model2 + ".pth", k, uid2)
+        lists.update(recommendation_lists([str(elt['item_id']) for elt in history_1], [str(elt['item_id']) for elt in history_2],
+                                          next(iter(recs_1.values())), next(iter(recs_2.values())), k))
+    if "hist" in selected:
+        # Whole interaction records are compared, as tuples of their field values.
+        lists["hist"] = ([tuple(elt.values()) for elt in history_1], [tuple(elt.values()) for elt in history_2])
+
+    with timed("similarity_metrics"):
+        results = similarity_results(lists, selected)
+    return JsonResponse(results)
+
+# Pairs of a batch are scored this many at a time; each chunk is streamed back as soon as it is done.
+similarity_batch_chunk = 256
+similarity_batch_max_pairs = int(os.environ.get("RECVIZ_SIMILARITY_BATCH_MAX", "100000"))
+# Random walk scores and a graph edit distance search per pair make graph_metrics batches far slower.
+similarity_batch_graph_max_pairs = int(os.environ.get("RECVIZ_SIMILARITY_BATCH_GRAPH_MAX", "200"))
+
+def score_similarity_chunk(dataset_name, pairs, model_pairs, topk, k, selected, graph_metrics, time_budget):
+    # One row per pair and model pair with the same keys as calculate_user_similarity_metrics (plus the
+    # random walk and edit distance results with graph_metrics). Per-user lists are built once per chunk.
+    dataset_obj = dataset_manager.get_dataset(dataset_name)["dataset_obj"]
+    histories = {}
+    history_ids = {}
+    titles = {}
+    rows = []
+    with timed("similarity_metrics"):
+        for uid1, uid2 in pairs:
+            for uid in (uid1, uid2):
+                if uid not in histories:
+                    histories[uid] = dataset_obj.get_user_history(uid)
+            history_1 = histories[uid1]
+            history_2 = histories[uid2]
+            if not history_1 or not history_2:
+                rows.append({"uid1": uid1, "uid2": uid2, "error": "Missing/empty interaction history"})
+                continue
+            for uid, history in [(uid1, history_1), (uid2, history_2)]:
+                if uid not in history_ids:
+                    history_ids[uid] = [str(elt['item_id']) for elt in history]
+            shared = {}
+            if "hist" in selected:
+                shared.update(similarity_results({"hist": ([tuple(elt.values()) for elt in history_1],
+                                                           [tuple(elt.values()) for elt in history_2])}, selected))
+            if graph_metrics:
+                for uid in (uid1, uid2):
+                    if uid not in titles:
+                        titles[uid] = get_user_interaction_history(dataset_name, uid)
+                scores = similarity_service.random_walk_similarity(dataset_name, uid1, uid2)
+                if scores is None:
+                    # Checked before streaming, so only an index dropped by ingestion since then gets here.
+                    raise PoolBusy("The random walk index is being rebuilt, retry shortly")
+                shared.update(scores)
+                shared["edit_distance"] = get_user_edit_distance(titles[uid1], uid1, titles[uid2], uid2, time_budget)
+            if not model_pairs:
+                rows.append({"uid1": uid1, "uid2": uid2, **shared})
+            for model1, model2 in model_pairs:
+                row = {"uid1": uid1, "uid2": uid2, "model1": model1, "model2": model2}
+                if selected.keys() - {"hist"}:
+                    preds_1 = topk[model1].get(uid1)
+                    preds_2 = topk[model2].get(uid2)
+                    if preds_1 is None or preds_2 is None:
+                        rows.append({**row, "error": "User unknown to the model"})
+                        continue
+                    row.update(similarity_results(recommendation_lists(history_ids[uid1], history_ids[uid2], preds_1, preds_2, k),
+                                                  selected))
+                rows.append({**row, **shared})
+    return rows
+
+@csrf_exempt
+@require_POST
+@offloaded
+async def batch_user_similarity_metrics(request, dataset_name):
+    # {"pairs": [[uid1, uid2]], "models": [[model1, model2]], "k": 10, "metrics": [...], "graph_metrics": false}
+    # answers with one JSON line per pair and model pair, in request order.
+    try:
+        body = json.loads(request.body)
+        pairs = [(str(uid1), str(uid2)) for uid1, uid2 in body["pairs"]]
+        model_pairs = [(str(model1), str(model2)) for model1, model2 in body.get("models", [])]
+        k = int(body.get("k", 10))
+        metrics = body.get("metrics", [])
+        requested = [value for value in metrics.split(",") if value] if isinstance(metrics, str) else [str(value) for value in metrics]
+        graph_metrics = bool(body.get("graph_metrics", False))
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return JsonResponse({"error": "Body must be a JSON object with a list of [uid1, uid2] pairs"}, status=400)
+    try:
+        time_budget = clamped_time_budget(body.get("ged_time_budget", 0.5))
+    except (ValueError, TypeError):
+        return JsonResponse({"error": "ged_time_budget must be a number of seconds"}, status=400)
+    max_pairs = similarity_batch_graph_max_pairs if graph_metrics else similarity_batch_max_pairs
+    if len(pairs) > max_pairs:
+        return JsonResponse({"error": f"At most {max_pairs} pairs per request"}, status=400)
+    try:
+        selected = selected_similarity_metrics(requested)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    if selected.keys() - {"hist"} and not model_pairs:
+        return JsonResponse({"error": "Recommendation metrics need a list of [model1, model2] models"}, status=400)
+    dsm_entry = dataset_manager.get_dataset(dataset_name)
+    if not dsm_entry or not dsm_entry["dataset_obj"].get_validity():
+        return JsonResponse({"error": "Dataset not found"}, status=404)
+    models = dsm_entry["dataset_obj"].get_models()
+    unknown = sorted({model for pair in model_pairs for model in pair if model + ".pth" not in models})
+    if unknown:
+        return JsonResponse({"error": f"Unknown models: {', '.join(unknown)}"}, status=404)
+    if graph_metrics and await similarity_pool.run(similarity_service.get_random_walk_index, dataset_name) is None:
+        return JsonResponse({"status": "pending"}, status=202)
+
+    # Each model scores every user it is asked about once, whatever the number of pairs they appear in.
+    topk = {}
+    if selected.keys() - {"hist"}:
+        wanted = {}
+        for model1, model2 in model_pairs:
+            wanted.setdefault(model1, set()).update(uid1 for uid1, uid2 in pairs)
+            wanted.setdefault(model2, set()).update(uid2 for uid1, uid2 in pairs)
+        for model, uids in wanted.items():
+            topk[model] = await model_pool.run(recommendation_service.get_topk_users, dataset_name, model + ".pth", k, sorted(uids))
+
+    async def ndjson_rows():
+        for start in range(0, len(pairs), similarity_batch_chunk):
+            try:
+                rows = await similarity_pool.run(score_similarity_chunk, dataset_name, pairs[start:start + similarity_batch_chunk],
+                                                 model_pairs, topk, k, selected, graph_metrics, time_budget)
+            except PoolBusy as e:
+                yield json.dumps({"error": str(e)}) + "\n"
+                return
+            except Exception as e:
+                # The response has already started, so the failure ends the stream as an error row.
+                print("SIMILARITY BATCH FAILED:", e)
+                yield json.dumps({"error": f"Scoring failed: {e}"}) + "\n"
+                return
+            yield "".join(json.dumps(row) + "\n" for row in rows)
+
+    return StreamingHttpResponse(ndjson_rows(), content_type="application/x-ndjson")
+
 def get_user_interaction_history(dataset_name, uid):
     dsm_entry = dataset_manager.get_dataset(dataset_name)
     result = []
     if dsm_entry and dsm_entry["dataset_obj"].get_validity():
         dataset_obj = dsm_entry["dataset_obj"]
-        user_mapping = dataset_obj.get_user_mapping()
-        item_mapping = dataset_obj.get_item_mapping()
-        uid = str(uid)
-        if uid in user_mapping:
-            user = user_mapping[uid]
-            if "interaction_history" in user:
-                for elt in user["interaction_history"]:
-                    result.append(item_mapping.get(elt["item_id"], {}).get("movie_title", f"Unknown ID {elt["item_id"]}"))
+        row = dataset_obj.get_user_index().get(str(uid))
+        if row is not None:
+            history_index = dataset_obj.get_history_index()
+            result = history_index.titles_of(history_index.entries(row))
     return result
 
-# def get_user_edit_distance(dataset_name, history1, uid1, history2, uid2):
-#     G1 = nx.Graph()
-#     user_node = f"user_{uid1}"
-#     G1.add_node(user_node, type="user")
-#     for interacted in history1:
-#         if not G1.has_node(interacted):
-#             G1.add_node(interacted, type="item")
-#         G1.add_edge(user_node, interacted)
-#
-#     G2 = nx.Graph()
-#     user_node = f"user_{uid2}"
-#     G2.add_node(user_node, type="user")
-#     for interacted in history2:
-#         if not G2.has_node(interacted):
-#             G2.add_node(interacted, type="item")
-#         G2.add_edge(user_node, interacted)
-#
-#     paths, ged = nx.optimal_edit_paths(G1, G2)
-#
-#     return ged
-
-def get_user_panther_similarity(dataset_name, history1, uid1, history2, uid2):
-    G = nx.Graph()
-
-    user1_node = f"user_{uid1}"
-    user2_node = f"user_{uid2}"
-    G.add_node(user1_node, type="user")
-    G.add_node(user2_node, type="user")
-
-    for interacted in history1:
-        if not G.has_node(interacted):
-            G.add_node(interacted, type="item")
-        G.add_edge(user1_node, interacted)
-
-    for interacted in history2:
-        if not G.has_node(interacted):
-            G.add_node(interacted, type="item")
-        G.add_edge(user2_node, interacted)
-
-    k_val = len(G.nodes()) - 1
-    random.seed(42)
-    numpy.random.seed(42)
-    sim_dict = nx.panther_similarity(G, user1_node, k=k_val)
-
-    similarity_score = sim_dict.get(user2_node, 0.0)
-    return similarity_score
-
-def get_user_interaction_graph_similarity_metrics(request, dataset_name, uid1, uid2):
+# Longest graph edit distance search a request can ask for, in seconds.
+ged_max_time_budget = float(os.environ.get("RECVIZ_GED_MAX_TIME_BUDGET", "2"))
+
+def clamped_time_budget(value):
+    time_budget = float(value)
+    if not numpy.isfinite(time_budget):
+        raise ValueError(f"Invalid time budget: {value}")
+    return min(max(time_budget, 0.0), ged_max_time_budget)
+
+def get_user_edit_distance(history1, uid1, history2, uid2, time_budget):
+    # User nodes share one label so they substitute for free; items are labelled by their title.
+    graphs = []
+    for uid, history in [(uid1, history1), (uid2, history2)]:
+        G = nx.Graph()
+        user_node = f"user_{uid}"
+        G.add_node(user_node, type="user", label="user")
+        for interacted in history:
+            if not G.has_node(interacted):
+                G.add_node(interacted, type="item", label=interacted)
+            G.add_edge(user_node, interacted)
+        graphs.append(G)
+
+    return similarity_service.bounded_graph_edit_distance(graphs[0], graphs[1], time_budget)
+
+@offloaded
+async def get_user_interaction_graph_similarity_metrics(request, dataset_name, uid1, uid2):
     history1 = get_user_interaction_history(dataset_name, uid1)
     history2 = get_user_interaction_history(dataset_name, uid2)
 
@@ -218,8 +697,25 @@ def get_user_interaction_graph_similarity_metrics(request, dataset_name, uid1, u
     elif not history2:
         return JsonResponse({"error": "Missing/empty interaction history for uid2"})
 
-    return JsonResponse(
-        {
-            "panther_similarity": get_user_panther_similarity(dataset_name, history1, uid1, history2, uid2),
-        }
-    )
\ No newline at end of file
+    try:
+        time_budget = clamped_time_budget(request.GET.get("ged_time_budget", 0.5))
+    except ValueError:
+        return JsonResponse({"error": "ged_time_budget must be a number of seconds"}, status=400)
+    metrics = await similarity_pool.run(similarity_service.random_walk_similarity, dataset_name, uid1, uid2)
+    if metrics is None:
+        return JsonResponse({"status": "pending"}, status=202)
+    metrics["edit_distance"] = await similarity_pool.run(get_user_edit_distance, history1, uid1, history2, uid2, time_budget)
+    return JsonResponse(metrics)
+
+@offloaded
+async def get_random_walk_neighbours(request, dataset_name, uid, n):
+    method = request.GET.get("method", "panther")
+    try:
+        neighbours = await similarity_pool.run(similarity_service.random_walk_neighbours, dataset_name, uid, n, method)
+    except KeyError:
+        return JsonResponse({"error": "User not found"}, status=404)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    if neighbours is None:
+        return JsonResponse({"status": "pending"}, status=202)
+    return JsonResponse({"method": method, "uid": uid, "neighbours": neighbours})
\ No newline at end of file